@@ -1,4 +1,8 @@
 from .module.node import NODE_CLASS_MAPPINGS, NODE_DISPLAY_NAME_MAPPINGS
+from .module.routes import setup_routes
+
+# 注册插件的 HTTP 路由（如任务完成回调）
+setup_routes()
 
 # 导出节点映射供 ComfyUI 加载
 __all__ = ['NODE_CLASS_MAPPINGS', 'NODE_DISPLAY_NAME_MAPPINGS']
@@ -0,0 +1,227 @@
+"""HTTP/1.1 连接池与 HTTP/2 多路复用传输的对比基准
+
+在独立的子进程中启动模拟 DashScope 的服务（HTTP/1.1 使用 aiohttp，HTTP/2 使用基于 h2 的明文 h2c 服务），
+每个服务都模拟网络延迟：提交接口返回 PENDING 的任务，任务在指定时长后变为 SUCCEEDED。
+对每种传输并发提交 N 个任务并轮询到全部完成，统计总耗时、请求延迟和服务端看到的连接数。
+
+依赖：aiohttp、httpx[http2]（包含 h2）
+
+用法：
+    python benchmarks/http2_transport.py --tasks 100 500 1000
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+import argparse
+import importlib.util
+import multiprocessing
+import statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_transport():
+    """不经过 ComfyUI 直接加载插件的 transport 模块"""
+    spec = importlib.util.spec_from_file_location("bailian_plugin", os.path.join(ROOT, "__init__.py"), submodule_search_locations=[ROOT])
+    package = importlib.util.module_from_spec(spec)
+    sys.modules["bailian_plugin"] = package
+    from importlib import import_module
+    return import_module("bailian_plugin.module.transport")
+
+
+class FakeDashScope:
+    """模拟 DashScope 的任务接口：提交后 task_duration 秒任务完成"""
+
+    def __init__(self, latency, task_duration):
+        self.latency = latency
+        self.task_duration = task_duration
+        self.tasks = {}
+        self.peers = set()
+        self.requests = 0
+
+    async def handle(self, method, path):
+        """返回 (状态码, 响应体)"""
+        if path == "/__stats":
+            return 200, {"requests": self.requests, "connections": len(self.peers)}
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        if method == "POST" and path.startswith("/api/v1/services/"):
+            task_id = uuid.uuid4().hex
+            self.tasks[task_id] = time.monotonic() + self.task_duration
+            return 200, {"output": {"task_id": task_id, "task_status": "PENDING"}}
+        if method == "GET" and path.startswith("/api/v1/tasks/"):
+            task_id = path.rsplit("/", 1)[-1]
+            if task_id not in self.tasks:
+                return 404, {"code": "NotFound"}
+            status = "SUCCEEDED" if time.monotonic() >= self.tasks[task_id] else "RUNNING"
+            return 200, {"output": {"task_id": task_id, "task_status": status}}
+        return 404, {"code": "NotFound"}
+
+
+async def start_http1_server(fake):
+    from aiohttp import web
+
+    async def handler(request):
+        # 客户端端口不同即为不同的连接
+        fake.peers.add(request.transport.get_extra_info("peername"))
+        status, body = await fake.handle(request.method, request.path)
+        return web.json_response(body, status=status)
+
+    app = web.Application()
+    app.router.add_route("*", "/{tail:.*}", handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0, backlog=4096)
+    await site.start()
+    port = runner.addresses[0][1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+class H2Protocol(asyncio.Protocol):
+    """最小的 h2c 服务端：每个 stream 独立处理，响应时写回同一个连接"""
+
+    def __init__(self, fake):
+        import h2.config
+        import h2.connection
+
+        self.fake = fake
+        self.connection = h2.connection.H2Connection(config=h2.config.H2Configuration(client_side=False, header_encoding="utf-8"))
+        self.transport = None
+        self.streams = {}
+
+    def connection_made(self, transport):
+        self.fake.peers.add(transport.get_extra_info("peername"))
+        self.transport = transport
+        self.connection.initiate_connection()
+        self.transport.write(self.connection.data_to_send())
+
+    def data_received(self, data):
+        import h2.events
+
+        for event in self.connection.receive_data(data):
+            if isinstance(event, h2.events.RequestReceived):
+                self.streams[event.stream_id] = dict(event.headers)
+            elif isinstance(event, h2.events.DataReceived):
+                self.connection.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+            elif isinstance(event, h2.events.StreamEnded):
+                headers = self.streams.pop(event.stream_id, {})
+                asyncio.ensure_future(self.respond(event.stream_id, headers))
+        self.transport.write(self.connection.data_to_send())
+
+    async def respond(self, stream_id, headers):
+        status, body = await self.fake.handle(headers.get(":method"), headers.get(":path"))
+        payload = json.dumps(body).encode()
+        if self.transport.is_closing():
+            return
+        self.connection.send_headers(stream_id, [
+            (":status", str(status)),
+            ("content-type", "application/json"),
+            ("content-length", str(len(payload))),
+        ])
+        self.connection.send_data(stream_id, payload, end_stream=True)
+        self.transport.write(self.connection.data_to_send())
+
+
+async def start_http2_server(fake):
+    loop = asyncio.get_running_loop()
+    server = await loop.create_server(lambda: H2Protocol(fake), "127.0.0.1", 0, backlog=4096)
+    port = server.sockets[0].getsockname()[1]
+    return server, f"http://127.0.0.1:{port}"
+
+
+async def run_tasks(transport, base_url, task_count, poll_interval):
+    """并发提交 task_count 个任务并轮询到全部完成，返回每个请求的延迟（秒）"""
+    latencies = []
+
+    async def timed(method, url, body=None):
+        start = time.perf_counter()
+        result = await transport.request_json(method, url, headers={"Content-Type": "application/json"}, json=body)
+        latencies.append(time.perf_counter() - start)
+        return result
+
+    async def one_task():
+        submitted = await timed("POST", f"{base_url}/api/v1/services/aigc/image2image/image-synthesis/", {"model": "bench"})
+        task_id = submitted["output"]["task_id"]
+        while True:
+            await asyncio.sleep(poll_interval)
+            result = await timed("GET", f"{base_url}/api/v1/tasks/{task_id}")
+            if result["output"]["task_status"] == "SUCCEEDED":
+                return
+
+    await asyncio.gather(*[one_task() for _ in range(task_count)])
+    return latencies
+
+
+def serve(mode, latency, task_duration, port_queue):
+    """子进程入口：启动模拟服务并一直运行，服务端与客户端不共享 CPU 和事件循环"""
+    async def run():
+        fake = FakeDashScope(latency, task_duration)
+        if mode == "HTTP/2":
+            _, base_url = await start_http2_server(fake)
+        else:
+            _, base_url = await start_http1_server(fake)
+        port_queue.put(base_url)
+        await asyncio.Event().wait()
+
+    asyncio.run(run())
+
+
+async def bench(transport, mode, task_count, base_url, poll_interval):
+    transport.HTTP2 = mode == "HTTP/2"
+    transport.HTTP2_PRIOR_KNOWLEDGE = True
+    transport._http2_available = None
+    try:
+        before = await transport.request_json("GET", f"{base_url}/__stats")
+        start = time.perf_counter()
+        latencies = await run_tasks(transport, base_url, task_count, poll_interval)
+        elapsed = time.perf_counter() - start
+        after = await transport.request_json("GET", f"{base_url}/__stats")
+    finally:
+        await transport.close()
+
+    latencies.sort()
+    return {
+        "mode": mode,
+        "tasks": task_count,
+        "elapsed": elapsed,
+        "requests": after["requests"] - before["requests"],
+        "connections": after["connections"],
+        "p50": statistics.median(latencies) * 1000,
+        "p95": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP/1.1 与 HTTP/2 传输对比基准")
+    parser.add_argument("--tasks", type=int, nargs="+", default=[100, 500, 1000], help="并发任务数")
+    parser.add_argument("--latency", type=float, default=0.05, help="模拟的单次请求服务端延迟（秒）")
+    parser.add_argument("--task-duration", type=float, default=2.0, help="模拟的任务执行时长（秒）")
+    parser.add_argument("--poll-interval", type=float, default=0.5, help="轮询间隔（秒）")
+    parser.add_argument("--pool-limit", type=int, default=100, help="HTTP/1.1 连接池大小")
+    args = parser.parse_args()
+
+    transport = load_transport()
+    transport.POOL_LIMIT = args.pool_limit
+
+    print(f"{'传输':<10}{'任务数':>8}{'总耗时(s)':>12}{'请求数':>10}{'连接数':>10}{'p50(ms)':>10}{'p95(ms)':>10}")
+    for task_count in args.tasks:
+        for mode in ("HTTP/1.1", "HTTP/2"):
+            # 每次测量使用新的服务进程，连接数从零开始统计
+            port_queue = multiprocessing.Queue()
+            server = multiprocessing.Process(target=serve, args=(mode, args.latency, args.task_duration, port_queue), daemon=True)
+            server.start()
+            try:
+                base_url = port_queue.get(timeout=30)
+                result = asyncio.run(bench(transport, mode, task_count, base_url, args.poll_interval))
+            finally:
+                server.terminate()
+                server.join()
+            print(f"{result['mode']:<10}{result['tasks']:>8}{result['elapsed']:>12.2f}{result['requests']:>10}"
+                  f"{result['connections']:>10}{result['p50']:>10.1f}{result['p95']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
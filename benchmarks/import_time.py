@@ -0,0 +1,92 @@
+"""插件加载耗时基准
+
+在独立的子进程中导入插件（与 ComfyUI 加载 custom_nodes 的方式相同），统计导入耗时，
+以及加载过程中是否引入了 aiohttp、requests、torch、numpy、PIL 等重量级模块。
+
+用法：
+    python benchmarks/import_time.py                 # 测量当前工作区
+    python benchmarks/import_time.py --ref HEAD~1    # 同时测量某个 git 版本，对比前后差异
+"""
+import os
+import sys
+import argparse
+import tempfile
+import subprocess
+import statistics
+
+
+HEAVY_MODULES = ("aiohttp", "requests", "torch", "numpy", "PIL", "comfy")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_IMPORT_SCRIPT = """
+import sys, time, importlib.util
+start = time.perf_counter()
+spec = importlib.util.spec_from_file_location("bailian_plugin", {init!r}, submodule_search_locations=[{root!r}])
+module = importlib.util.module_from_spec(spec)
+sys.modules["bailian_plugin"] = module
+spec.loader.exec_module(module)
+print("ELAPSED", (time.perf_counter() - start) * 1000)
+print("NODES", len(module.NODE_CLASS_MAPPINGS))
+print("LOADED", ",".join(sorted({{name.split(".")[0] for name in sys.modules}} & set({heavy!r}))))
+"""
+
+
+def measure_once(root):
+    """导入一次插件，返回 (导入耗时 ms, 注册的节点数, 已加载的重量级模块)；导入失败时抛出 RuntimeError"""
+    script = _IMPORT_SCRIPT.format(init=os.path.join(root, "__init__.py"), root=root, heavy=HEAVY_MODULES)
+    result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, cwd=tempfile.gettempdir())
+    if result.returncode != 0:
+        last_line = result.stderr.strip().splitlines()[-1] if result.stderr.strip() else ""
+        raise RuntimeError(f"导入失败: {last_line}")
+
+    elapsed, nodes, loaded = 0.0, 0, []
+    for line in result.stdout.splitlines():
+        if line.startswith("ELAPSED "):
+            elapsed = float(line.split()[1])
+        elif line.startswith("NODES "):
+            nodes = int(line.split()[1])
+        elif line.startswith("LOADED "):
+            loaded = [name for name in line[len("LOADED "):].split(",") if name]
+    return elapsed, nodes, loaded
+
+
+def measure(root, repeat):
+    samples = []
+    nodes, loaded = 0, []
+    for _ in range(repeat):
+        elapsed, nodes, loaded = measure_once(root)
+        samples.append(elapsed)
+    return statistics.median(samples), min(samples), nodes, loaded
+
+
+def export_ref(ref):
+    """把指定 git 版本导出到临时目录"""
+    target = tempfile.mkdtemp(prefix="bailian-import-")
+    archive = subprocess.run(["git", "-C", ROOT, "archive", ref], capture_output=True, check=True)
+    subprocess.run(["tar", "-x", "-C", target], input=archive.stdout, check=True)
+    return target
+
+
+def report(label, root, repeat):
+    try:
+        median, best, nodes, loaded = measure(root, repeat)
+    except RuntimeError as e:
+        print(f"{label:<12} {str(e)}")
+        return
+    print(f"{label:<12} 中位数 {median:8.1f} ms  最快 {best:8.1f} ms  节点 {nodes:<3} 重量级模块: {', '.join(loaded) or '无'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="插件加载耗时基准")
+    parser.add_argument("--ref", help="对比的 git 版本，如 HEAD~1")
+    parser.add_argument("--repeat", type=int, default=5, help="每个版本重复测量的次数")
+    args = parser.parse_args()
+
+    if args.ref:
+        report(args.ref, export_ref(args.ref), args.repeat)
+    report("工作区", ROOT, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+"""本地 CPU 路径的微基准，与基线对比检查性能回退
+
+覆盖 utils 的图片转换（pil2tensor、tensor2pil、pil2comfy、padimage，多种尺寸和批次大小）、
+JSON 键值提取器/修改器（10KB ~ 10MB 的响应）和日志格式化（ColoredFormatter.format）。
+每个用例在独立的子进程中执行，互不影响内存统计：
+- 吞吐量：timeit 自动确定循环次数，重复多轮取最快一轮，单位为次/秒
+- 峰值内存：用例执行期间进程常驻内存峰值（ru_maxrss）相对准备完成时的增量，包括 torch/numpy 的分配
+
+不需要网络和 GPU（torch 使用 CPU）；缺少 torch、numpy 或 PIL 时跳过对应的用例。
+
+用法：
+    python benchmarks/micro.py --save                    # 测量并写入基线 benchmarks/micro_baseline.json
+    python benchmarks/micro.py                           # 测量并与基线对比，有回退时退出码为 1
+    python benchmarks/micro.py --filter json --repeat 7  # 只运行名称包含 json 的用例
+    python benchmarks/micro.py --max-slowdown 0.1 --max-memory-growth 0.2
+"""
+import os
+import sys
+import json
+import time
+import timeit
+import fnmatch
+import argparse
+import platform
+import subprocess
+import importlib.util
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(ROOT, "benchmarks", "micro_baseline.json")
+
+IMAGE_SIZES = ((512, 512), (1024, 1024), (2048, 2048))
+BATCH_SIZES = (1, 4)
+JSON_SIZES = (("10KB", 10 * 1024), ("1MB", 1024 * 1024), ("10MB", 10 * 1024 * 1024))
+
+# 峰值内存的增量低于这个值（MB）时不判断回退，避免测量噪声
+_MEMORY_NOISE_MB = 2.0
+
+
+class Skip(Exception):
+    """用例依赖的模块不可用"""
+    pass
+
+
+def load_module(name):
+    """不经过 ComfyUI 直接加载插件的子模块"""
+    if "bailian_plugin" not in sys.modules:
+        spec = importlib.util.spec_from_file_location("bailian_plugin", os.path.join(ROOT, "__init__.py"), submodule_search_locations=[ROOT])
+        sys.modules["bailian_plugin"] = importlib.util.module_from_spec(spec)
+    from importlib import import_module
+    return import_module(f"bailian_plugin.module.{name}")
+
+
+def require(*modules):
+    """导入用例依赖的模块（导入本身不计入内存增量），缺少时跳过"""
+    from importlib import import_module
+    for module in modules:
+        try:
+            import_module(module)
+        except ImportError:
+            raise Skip(f"缺少 {module}")
+
+
+def _images(width, height, count):
+    import numpy as np
+    from PIL import Image
+    rng = np.random.default_rng(0)
+    return [Image.fromarray(rng.integers(0, 256, (height, width, 3), dtype=np.uint8)) for _ in range(count)]
+
+
+def _response_json(size):
+    """模拟百炼任务结果：大小约为 size 字节的嵌套 JSON"""
+    results = []
+    data = {"request_id": "0" * 32, "output": {"task_id": "0" * 36, "task_status": "SUCCEEDED", "results": results}, "usage": {"image_count": 0}}
+    index = 0
+    while len(json.dumps(data, ensure_ascii=False)) < size:
+        for _ in range(max(1, (size - len(json.dumps(data))) // 200)):
+            results.append({
+                "url": f"https://dashscope-result.oss-cn-beijing.aliyuncs.com/1d/{index:08d}.png?Expires=1700000000&Signature=abc",
+                "index": index,
+                "metadata": {"width": 1024, "height": 1024, "seed": index * 7919},
+            })
+            index += 1
+    data["usage"]["image_count"] = index
+    return json.dumps(data, ensure_ascii=False)
+
+
+# 每个用例返回一个无参函数，调用一次为一次操作；准备工作（生成图片、JSON）不计入测量
+
+def case_pil2tensor(width, height, batch):
+    require("torch", "numpy", "PIL")
+    utils = load_module("utils")
+    images = _images(width, height, batch)
+    return lambda: [utils.pil2tensor(image, "cpu") for image in images]
+
+
+def case_tensor2pil(width, height, batch):
+    require("torch", "numpy", "PIL")
+    utils = load_module("utils")
+    tensors = [utils.pil2comfy(image)[0] for image in _images(width, height, batch)]
+    return lambda: [utils.tensor2pil(tensor) for tensor in tensors]
+
+
+def case_pil2comfy(width, height, batch):
+    require("torch", "numpy", "PIL")
+    utils = load_module("utils")
+    images = _images(width, height, batch)
+    return lambda: [utils.pil2comfy(image) for image in images]
+
+
+def case_padimage(width, height, batch):
+    require("PIL", "numpy")
+    utils = load_module("utils")
+    # 尺寸不是 8 的倍数时才需要填充
+    images = _images(width - 3, height - 5, batch)
+    return lambda: [utils.padimage(image) for image in images]
+
+
+def case_json_extract(size):
+    node = load_module("node")
+    extractor = node.MaletteJSONExtractor()
+    payload = _response_json(size)
+    return lambda: extractor.extract(payload, "output.results.0.url")
+
+
+def case_json_modify(size):
+    node = load_module("node")
+    modifier = node.MaletteJSONModifier()
+    payload = _response_json(size)
+    return lambda: modifier.modify(payload, "output.task_status", "FAILED", "string")
+
+
+def case_log_format(batch):
+    import logging
+    colored_formatter = load_module("logging").ColoredFormatter
+    formatter = colored_formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    records = [
+        logging.LogRecord("AIWorkflowEngine", logging.INFO, __file__, 1, f"[BailianAPI] 轮询任务状态: {index:036d}", None, None)
+        for index in range(batch)
+    ]
+    return lambda: [formatter.format(record) for record in records]
+
+
+def cases():
+    """所有用例：名称 -> (函数名, 参数)"""
+    result = {}
+    for function in ("pil2tensor", "tensor2pil", "pil2comfy", "padimage"):
+        for width, height in IMAGE_SIZES:
+            for batch in BATCH_SIZES:
+                result[f"utils.{function}[{width}x{height}x{batch}]"] = (f"case_{function}", (width, height, batch))
+    for label, size in JSON_SIZES:
+        result[f"json.extract[{label}]"] = ("case_json_extract", (size,))
+        result[f"json.modify[{label}]"] = ("case_json_modify", (size,))
+    result["logging.format[1000]"] = ("case_log_format", (1000,))
+    return result
+
+
+def _max_rss_mb():
+    """进程常驻内存峰值（MB），平台不支持时返回 None"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位为 KB，macOS 为字节
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def run_case(name, repeat):
+    """在当前进程中执行一个用例，返回结果字典"""
+    function_name, args = cases()[name]
+    try:
+        operation = globals()[function_name](*args)
+    except Skip as e:
+        return {"skipped": str(e)}
+    # 插件的日志和 pil2tensor 的 print 不计入输出
+    sys.stdout = open(os.devnull, "w")
+    logger = load_module("logging").logger
+    for handler in logger.handlers:
+        handler.setStream(sys.stdout)
+
+    rss_before = _max_rss_mb()
+    timer = timeit.Timer(operation)
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat=repeat, number=number)) / number
+    rss_after = _max_rss_mb()
+    return {
+        "ops_per_sec": 1.0 / best,
+        "seconds_per_op": best,
+        "peak_memory_mb": max(0.0, rss_after - rss_before) if rss_before is not None else None,
+    }
+
+
+def measure(name, repeat):
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--run-case", name, "--repeat", str(repeat)],
+        capture_output=True, text=True, cwd=ROOT,
+    )
+    if result.returncode != 0:
+        last_line = result.stderr.strip().splitlines()[-1] if result.stderr.strip() else ""
+        return {"error": last_line}
+    return json.loads(result.stderr.strip().splitlines()[-1])
+
+
+def compare(name, current, baseline, max_slowdown, max_memory_growth):
+    """返回回退说明的列表，没有回退时为空"""
+    regressions = []
+    if "ops_per_sec" not in current or "ops_per_sec" not in baseline:
+        return regressions
+    if current["ops_per_sec"] < baseline["ops_per_sec"] * (1 - max_slowdown):
+        regressions.append(f"吞吐量 {baseline['ops_per_sec']:.1f} -> {current['ops_per_sec']:.1f} 次/秒")
+    if current["peak_memory_mb"] is None or baseline["peak_memory_mb"] is None:
+        return regressions
+    memory_limit = max(baseline["peak_memory_mb"] * (1 + max_memory_growth), baseline["peak_memory_mb"] + _MEMORY_NOISE_MB)
+    if current["peak_memory_mb"] > memory_limit:
+        regressions.append(f"峰值内存 {baseline['peak_memory_mb']:.1f} -> {current['peak_memory_mb']:.1f} MB")
+    return regressions
+
+
+def describe(result):
+    if "skipped" in result:
+        return f"跳过（{result['skipped']}）"
+    if "error" in result:
+        return f"出错: {result['error']}"
+    memory = f"+{result['peak_memory_mb']:.1f} MB" if result["peak_memory_mb"] is not None else "未知"
+    return f"{result['ops_per_sec']:12.1f} 次/秒  {result['seconds_per_op'] * 1000:10.3f} ms/次  峰值内存 {memory}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 CPU 路径的微基准")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="基线文件路径")
+    parser.add_argument("--save", action="store_true", help="把本次结果写入基线文件")
+    parser.add_argument("--filter", default="*", help="只运行名称匹配的用例（通配符，或名称中包含的字符串）")
+    parser.add_argument("--repeat", type=int, default=5, help="每个用例重复测量的轮数")
+    parser.add_argument("--max-slowdown", type=float, default=0.2, help="吞吐量低于基线的比例超过该值时视为回退")
+    parser.add_argument("--max-memory-growth", type=float, default=0.25, help="峰值内存高于基线的比例超过该值时视为回退")
+    parser.add_argument("--run-case", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        # 子进程：结果写到 stderr 的最后一行，stdout 被重定向丢弃
+        result = run_case(args.run_case, args.repeat)
+        sys.stderr.write(json.dumps(result) + "\n")
+        return
+
+    # 用例名称本身带有方括号，先按包含的字符串匹配，再按通配符匹配
+    names = [name for name in cases() if args.filter in name or fnmatch.fnmatch(name, args.filter)]
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f).get("results", {})
+
+    results = {}
+    failed = []
+    for name in names:
+        results[name] = measure(name, args.repeat)
+        regressions = compare(name, results[name], baseline.get(name, {}), args.max_slowdown, args.max_memory_growth)
+        print(f"{name:<36} {describe(results[name])}{'  回退: ' + '；'.join(regressions) if regressions else ''}", flush=True)
+        if regressions:
+            failed.append(name)
+
+    if args.save:
+        saved = {"results": {}}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+        # 只更新本次运行的用例，跳过和出错的用例保留原来的基线
+        saved["results"].update({name: result for name, result in results.items() if "ops_per_sec" in result})
+        saved["machine"] = {"python": platform.python_version(), "platform": platform.platform(), "processor": platform.processor()}
+        saved["updated_at"] = time.strftime("%Y-%m-%d %H:%M:%S")
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(saved, f, ensure_ascii=False, indent=2)
+        print(f"基线已写入 {args.baseline}")
+    elif not baseline:
+        print(f"没有找到基线 {args.baseline}，先用 --save 生成")
+    elif failed:
+        print(f"{len(failed)} 个用例出现回退: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
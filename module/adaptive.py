@@ -0,0 +1,190 @@
+import os
+import time
+import threading
+import contextvars
+from collections import deque
+from contextlib import asynccontextmanager
+
+from . import interrupt
+from .deadline import DeadlineExceeded
+from .scheduler import _Waiter, MAX_CONCURRENT_TASKS
+from .lazy import lazy_import
+from .logging import logger
+
+asyncio = lazy_import("asyncio")
+
+
+# 是否按限流反馈自动调整每个接口地址同时在途的任务数（扇出的条目从提交到轮询结束一直占用名额，其他提交只在请求期间占用）
+ENABLED = os.environ.get("BAILIAN_ADAPTIVE_CONCURRENCY", "1").lower() in ("1", "true", "yes", "on")
+# 初始并发数和调整范围，初始值默认与进程级调度器的名额相同，收到限流前不额外限制
+INITIAL_LIMIT = float(os.environ.get("BAILIAN_ADAPTIVE_INITIAL", str(MAX_CONCURRENT_TASKS)))
+MIN_LIMIT = float(os.environ.get("BAILIAN_ADAPTIVE_MIN", "1"))
+MAX_LIMIT = float(os.environ.get("BAILIAN_ADAPTIVE_MAX", "64"))
+# 收到限流（429）或提交耗时突增时并发数乘以这个系数
+DECREASE_FACTOR = float(os.environ.get("BAILIAN_ADAPTIVE_DECREASE", "0.5"))
+# 提交耗时超过基线（指数移动平均）的这个倍数、并且比基线至少多出 MIN_LATENCY_DELTA 秒时视为耗时突增
+LATENCY_FACTOR = float(os.environ.get("BAILIAN_ADAPTIVE_LATENCY_FACTOR", "3"))
+MIN_LATENCY_DELTA = float(os.environ.get("BAILIAN_ADAPTIVE_MIN_LATENCY_DELTA", "0.5"))
+# 提交被限流（429）时退避重试的次数，重试前自适应上限已经下调
+THROTTLE_RETRIES = int(os.environ.get("BAILIAN_ADAPTIVE_THROTTLE_RETRIES", "3"))
+
+# 开始判断耗时突增前至少需要的样本数，以及基线的平滑系数
+_MIN_LATENCY_SAMPLES = 10
+_EWMA_ALPHA = 0.1
+
+# 当前任务已经占用名额的接口地址，其中的提交请求不再重复占用
+_held = contextvars.ContextVar("bailian_adaptive_held", default=frozenset())
+
+
+class AIMDLimiter:
+    """一个接口地址同时在途的任务数的自适应上限（加性增、乘性减）
+
+    名额已经用满时每次提交成功增加 1/limit（约每轮增加 1），收到限流或提交耗时突增时乘以 DECREASE_FACTOR。
+    同一轮中发出的请求接连被限流只减一次：减小之前发出的请求的反馈不再触发减小。
+    下调不会打断已经在途的任务，它们结束后在途数自然降到新的上限以内。
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.limit = min(MAX_LIMIT, max(MIN_LIMIT, INITIAL_LIMIT))
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self._waiters = deque()
+        self._last_decrease = 0.0
+        self._baseline = None
+        self._samples = 0
+        self._stats = {"successes": 0, "throttled": 0, "latency_spikes": 0, "decreases": 0}
+
+    def _dispatch(self):
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if waiter.cancelled:
+                continue
+            self.in_flight += 1
+            if not waiter.grant():
+                self.in_flight -= 1
+
+    def _cancel(self, waiter):
+        with self._lock:
+            if waiter.granted:
+                self.in_flight -= 1
+                self._dispatch()
+            else:
+                waiter.cancelled = True
+
+    async def acquire(self, deadline=None):
+        """异步等待一个名额，等待期间可被 ComfyUI 取消，排队时间计入 deadline"""
+        waiter = _Waiter(self.name, asyncio.get_running_loop())
+        with self._lock:
+            self._waiters.append(waiter)
+            self._dispatch()
+        try:
+            timeout = deadline.remaining() if deadline is not None else None
+            await asyncio.wait_for(interrupt.wait_for(asyncio.shield(waiter.future)), timeout)
+        except asyncio.TimeoutError:
+            self._cancel(waiter)
+            raise DeadlineExceeded(f"等待并发名额时已超出最大等待时间 ({deadline.budget}秒)")
+        except BaseException:
+            self._cancel(waiter)
+            raise
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+            self._dispatch()
+
+    def _decrease(self, started, reason):
+        if started < self._last_decrease:
+            return
+        previous = self.limit
+        self.limit = max(MIN_LIMIT, self.limit * DECREASE_FACTOR)
+        self._last_decrease = time.monotonic()
+        self._stats["decreases"] += 1
+        logger.info(f"[BailianAdaptive] {self.name} {reason}，并发上限 {previous:.1f} -> {self.limit:.1f}")
+
+    def on_success(self, started, latency):
+        """started 时刻发出的提交请求成功，耗时 latency 秒"""
+        with self._lock:
+            self._stats["successes"] += 1
+            spike = (
+                self._samples >= _MIN_LATENCY_SAMPLES
+                and latency > self._baseline * LATENCY_FACTOR
+                and latency - self._baseline > MIN_LATENCY_DELTA
+            )
+            # 突增的样本同样计入基线：持续变慢时基线跟上新的水平，不会一直下调
+            self._baseline = latency if self._baseline is None else self._baseline + _EWMA_ALPHA * (latency - self._baseline)
+            self._samples += 1
+            if spike:
+                self._stats["latency_spikes"] += 1
+                self._decrease(started, f"提交耗时突增 ({latency:.2f}秒，基线 {self._baseline:.2f}秒)")
+                return
+            # 只有上限确实限制了并发时才增加，需求不足时上限不会无限上涨
+            if self.in_flight >= int(self.limit) and self.limit < MAX_LIMIT:
+                self.limit = min(MAX_LIMIT, self.limit + 1.0 / self.limit)
+                self._dispatch()
+
+    def on_throttle(self, started):
+        """started 时刻发出的提交请求被限流（429）"""
+        with self._lock:
+            self._stats["throttled"] += 1
+            self._decrease(started, "收到限流响应")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "limit": round(self.limit, 2),
+                "in_flight": self.in_flight,
+                "queued": len([waiter for waiter in self._waiters if not waiter.cancelled]),
+                "baseline_latency": round(self._baseline, 3) if self._baseline is not None else None,
+                **self._stats,
+            }
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(endpoint):
+    """接口地址对应的并发控制器，在进程内跨节点、跨执行保留"""
+    with _limiters_lock:
+        limiter = _limiters.get(endpoint)
+        if limiter is None:
+            limiter = _limiters[endpoint] = AIMDLimiter(endpoint)
+        return limiter
+
+
+@asynccontextmanager
+async def slot(endpoint, deadline=None):
+    """在 async with 期间占用 endpoint 的一个并发名额，未开启时不限制
+
+    扇出的条目用它包住整个任务（提交到轮询结束），其中的提交请求（包括 refiner 和对冲任务）
+    发现当前任务已经占用了该接口地址的名额时不再重复占用；单独的提交请求只在请求期间占用。
+    """
+    if not ENABLED or endpoint in _held.get():
+        yield
+        return
+    limiter = get_limiter(endpoint)
+    await limiter.acquire(deadline)
+    token = _held.set(_held.get() | {endpoint})
+    try:
+        yield
+    finally:
+        _held.reset(token)
+        limiter.release()
+
+
+def record_success(endpoint, started, latency):
+    if ENABLED:
+        get_limiter(endpoint).on_success(started, latency)
+
+
+def record_throttle(endpoint, started):
+    if ENABLED:
+        get_limiter(endpoint).on_throttle(started)
+
+
+def stats():
+    """每个接口地址当前的并发上限、在途数和反馈统计"""
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {limiter.name: limiter.stats() for limiter in limiters}
@@ -0,0 +1,245 @@
+import os
+import weakref
+import threading
+from urllib.parse import urlparse
+
+from . import transport
+from . import utils
+from .deadline import Deadline
+from .interrupt import InterruptProcessingException
+from .lazy import lazy_import
+from .logging import logger
+
+asyncio = lazy_import("asyncio")
+
+
+# 归档的 OSS bucket，设置后每个试穿结果的图片都会转存一份（需要安装 oss2）
+BUCKET = os.environ.get("BAILIAN_ARCHIVE_BUCKET", "")
+# bucket 所在地域的 OSS 地址，如 https://oss-cn-beijing.aliyuncs.com
+ENDPOINT = os.environ.get("BAILIAN_ARCHIVE_ENDPOINT", "https://oss-cn-beijing.aliyuncs.com")
+ACCESS_KEY_ID = os.environ.get("BAILIAN_ARCHIVE_ACCESS_KEY_ID", os.environ.get("OSS_ACCESS_KEY_ID", ""))
+ACCESS_KEY_SECRET = os.environ.get("BAILIAN_ARCHIVE_ACCESS_KEY_SECRET", os.environ.get("OSS_ACCESS_KEY_SECRET", ""))
+# 对象名前缀，后面是 utils.generate_filename_with_date 生成的 年/月/日/随机名.扩展名
+PREFIX = os.environ.get("BAILIAN_ARCHIVE_PREFIX", "bailian-results/")
+# 分片大小（OSS 要求除最后一片外不小于 100KB），不足一个分片的图片直接 PutObject
+PART_SIZE = int(float(os.environ.get("BAILIAN_ARCHIVE_PART_SIZE_MB", "1")) * 1024 * 1024)
+# 每个转存任务中已下载、等待上传的分片数上限，下载快于上传时暂停读取
+BUFFER_PARTS = int(os.environ.get("BAILIAN_ARCHIVE_BUFFER_PARTS", "2"))
+# 同时进行的转存任务数
+MAX_RELAYS = int(os.environ.get("BAILIAN_ARCHIVE_MAX_RELAYS", "4"))
+# 每个结果转存的最长时间（秒），与节点的等待时间无关
+TIMEOUT = float(os.environ.get("BAILIAN_ARCHIVE_TIMEOUT", "120"))
+
+# 从 HTTP 响应读取的块大小
+_CHUNK_SIZE = 64 * 1024
+
+_CONTENT_TYPES = {"png": "image/png", "jpg": "image/jpeg", "jpeg": "image/jpeg", "webp": "image/webp"}
+
+_store = None
+_store_lock = threading.Lock()
+_semaphores = weakref.WeakKeyDictionary()
+
+
+class OssStore:
+    """阿里云 OSS（oss2 是同步接口，转存时在线程中调用）"""
+
+    def __init__(self, endpoint, bucket, access_key_id, access_key_secret):
+        import oss2
+        self.name = bucket
+        self.bucket = oss2.Bucket(oss2.Auth(access_key_id, access_key_secret), endpoint, bucket)
+
+    def put(self, key, data, content_type):
+        self.bucket.put_object(key, data, headers={"Content-Type": content_type})
+
+    def init(self, key, content_type):
+        return self.bucket.init_multipart_upload(key, headers={"Content-Type": content_type}).upload_id
+
+    def upload_part(self, key, upload_id, number, data):
+        return self.bucket.upload_part(key, upload_id, number, data).etag
+
+    def complete(self, key, upload_id, parts):
+        import oss2
+        self.bucket.complete_multipart_upload(key, upload_id, [oss2.models.PartInfo(number, etag) for number, etag in parts])
+
+    def abort(self, key, upload_id):
+        self.bucket.abort_multipart_upload(key, upload_id)
+
+
+class MemoryStore:
+    """进程内的对象存储，接口与 OssStore 相同，用于本地调试和测试"""
+
+    def __init__(self, name="memory"):
+        self.name = name
+        self.objects = {}
+        self._uploads = {}
+        self._lock = threading.Lock()
+
+    def put(self, key, data, content_type):
+        with self._lock:
+            self.objects[key] = bytes(data)
+
+    def init(self, key, content_type):
+        with self._lock:
+            upload_id = f"{len(self._uploads) + 1}"
+            self._uploads[upload_id] = {}
+            return upload_id
+
+    def upload_part(self, key, upload_id, number, data):
+        with self._lock:
+            self._uploads[upload_id][number] = bytes(data)
+            return f"{upload_id}-{number}"
+
+    def complete(self, key, upload_id, parts):
+        with self._lock:
+            uploaded = self._uploads.pop(upload_id)
+            self.objects[key] = b"".join(uploaded[number] for number, _ in parts)
+
+    def abort(self, key, upload_id):
+        with self._lock:
+            self._uploads.pop(upload_id, None)
+
+
+def get_store():
+    """归档使用的对象存储，未配置时返回 None"""
+    global _store
+    with _store_lock:
+        if _store is None and BUCKET:
+            _store = OssStore(ENDPOINT, BUCKET, ACCESS_KEY_ID, ACCESS_KEY_SECRET)
+        return _store
+
+
+def set_store(store):
+    """替换对象存储（如 MemoryStore），传入 None 时恢复按环境变量配置"""
+    global _store
+    with _store_lock:
+        _store = store
+
+
+def enabled():
+    return _store is not None or bool(BUCKET)
+
+
+def _semaphore():
+    loop = asyncio.get_running_loop()
+    semaphore = _semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _semaphores[loop] = asyncio.Semaphore(MAX_RELAYS)
+    return semaphore
+
+
+class _PartReader:
+    """把 HTTP 响应的块拼成固定大小的分片，内存中最多保留一个分片加一个块"""
+
+    def __init__(self, chunks, size):
+        self._chunks = chunks
+        self._size = size
+        self._buffer = bytearray()
+        self._exhausted = False
+
+    async def next(self):
+        """下一个分片，读完时返回空字节串"""
+        while not self._exhausted and len(self._buffer) < self._size:
+            try:
+                self._buffer += await self._chunks.__anext__()
+            except StopAsyncIteration:
+                self._exhausted = True
+        part = bytes(self._buffer[:self._size])
+        del self._buffer[:self._size]
+        return part
+
+
+async def _upload_parts(store, key, upload_id, queue):
+    """按顺序上传队列中的分片，返回 [(分片号, ETag)]"""
+    parts = []
+    while True:
+        data = await queue.get()
+        if data is None:
+            return parts
+        number = len(parts) + 1
+        parts.append((number, await asyncio.to_thread(store.upload_part, key, upload_id, number, data)))
+
+
+async def _put(queue, data, uploader):
+    """把分片放入队列，上传出错时不再等待队列空出位置，直接抛出上传的错误"""
+    put = asyncio.ensure_future(queue.put(data))
+    await asyncio.wait({put, uploader}, return_when=asyncio.FIRST_COMPLETED)
+    if not put.done():
+        put.cancel()
+        uploader.result()
+
+
+async def relay(url, key, store, deadline=None):
+    """边下载 url 边分片上传到 store 的 key，返回字节数
+
+    下载和上传并行：已下载、等待上传的分片不超过 BUFFER_PARTS 个，上传慢时暂停读取响应（背压），
+    每个转存任务占用的内存与图片大小无关。上传失败或被取消时中止分片上传，不留下未完成的分片。
+    """
+    async with transport.stream("GET", url, deadline=deadline) as response:
+        extension = os.path.splitext(urlparse(url).path)[1].lstrip(".").lower()
+        content_type = response.headers.get("content-type") or _CONTENT_TYPES.get(extension, "application/octet-stream")
+        reader = _PartReader(response.iter_chunks(_CHUNK_SIZE).__aiter__(), PART_SIZE)
+        part = await reader.next()
+        if len(part) < PART_SIZE:
+            await asyncio.to_thread(store.put, key, part, content_type)
+            return len(part)
+
+        upload_id = await asyncio.to_thread(store.init, key, content_type)
+        queue = asyncio.Queue(maxsize=max(1, BUFFER_PARTS))
+        uploader = asyncio.ensure_future(_upload_parts(store, key, upload_id, queue))
+        size = 0
+        try:
+            while part:
+                await _put(queue, part, uploader)
+                size += len(part)
+                part = await reader.next()
+            await _put(queue, None, uploader)
+            parts = await uploader
+            await asyncio.to_thread(store.complete, key, upload_id, parts)
+            return size
+        except BaseException:
+            uploader.cancel()
+            await asyncio.gather(uploader, return_exceptions=True)
+            try:
+                await asyncio.shield(asyncio.to_thread(store.abort, key, upload_id))
+            except Exception as e:
+                logger.info(f"[BailianArchive] 中止分片上传失败: {key} {str(e)}")
+            raise
+
+
+def _result_urls(response_data):
+    output = response_data.get("output", {}) if isinstance(response_data, dict) else {}
+    if output.get("task_status") not in (None, "SUCCEEDED"):
+        return []
+    if output.get("image_url"):
+        return [output["image_url"]]
+    return [result["url"] for result in output.get("results") or [] if isinstance(result, dict) and result.get("url")]
+
+
+async def archive_result(response_data):
+    """把任务的结果图片转存到归档 bucket，在 response_data 中记录 archive（对象地址）或 archive_error
+
+    未配置归档、任务失败时不做任何事；转存失败只记录错误，不影响节点的结果。
+    """
+    if not enabled() or not isinstance(response_data, dict) or "error" in response_data:
+        return
+    urls = _result_urls(response_data)
+    if not urls:
+        return
+    deadline = Deadline(TIMEOUT)
+    archived = []
+    try:
+        store = get_store()
+        async with _semaphore():
+            for url in urls:
+                extension = os.path.splitext(urlparse(url).path)[1].lstrip(".").lower() or "png"
+                key = PREFIX + utils.generate_filename_with_date(extension)
+                size = await relay(url, key, store, deadline)
+                archived.append(f"oss://{store.name}/{key}")
+                logger.info(f"[BailianArchive] 已转存 {key} ({size / 1024:.0f}KB)")
+    except InterruptProcessingException:
+        raise
+    except Exception as e:
+        response_data["archive_error"] = f"转存结果图片失败: {str(e)}"
+        logger.info(f"[BailianArchive] {response_data['archive_error']}")
+    if archived:
+        response_data["archive"] = archived if len(archived) > 1 else archived[0]
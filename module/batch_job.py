@@ -0,0 +1,232 @@
+import os
+import csv
+import json
+import time
+
+from .interrupt import InterruptProcessingException
+from .lazy import lazy_import
+from .logging import logger
+
+asyncio = lazy_import("asyncio")
+
+
+# 输入文件中可以作为人物图片 URL 的字段名
+URL_FIELDS = ("person_image_url", "person_image", "url")
+
+
+# 崩溃时写了一半的最后一行的开头（ResultWriter 写出的每一行都以 index 字段开头）
+_RECORD_PREFIX = b'{"index": '
+
+
+def resolve_path(path, kind):
+    """解析 ComfyUI 的 input/output 目录中的相对路径，脱离 ComfyUI 运行时相对于当前目录
+
+    与 ComfyUI 内置节点一样只允许访问该目录：绝对路径、~ 以及解析后（包括 .. 和符号链接）不在目录中的路径抛出 ValueError。
+    """
+    try:
+        import folder_paths
+        base = folder_paths.get_input_directory() if kind == "input" else folder_paths.get_output_directory()
+    except ImportError:
+        base = os.getcwd()
+    path = path.strip()
+    if not path or os.path.isabs(path) or path.startswith("~"):
+        raise ValueError(f"{kind}_path 必须是 {kind} 目录中的相对路径: {path}")
+    base = os.path.realpath(base)
+    resolved = os.path.realpath(os.path.join(base, path))
+    try:
+        inside = os.path.commonpath((base, resolved)) == base and resolved != base
+    except ValueError:
+        # Windows 上位于不同的盘符
+        inside = False
+    if not inside:
+        raise ValueError(f"{kind}_path 不能指向 {kind} 目录之外: {path}")
+    return resolved
+
+
+def _url_from_record(record):
+    if isinstance(record, str):
+        return record.strip()
+    if isinstance(record, dict):
+        for field in URL_FIELDS:
+            if record.get(field):
+                return str(record[field]).strip()
+    return ""
+
+
+def iter_inputs(path):
+    """逐行读取输入文件，产出 (序号, URL)，不会把整个文件读入内存
+
+    支持 NDJSON（每行一个 URL 字符串或包含 person_image_url/url 字段的对象）、
+    CSV（带表头时按字段名取 URL，否则取第一列）以及每行一个 URL 的纯文本。
+    """
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if path.lower().endswith(".csv"):
+            reader = csv.reader(f)
+            header = None
+            index = 0
+            for row in reader:
+                if not row:
+                    continue
+                if header is None and any(cell.strip() in URL_FIELDS for cell in row):
+                    header = [cell.strip() for cell in row]
+                    continue
+                if header is not None:
+                    url = _url_from_record(dict(zip(header, row)))
+                else:
+                    url = row[0].strip()
+                yield index, url
+                index += 1
+            return
+
+        index = 0
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                url = _url_from_record(json.loads(line))
+            except json.JSONDecodeError:
+                url = line
+            yield index, url
+            index += 1
+
+
+def _parse_record(line):
+    """解析输出文件的一行，不是本节点写出的结果记录时返回 None"""
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(record, dict) or not isinstance(record.get("index"), int):
+        return None
+    return record
+
+
+def load_completed(output_path, retry_failed):
+    """从已有的输出文件中恢复进度，返回已完成的序号集合
+
+    输出文件本身就是检查点：崩溃时写了一半的最后一行会被截掉。
+    retry_failed 为 True 时，失败的条目不算完成，重新运行时会再次处理。
+    无法解析的行跳过；文件中没有任何结果记录（不是本节点的输出文件）时抛出 ValueError，不修改文件。
+    """
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+
+    with open(output_path, "rb+") as f:
+        data_end = 0
+        records = 0
+        malformed = 0
+        partial = b""
+        for line in iter(f.readline, b""):
+            if not line.endswith(b"\n"):
+                partial = line
+                break
+            data_end += len(line)
+            if not line.strip():
+                continue
+            record = _parse_record(line)
+            if record is None:
+                malformed += 1
+                continue
+            records += 1
+            result = record.get("result")
+            if retry_failed and isinstance(result, dict) and "error" in result:
+                completed.discard(record["index"])
+            else:
+                completed.add(record["index"])
+        if (malformed and not records) or (partial and not partial.startswith(_RECORD_PREFIX)):
+            raise ValueError(f"output_path 不是批量任务的结果文件（NDJSON），不会覆盖: {output_path}")
+        f.truncate(data_end)
+    if malformed:
+        logger.info(f"[BatchJob] {output_path} 中有 {malformed} 行无法解析，已跳过")
+    return completed
+
+
+class ResultWriter:
+    """每个结果完成后立即追加一行到 NDJSON 输出文件，并定期更新检查点摘要"""
+
+    def __init__(self, output_path, input_path, skipped=0):
+        self.output_path = output_path
+        self.checkpoint_path = output_path + ".checkpoint.json"
+        self.input_path = input_path
+        self.skipped = skipped
+        self.completed = 0
+        self.failed = 0
+        self._file = None
+        self._last_checkpoint = 0
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.output_path)), exist_ok=True)
+        self._file = open(self.output_path, "a", encoding="utf-8")
+        return self
+
+    def __exit__(self, *exc):
+        self._file.close()
+        self._write_checkpoint()
+
+    def write(self, index, person_image, result):
+        record = {"index": index, "person_image": person_image, "result": result}
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        if isinstance(result, dict) and "error" in result:
+            self.failed += 1
+        else:
+            self.completed += 1
+        if time.monotonic() - self._last_checkpoint > 5:
+            self._write_checkpoint()
+
+    def _write_checkpoint(self):
+        self._last_checkpoint = time.monotonic()
+        checkpoint = {
+            "input_path": self.input_path,
+            "output_path": self.output_path,
+            "skipped": self.skipped,
+            "completed": self.completed,
+            "failed": self.failed,
+            "updated_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(checkpoint, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.checkpoint_path)
+
+
+async def run(items, process, writer, max_concurrency):
+    """流式处理 items 中的 (序号, URL)：最多 max_concurrency 个条目同时在途，完成一个写出一个
+
+    内存中只保留在途的条目，与批次大小无关。收到取消请求时取消所有在途条目后向上抛出，
+    已写出的结果不受影响，重新运行时从输出文件恢复进度。
+    """
+    in_flight = {}
+    items = iter(items)
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(in_flight) < max_concurrency:
+                try:
+                    index, person_image = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                in_flight[asyncio.ensure_future(process(index, person_image))] = (index, person_image)
+            if not in_flight:
+                return
+            done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                index, person_image = in_flight.pop(task)
+                if task.exception() is not None:
+                    if isinstance(task.exception(), InterruptProcessingException):
+                        raise task.exception()
+                    result = {"error": f"处理第 {index+1} 个人物图像时发生异常: {str(task.exception())}"}
+                else:
+                    result = task.result()
+                writer.write(index, person_image, result)
+    except (InterruptProcessingException, asyncio.CancelledError):
+        logger.info(f"[BatchJob] 收到取消请求，停止 {len(in_flight)} 个在途条目，已完成的结果已写入 {writer.output_path}")
+        raise
+    finally:
+        for task in in_flight:
+            task.cancel()
+        if in_flight:
+            await asyncio.gather(*in_flight, return_exceptions=True)
@@ -0,0 +1,156 @@
+import os
+import threading
+from collections import OrderedDict
+
+from . import interrupt
+from . import coordination
+from .lazy import lazy_import
+from .logging import logger
+
+asyncio = lazy_import("asyncio")
+
+
+# 回调校验令牌，通过请求头 X-Bailian-Callback-Token 或查询参数 token 传递
+TOKEN = os.environ.get("BAILIAN_CALLBACK_TOKEN", "")
+# 是否启用回调模式：需要 ComfyUI 能接收外部（如 EventBridge 投递的任务完成事件）的入站请求，
+# 并且必须设置 TOKEN，否则任何人都可以伪造任务结果
+ENABLED = os.environ.get("BAILIAN_CALLBACK_ENABLED", "").lower() in ("1", "true", "yes", "on")
+if ENABLED and not TOKEN:
+    logger.warning("[BailianCallback] 设置了 BAILIAN_CALLBACK_ENABLED 但没有设置 BAILIAN_CALLBACK_TOKEN，不启用回调模式")
+    ENABLED = False
+# 回调模式下的兜底轮询间隔（秒），防止回调丢失时任务永远等不到结果
+FALLBACK_POLL_INTERVAL = float(os.environ.get("BAILIAN_CALLBACK_FALLBACK_INTERVAL", "30"))
+
+ROUTE_PATH = "/bailian/callback"
+
+TERMINAL_STATUSES = ("SUCCEEDED", "FAILED", "CANCELED", "UNKNOWN")
+
+# 最多缓存的已推送结果数（同一账号下其他进程的任务也会推送过来，需要有上限）
+_MAX_RESULTS = 10000
+
+_lock = threading.Lock()
+_results = OrderedDict()
+_waiters = {}
+
+
+def next_poll_interval(poll_interval):
+    """回调模式下只需要慢速兜底轮询"""
+    if ENABLED:
+        return max(poll_interval, FALLBACK_POLL_INTERVAL)
+    return poll_interval
+
+
+def _extract_task(payload):
+    """兼容直接推送任务查询结果，以及 CloudEvents 格式（任务结果放在 data 字段中）"""
+    if isinstance(payload, dict) and isinstance(payload.get("data"), dict):
+        payload = payload["data"]
+    if not isinstance(payload, dict):
+        return None, None, None
+    output = payload.get("output")
+    if not isinstance(output, dict):
+        output = payload
+        payload = {"output": output}
+    return output.get("task_id"), output.get("task_status"), payload
+
+
+def notify(payload):
+    """收到任务完成通知，唤醒等待该任务的轮询，返回 task_id"""
+    task_id, task_status, result_data = _extract_task(payload)
+    if not task_id:
+        return None
+    if task_status not in TERMINAL_STATUSES:
+        return task_id
+
+    with _lock:
+        _results[task_id] = result_data
+        _results.move_to_end(task_id)
+        while len(_results) > _MAX_RESULTS:
+            _results.popitem(last=False)
+        waiters = _waiters.pop(task_id, [])
+
+    logger.info(f"[BailianCallback] 收到任务完成通知: {task_id}, 状态: {task_status}")
+    for waiter in waiters:
+        waiter()
+    return task_id
+
+
+def take(task_id):
+    """取出已推送的任务结果，没有时返回 None"""
+    if not ENABLED:
+        return None
+    with _lock:
+        return _results.pop(task_id, None)
+
+
+def _register(task_id, waiter):
+    with _lock:
+        if task_id in _results:
+            return False
+        _waiters.setdefault(task_id, []).append(waiter)
+        return True
+
+
+def _unregister(task_id, waiter):
+    with _lock:
+        waiters = _waiters.get(task_id)
+        if waiters and waiter in waiters:
+            waiters.remove(waiter)
+            if not waiters:
+                _waiters.pop(task_id, None)
+
+
+async def async_wait(task_id, timeout):
+    """异步等待任务完成通知或超时（可被 ComfyUI 取消），未启用回调模式时等价于可中断的 asyncio.sleep"""
+    await async_wait_any([task_id], timeout)
+
+
+async def async_wait_any(task_ids, timeout):
+    """异步等待任意一个任务的完成通知或超时，用于同时等待多个任务"""
+    if not ENABLED:
+        await interrupt.async_sleep(timeout)
+        return
+
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def wake():
+        try:
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+        except RuntimeError:
+            # 等待方所在的事件循环已关闭
+            pass
+
+    registered = []
+    try:
+        for task_id in task_ids:
+            if not _register(task_id, wake):
+                return
+            registered.append(task_id)
+        await asyncio.wait_for(interrupt.wait_for(asyncio.shield(future)), timeout)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        for task_id in registered:
+            _unregister(task_id, wake)
+
+
+async def handle_callback(request):
+    """PromptServer 路由：接收任务完成通知"""
+    from aiohttp import web
+
+    # 没有配置令牌时拒绝所有请求
+    if not TOKEN or request.headers.get("X-Bailian-Callback-Token", request.query.get("token", "")) != TOKEN:
+        return web.json_response({"error": "invalid token"}, status=403)
+    try:
+        payload = await request.json()
+    except Exception:
+        return web.json_response({"error": "invalid json"}, status=400)
+
+    events = payload if isinstance(payload, list) else [payload]
+    task_ids = [task_id for task_id in (notify(event) for event in events) if task_id]
+    # 回调只会投递到其中一个进程，保存到协调后端后其他进程轮询时可以直接拿到结果
+    for event in events:
+        task_id, task_status, result_data = _extract_task(event)
+        if task_id and task_status in TERMINAL_STATUSES:
+            await coordination.store_result(task_id, result_data)
+    return web.json_response({"received": task_ids})
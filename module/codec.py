@@ -0,0 +1,167 @@
+import os
+import sys
+import json
+import weakref
+
+from .lazy import lazy_import
+from .logging import logger
+
+asyncio = lazy_import("asyncio")
+np = lazy_import("numpy")
+
+
+# 图片编解码工作进程数，设置为 0 时在线程中编解码（与事件循环所在进程共享 GIL）
+WORKERS = int(os.environ.get("BAILIAN_CODEC_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# 插件根目录，工作进程以 `python -m module.codec_worker` 从这里启动
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_pools = weakref.WeakKeyDictionary()
+
+
+class CodecError(Exception):
+    """工作进程启动失败或意外退出"""
+    pass
+
+
+def _attach(name, shape, dtype):
+    """映射工作进程写好的共享内存为 numpy 数组，不复制；数组被回收时释放映射"""
+    from multiprocessing import shared_memory
+    try:
+        shm = shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+    # 主进程负责释放：POSIX 上立即删除名字，映射在数组被回收前一直有效
+    shm.unlink()
+    pixels = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    weakref.finalize(pixels, shm.close)
+    return pixels
+
+
+class _Worker:
+    def __init__(self, process):
+        self.process = process
+        self.broken = False
+
+    @property
+    def alive(self):
+        return not self.broken and self.process.returncode is None
+
+    async def call(self, op, data, params):
+        header = dict(params, op=op, size=len(data))
+        self.process.stdin.write(json.dumps(header).encode("utf-8") + b"\n")
+        self.process.stdin.write(data)
+        await self.process.stdin.drain()
+        line = await self.process.stdout.readline()
+        if not line:
+            raise CodecError("图片编解码工作进程意外退出")
+        response = json.loads(line)
+        body = await self.process.stdout.readexactly(response["size"]) if response["size"] else b""
+        if "shm" in response:
+            # 必须在下一个请求之前映射，工作进程收到下一个请求时会关闭自己的句柄
+            response["pixels"] = _attach(response["shm"], tuple(response["shape"]), response["dtype"])
+        return response, body
+
+    def kill(self):
+        # 请求中途出错时协议可能已经错位，这个进程不再使用
+        if self.alive:
+            self.process.kill()
+        self.broken = True
+
+
+class CodecPool:
+    """图片编解码进程池：解码下载的结果图片、预处理输入图片等 CPU 密集的工作在独立进程中执行
+
+    网络事件循环只负责收发字节，不会被编解码阻塞；解码得到的像素通过共享内存返回，不经过 pickle 复制。
+    工作进程按需启动，每个事件循环一个进程池。
+    """
+
+    def __init__(self, size):
+        self.size = size
+        # 空闲的工作进程，None 表示还没有启动（或已经退出）的名额
+        self._idle = asyncio.Queue()
+        for _ in range(size):
+            self._idle.put_nowait(None)
+
+    async def _spawn(self):
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, "-m", "module.codec_worker",
+            cwd=_ROOT, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE,
+        )
+        logger.info(f"[BailianCodec] 启动图片编解码工作进程 (pid {process.pid})")
+        return _Worker(process)
+
+    async def _acquire(self):
+        worker = await self._idle.get()
+        if worker is not None:
+            return worker
+        try:
+            return await self._spawn()
+        except Exception as e:
+            self._idle.put_nowait(None)
+            raise CodecError(f"无法启动图片编解码工作进程: {str(e)}") from e
+
+    def _release(self, worker):
+        self._idle.put_nowait(worker if worker.alive else None)
+
+    async def call(self, op, data, **params):
+        """在空闲的工作进程中执行 op，返回 (响应头, 数据)，解码的像素在响应头的 pixels 中
+
+        调用方被取消时请求仍然完成，工作进程归还后才丢弃结果，保证协议不会错位。
+        """
+        worker = await self._acquire()
+
+        async def roundtrip():
+            try:
+                return await worker.call(op, data, params)
+            except BaseException:
+                worker.kill()
+                raise
+            finally:
+                self._release(worker)
+
+        response, body = await asyncio.shield(asyncio.ensure_future(roundtrip()))
+        if "error" in response:
+            raise ValueError(response["error"])
+        return response, body
+
+
+def get_pool():
+    """当前事件循环的编解码进程池，关闭时返回 None"""
+    if WORKERS <= 0:
+        return None
+    loop = asyncio.get_running_loop()
+    pool = _pools.get(loop)
+    if pool is None:
+        pool = _pools[loop] = CodecPool(WORKERS)
+    return pool
+
+
+def _decode_in_thread(data):
+    from .image_cache import decode_image
+    return decode_image(data)
+
+
+async def decode(data):
+    """解码图片字节为 float32 像素数组 (h, w, 3)，与 image_cache.decode_image 的结果一致"""
+    pool = get_pool()
+    if pool is not None:
+        try:
+            response, _ = await pool.call("decode", data)
+            return response["pixels"]
+        except CodecError as e:
+            logger.info(f"[BailianCodec] {str(e)}，改为在线程中解码")
+    return await asyncio.to_thread(_decode_in_thread, data)
+
+
+async def preprocess(data, profile):
+    """按模型规格预处理图片，返回值同 preprocess.process_bytes"""
+    pool = get_pool()
+    if pool is not None:
+        try:
+            response, body = await pool.call("preprocess", data, profile=profile)
+            return (body if response["processed"] else None), response["report"]
+        except CodecError as e:
+            logger.info(f"[BailianCodec] {str(e)}，改为在线程中预处理")
+    from .preprocess import process_bytes
+    return await asyncio.to_thread(process_bytes, data, profile)
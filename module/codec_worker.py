@@ -0,0 +1,85 @@
+"""图片编解码工作进程，由 codec.CodecPool 以 `python -m module.codec_worker` 启动
+
+通过 stdin/stdout 通信，每条消息是一行 JSON 头（size 为随后的数据字节数）加上数据。
+解码得到的像素直接写入共享内存，主进程映射后即可使用，不经过管道复制。
+工作进程只导入 numpy 和 PIL，不导入 torch，也不继承 ComfyUI 进程的状态。
+"""
+import io
+import sys
+import json
+import importlib
+
+from multiprocessing import shared_memory
+
+
+def _create_shared_memory(size):
+    try:
+        # Python 3.13+：共享内存由主进程负责释放，工作进程不登记
+        return shared_memory.SharedMemory(create=True, size=size, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+def decode(header, data):
+    """解码图片为 float32 像素 (h, w, 3)，与 utils.pil2numpy 的结果一致，直接写入共享内存"""
+    import numpy as np
+    from PIL import Image, ImageOps
+
+    img = ImageOps.exif_transpose(Image.open(io.BytesIO(data))).convert("RGB")
+    pixels = np.asarray(img)
+    shm = _create_shared_memory(pixels.size * 4)
+    out = np.ndarray(pixels.shape, dtype=np.float32, buffer=shm.buf)
+    np.divide(pixels, np.float32(255.0), out=out)
+    del out
+    return {"shm": shm.name, "shape": list(pixels.shape), "dtype": "float32"}, b"", shm
+
+
+def preprocess(header, data):
+    """按模型规格预处理输入图片，见 preprocess.process_bytes"""
+    process_bytes = importlib.import_module(__package__ + ".preprocess").process_bytes
+    processed, report = process_bytes(data, header["profile"])
+    if processed is None:
+        return {"report": report, "processed": False}, b"", None
+    return {"report": report, "processed": True}, processed, None
+
+
+OPERATIONS = {
+    "decode": decode,
+    "preprocess": preprocess,
+}
+
+
+def main():
+    stdin = sys.stdin.buffer
+    stdout = sys.stdout.buffer
+    # 协议独占 stdout，其他输出（日志、print）改写到 stderr
+    sys.stdout = sys.stderr
+
+    # 上一次返回的共享内存保留到下一个请求：主进程在发出下一个请求前已经映射完成
+    # （Windows 上共享内存在所有句柄关闭后即被释放）
+    previous = None
+    while True:
+        line = stdin.readline()
+        if not line:
+            break
+        if previous is not None:
+            previous.close()
+            previous = None
+
+        header = json.loads(line)
+        data = stdin.read(header["size"])
+        try:
+            response, body, previous = OPERATIONS[header["op"]](header, data)
+        except Exception as e:
+            response, body = {"error": f"{type(e).__name__}: {str(e)}"}, b""
+        response["size"] = len(body)
+        stdout.write(json.dumps(response).encode("utf-8") + b"\n")
+        stdout.write(body)
+        stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
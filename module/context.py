@@ -0,0 +1,51 @@
+import contextvars
+
+
+# 当前节点执行的归属 (节点类名, unique_id, prompt_id)，在节点入口记录，后台事件循环上的子任务继承
+_execution = contextvars.ContextVar("bailian_execution", default=None)
+
+
+def current_prompt_id():
+    """当前正在执行的 prompt_id，脱离 ComfyUI 运行时返回 None"""
+    try:
+        # 新版 ComfyUI 提供执行上下文，异步节点并行执行时也能拿到正确的 prompt_id
+        from comfy_execution.utils import get_executing_context
+        context = get_executing_context()
+        if context is not None:
+            return context.prompt_id
+    except ImportError:
+        pass
+
+    try:
+        from server import PromptServer
+        return PromptServer.instance.last_prompt_id
+    except Exception:
+        return None
+
+
+def execution_prompt_id():
+    """当前节点执行所属的 prompt_id
+
+    后台事件循环上的协程优先使用节点入口记录的值：并行执行多个 prompt 时，
+    此时再调用 current_prompt_id 可能拿到的是其他 prompt 的 ID。
+    """
+    execution = _execution.get()
+    if execution is not None and execution[2] is not None:
+        return execution[2]
+    return current_prompt_id()
+
+
+def owner_key(unique_id=None):
+    """任务归属标识：prompt_id + 节点 ID，用于调度时区分不同的工作流和节点"""
+    return f"{execution_prompt_id() or '-'}:{unique_id or '-'}"
+
+
+def current_execution():
+    """当前节点执行的 (节点类名, unique_id, prompt_id)，不在节点执行中时返回 None"""
+    return _execution.get()
+
+
+async def bind_execution(coro, node, unique_id, prompt_id):
+    """在协程所在的任务上下文中记录节点执行的归属后执行协程"""
+    _execution.set((node, unique_id, prompt_id))
+    return await coro
@@ -0,0 +1,401 @@
+import os
+import json
+import time
+import uuid
+import socket
+import weakref
+import hashlib
+import sqlite3
+import threading
+
+from . import interrupt
+from .deadline import DeadlineExceeded, CONNECT_TIMEOUT, READ_TIMEOUT
+from .lazy import lazy_import
+from .logging import logger
+
+asyncio = lazy_import("asyncio")
+
+
+# 多个 ComfyUI 进程（同一台机器或多台机器）共享的协调后端，为空时不启用：
+#   sqlite 或 sqlite:///path/to/file  本机（或共享文件系统上）的 SQLite 文件
+#   redis://host:6379/0               Redis（需要安装 redis）
+#   memory                            进程内实现，只用于单进程或测试
+BACKEND = os.environ.get("BAILIAN_COORDINATION", "")
+# 是否在所有进程间合并相同的请求：已有进程用同一个 API Key 提交过时直接复用它的任务
+DEDUPE = os.environ.get("BAILIAN_COORDINATION_DEDUPE", "").lower() in ("1", "true", "yes", "on")
+# 已提交的任务可以被相同请求复用的时间（秒），超过后相同的请求重新提交
+TASK_TTL = float(os.environ.get("BAILIAN_COORDINATION_TASK_TTL", "3600"))
+# 整个集群每秒最多提交的任务数（同一个 DashScope 账号共享），0 表示不限制
+QUOTA_RATE = float(os.environ.get("BAILIAN_QUOTA_RATE", "0"))
+# 提交速率允许的突发数
+QUOTA_BURST = float(os.environ.get("BAILIAN_QUOTA_BURST", "5"))
+# 任务结果在共享缓存中的保留时间（秒）
+RESULT_TTL = float(os.environ.get("BAILIAN_COORDINATION_RESULT_TTL", "3600"))
+
+DEFAULT_SQLITE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "comfyui-bailian", "coordination.sqlite3")
+
+# 提交中的请求的占用时间：提交方在等待配额、并发名额和提交请求期间定期续期，
+# 超过这个时间没有续期时其他进程认为提交方已经退出
+_CLAIM_TTL = CONNECT_TIMEOUT + READ_TIMEOUT + 10
+_FAILED = object()
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+class MemoryBackend:
+    """进程内的协调后端，语义与 SQLite、Redis 后端一致，可以在测试中代替网络后端"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+        self._buckets = {}
+
+    def _live(self, key):
+        entry = self._values.get(key)
+        if entry is not None and entry[1] <= time.time():
+            del self._values[key]
+            return None
+        return entry
+
+    async def get(self, key):
+        with self._lock:
+            entry = self._live(key)
+            return entry[0] if entry is not None else None
+
+    async def set(self, key, value, ttl):
+        with self._lock:
+            self._values[key] = (value, time.time() + ttl)
+
+    async def claim(self, key, value, ttl):
+        """key 不存在时写入并返回 None，否则返回已有的值"""
+        with self._lock:
+            entry = self._live(key)
+            if entry is not None:
+                return entry[0]
+            self._values[key] = (value, time.time() + ttl)
+            return None
+
+    async def delete(self, key):
+        with self._lock:
+            self._values.pop(key, None)
+
+    async def take_token(self, name, rate, burst):
+        """令牌桶：拿到令牌时返回 0，否则返回需要等待的秒数"""
+        with self._lock:
+            now = time.time()
+            tokens, updated_at = self._buckets.get(name, (burst, now))
+            tokens = min(burst, tokens + (now - updated_at) * rate)
+            wait = 0.0 if tokens >= 1 else (1 - tokens) / rate
+            self._buckets[name] = (tokens - 1 if wait == 0 else tokens, now)
+            return wait
+
+
+class SQLiteBackend:
+    """基于 SQLite 文件的协调后端，同一台机器上的进程共享；放在共享文件系统上时需要文件系统支持文件锁"""
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT, expires_at REAL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, tokens REAL, updated_at REAL)")
+            conn.execute("DELETE FROM kv WHERE expires_at <= ?", (time.time(),))
+
+    def _connect(self):
+        # 每个线程一个连接，读写在线程池中执行，文件锁等待不阻塞事件循环
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return _Transaction(conn)
+
+    def _get(self, key):
+        with self._connect() as conn:
+            row = conn.execute("SELECT value FROM kv WHERE key = ? AND expires_at > ?", (key, time.time())).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _set(self, key, value, ttl):
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)", (key, json.dumps(value), time.time() + ttl))
+
+    def _claim(self, key, value, ttl):
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute("SELECT value FROM kv WHERE key = ? AND expires_at > ?", (key, now)).fetchone()
+            if row:
+                return json.loads(row[0])
+            conn.execute("INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)", (key, json.dumps(value), now + ttl))
+            return None
+
+    def _delete(self, key):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+
+    def _take_token(self, name, rate, burst):
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute("SELECT tokens, updated_at FROM buckets WHERE name = ?", (name,)).fetchone()
+            tokens = burst if row is None else min(burst, row[0] + (now - row[1]) * rate)
+            wait = 0.0 if tokens >= 1 else (1 - tokens) / rate
+            conn.execute("INSERT OR REPLACE INTO buckets (name, tokens, updated_at) VALUES (?, ?, ?)", (name, tokens - 1 if wait == 0 else tokens, now))
+            return wait
+
+    async def get(self, key):
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key, value, ttl):
+        await asyncio.to_thread(self._set, key, value, ttl)
+
+    async def claim(self, key, value, ttl):
+        return await asyncio.to_thread(self._claim, key, value, ttl)
+
+    async def delete(self, key):
+        await asyncio.to_thread(self._delete, key)
+
+    async def take_token(self, name, rate, burst):
+        return await asyncio.to_thread(self._take_token, name, rate, burst)
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE 事务：读-改-写期间持有写锁，多个进程同时操作同一个 key 时也是原子的"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, *exc):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+# 令牌桶的 Lua 脚本，在 Redis 中原子执行
+_TAKE_TOKEN_SCRIPT = """
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local rate, burst = tonumber(ARGV[1]), tonumber(ARGV[2])
+-- 使用 Redis 服务器的时间，不受各机器时钟误差影响
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local tokens = tonumber(bucket[1]) or burst
+local updated_at = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + (now - updated_at) * rate)
+local wait = 0
+if tokens >= 1 then tokens = tokens - 1 else wait = (1 - tokens) / rate end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated_at', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 60)
+return tostring(wait)
+"""
+
+
+class RedisBackend:
+    """基于 Redis 的协调后端，多台机器上的进程共享"""
+
+    def __init__(self, url, prefix="bailian:"):
+        # 未安装 redis 时在创建后端时就报错
+        import redis.asyncio  # noqa: F401
+        self.url = url
+        self.prefix = prefix
+        self._clients = weakref.WeakKeyDictionary()
+
+    def _client(self):
+        # redis.asyncio 的连接绑定创建时的事件循环
+        import redis.asyncio
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            client = self._clients[loop] = redis.asyncio.Redis.from_url(self.url)
+        return client
+
+    async def get(self, key):
+        value = await self._client().get(self.prefix + key)
+        return json.loads(value) if value is not None else None
+
+    async def set(self, key, value, ttl):
+        await self._client().set(self.prefix + key, json.dumps(value), px=int(ttl * 1000))
+
+    async def claim(self, key, value, ttl):
+        client = self._client()
+        while True:
+            if await client.set(self.prefix + key, json.dumps(value), px=int(ttl * 1000), nx=True):
+                return None
+            existing = await client.get(self.prefix + key)
+            # 刚好过期时重新尝试写入
+            if existing is not None:
+                return json.loads(existing)
+
+    async def delete(self, key):
+        await self._client().delete(self.prefix + key)
+
+    async def take_token(self, name, rate, burst):
+        wait = await self._client().eval(_TAKE_TOKEN_SCRIPT, 1, self.prefix + "bucket:" + name, rate, burst)
+        return float(wait)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def _create_backend(spec):
+    if spec == "memory":
+        return MemoryBackend()
+    if spec == "sqlite":
+        return SQLiteBackend(DEFAULT_SQLITE_PATH)
+    if spec.startswith("sqlite:///"):
+        return SQLiteBackend(spec[len("sqlite://"):])
+    if spec.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBackend(spec)
+    raise ValueError(f"不支持的协调后端: {spec}")
+
+
+def get_backend():
+    """进程级的协调后端，未配置或创建失败时返回 None"""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            if not BACKEND:
+                return None
+            try:
+                _backend = _create_backend(BACKEND)
+                logger.info(f"[BailianCoordination] 使用协调后端: {type(_backend).__name__} ({WORKER_ID})")
+            except Exception as e:
+                # 只提示一次，之后按未启用处理
+                logger.info(f"[BailianCoordination] 无法创建协调后端，按单进程运行: {str(e)}")
+                _backend = False
+        return _backend or None
+
+
+def set_backend(backend):
+    """替换协调后端（例如测试中用 MemoryBackend 代替 Redis），传入 None 时关闭"""
+    global _backend
+    with _backend_lock:
+        _backend = backend if backend is not None else False
+
+
+def work_key(endpoint, headers, request_data, slot=None):
+    """跨进程合并请求的键：包含请求本身和 API Key 的摘要，不包含 prompt 和节点
+
+    不同进程用同一个 API Key 提交的相同请求得到同一个键，不同账号、不同 API Key 的任务不会互相复用。
+    """
+    if not DEDUPE or headers.get("X-DashScope-Async") != "enable":
+        return None
+    credential = hashlib.sha256(headers.get("Authorization", "").encode("utf-8")).hexdigest()
+    identity = {"endpoint": endpoint, "request": request_data, "slot": slot, "credential": credential}
+    return hashlib.sha256(json.dumps(identity, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+async def acquire_quota(deadline=None):
+    """按集群共享的提交速率等待一个令牌，deadline 内拿不到时抛出 DeadlineExceeded"""
+    backend = get_backend()
+    if backend is None or QUOTA_RATE <= 0:
+        return
+    while True:
+        # 后端出错时不限制提交
+        wait = await _quietly(backend.take_token("submit", QUOTA_RATE, QUOTA_BURST), 0)
+        if wait <= 0:
+            return
+        if deadline is not None and deadline.remaining() <= wait:
+            raise DeadlineExceeded(f"等待提交配额超时 ({deadline.budget}秒)")
+        await interrupt.async_sleep(wait)
+
+
+async def submit(key, send, deadline=None):
+    """等待提交配额后调用 send() 提交；其他进程已经提交过相同的请求时直接复用它的任务
+
+    协调后端出错时不影响提交。
+    """
+    backend = get_backend()
+    if backend is None:
+        return await send()
+
+    if key is None:
+        await acquire_quota(deadline)
+        return await send()
+
+    claim_key = f"inflight:{key}"
+    while True:
+        existing = await _quietly(backend.claim(claim_key, {"worker": WORKER_ID, "task_id": None}, _CLAIM_TTL), _FAILED)
+        if existing is _FAILED:
+            # 后端出错时按单进程的方式直接提交
+            await acquire_quota(deadline)
+            return await send()
+        if existing is None:
+            break
+        if existing.get("task_id"):
+            logger.info(f"[BailianCoordination] 复用 {existing['worker']} 提交的任务: {existing['task_id']}")
+            return {"output": {"task_id": existing["task_id"], "task_status": "PENDING"}, "coordination": "shared"}
+        # 其他进程正在提交相同的请求，等它拿到 task_id
+        if deadline is not None and deadline.remaining() <= 0.5:
+            raise DeadlineExceeded(f"等待其他进程提交超时 ({deadline.budget}秒)")
+        await interrupt.async_sleep(0.5)
+
+    released = asyncio.Event()
+    keeper = asyncio.ensure_future(_keep_claim(backend, claim_key, released))
+    try:
+        await acquire_quota(deadline)
+        response_data = await send()
+    except BaseException:
+        released.set()
+        await asyncio.shield(keeper)
+        await asyncio.shield(_quietly(backend.delete(claim_key)))
+        raise
+    # 续期停止后再写入 task_id，避免被续期覆盖
+    released.set()
+    await asyncio.shield(keeper)
+    task_id = response_data.get("output", {}).get("task_id")
+    if task_id:
+        await _quietly(backend.set(claim_key, {"worker": WORKER_ID, "task_id": task_id}, TASK_TTL))
+        await _quietly(backend.set(f"task:{task_id}", claim_key, TASK_TTL))
+    else:
+        await _quietly(backend.delete(claim_key))
+    return response_data
+
+
+async def _keep_claim(backend, claim_key, released):
+    """在 released 之前每隔 _CLAIM_TTL 的三分之一续期一次提交占用"""
+    while True:
+        try:
+            await asyncio.wait_for(released.wait(), _CLAIM_TTL / 3)
+            return
+        except asyncio.TimeoutError:
+            await _quietly(backend.set(claim_key, {"worker": WORKER_ID, "task_id": None}, _CLAIM_TTL))
+
+
+async def _quietly(operation, default=None):
+    """执行后端操作，出错时只记录日志"""
+    try:
+        return await operation
+    except Exception as e:
+        logger.info(f"[BailianCoordination] 协调后端出错: {str(e)}")
+        return default
+
+
+async def _forget(backend, task_id):
+    claim_key = await backend.get(f"task:{task_id}")
+    if claim_key:
+        await backend.delete(claim_key)
+    await backend.delete(f"task:{task_id}")
+
+
+async def forget_task(task_id):
+    """任务失败或被取消后删除占用记录，之后相同的请求重新提交"""
+    backend = get_backend()
+    if backend is not None:
+        await _quietly(_forget(backend, task_id))
+
+
+async def cached_result(task_id):
+    """其他进程已经拿到的任务结果（轮询或回调），没有时返回 None"""
+    backend = get_backend()
+    if backend is None:
+        return None
+    return await _quietly(backend.get(f"result:{task_id}"))
+
+
+async def store_result(task_id, result_data):
+    """保存已结束的任务结果，供其他进程直接使用"""
+    backend = get_backend()
+    if backend is not None:
+        await _quietly(backend.set(f"result:{task_id}", result_data, RESULT_TTL))
@@ -0,0 +1,37 @@
+import time
+
+
+# 单次 HTTP 请求的连接/读取超时（秒），整体上限由 Deadline 的剩余预算决定
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 30
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Deadline:
+    """一次节点执行的整体截止时间
+
+    提交、轮询、refiner、下载等各阶段共享同一份预算，每个阶段只能使用剩余的时间，
+    因此最坏情况下的总耗时不会超过用户配置的 max_wait_time。
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.start_time = time.monotonic()
+        self.end_time = self.start_time + budget
+
+    def elapsed(self):
+        return time.monotonic() - self.start_time
+
+    def remaining(self):
+        return max(0.0, self.end_time - time.monotonic())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def check(self, stage):
+        """预算耗尽时抛出 DeadlineExceeded"""
+        if self.expired():
+            raise DeadlineExceeded(f"{stage}前已超出最大等待时间 ({self.budget}秒)")
@@ -0,0 +1,88 @@
+import os
+import sys
+import functools
+import threading
+
+from .context import bind_execution, current_prompt_id
+from .lazy import lazy_import
+from .logging import logger
+
+asyncio = lazy_import("asyncio")
+
+
+_loop = None
+_thread = None
+_lock = threading.Lock()
+
+
+def supports_async_nodes():
+    """当前 ComfyUI 是否支持原生异步节点（FUNCTION 为协程函数）"""
+    override = os.environ.get("BAILIAN_ASYNC_NODES", "").lower()
+    if override in ("0", "false", "no", "off"):
+        return False
+    if override in ("1", "true", "yes", "on"):
+        return True
+    execution = sys.modules.get("execution")
+    return execution is not None and hasattr(execution, "_async_map_node_over_list")
+
+
+def get_loop():
+    """插件专用的后台事件循环，所有网络请求都在这个循环中执行，连接池可以跨节点、跨 prompt 复用"""
+    global _loop, _thread
+    with _lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name="bailian-event-loop", daemon=True)
+            thread.start()
+            _loop, _thread = loop, thread
+        return _loop
+
+
+def loop_thread_ident():
+    """后台事件循环所在线程的 ident，还没有启动时返回 None"""
+    return _thread.ident if _thread is not None else None
+
+
+def run_sync(coro):
+    """在后台事件循环中执行协程并阻塞当前线程直到完成（不支持异步节点时的回退方式）"""
+    return asyncio.run_coroutine_threadsafe(coro, get_loop()).result()
+
+
+async def run_async(coro):
+    """在调用方的事件循环中等待后台事件循环上的协程，调用方被取消时同时取消后台协程"""
+    future = asyncio.run_coroutine_threadsafe(coro, get_loop())
+    try:
+        return await asyncio.wrap_future(future)
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+
+
+def async_node(cls):
+    """节点类装饰器：FUNCTION 指向的协程在后台事件循环中执行
+
+    支持原生异步节点时入口仍是协程，ComfyUI 可以并行执行图中互不依赖的节点；
+    否则入口是普通函数，阻塞执行器线程直到协程完成。
+    """
+    function_name = cls.FUNCTION
+    coroutine_function = getattr(cls, function_name)
+
+    def bound(self, args, kwargs):
+        # prompt_id 在执行器线程中读取，后台事件循环中拿不到 ComfyUI 的执行上下文
+        return bind_execution(coroutine_function(self, *args, **kwargs), cls.__name__, kwargs.get("unique_id"), current_prompt_id())
+
+    if supports_async_nodes():
+        @functools.wraps(coroutine_function)
+        async def entry(self, *args, **kwargs):
+            return await run_async(bound(self, args, kwargs))
+    else:
+        @functools.wraps(coroutine_function)
+        def entry(self, *args, **kwargs):
+            return run_sync(bound(self, args, kwargs))
+
+    setattr(cls, function_name, entry)
+    return cls
+
+
+if not supports_async_nodes():
+    logger.info("[Bailian] 当前 ComfyUI 不支持异步节点，百炼节点将在后台事件循环中执行并阻塞执行器线程")
@@ -0,0 +1,133 @@
+import os
+import time
+import threading
+from collections import deque
+
+from .interrupt import InterruptProcessingException
+from .lazy import lazy_import
+from .logging import logger
+
+asyncio = lazy_import("asyncio")
+
+
+# 任务运行时间超过该模型历史耗时的这个分位数时提交一个重复任务
+PERCENTILE = float(os.environ.get("BAILIAN_HEDGE_PERCENTILE", "95"))
+# 对冲任务数占主任务数的比例上限
+MAX_RATE = float(os.environ.get("BAILIAN_HEDGE_MAX_RATE", "0.1"))
+# 每小时最多提交的对冲任务数（对冲任务同样计费）
+MAX_PER_HOUR = int(os.environ.get("BAILIAN_HEDGE_MAX_PER_HOUR", "100"))
+# 可选：对冲任务使用的备用接口地址和模型
+ALTERNATE_ENDPOINT = os.environ.get("BAILIAN_HEDGE_ENDPOINT", "")
+ALTERNATE_MODEL = os.environ.get("BAILIAN_HEDGE_MODEL", "")
+
+# 每个模型保留的历史耗时样本数，以及开始对冲前至少需要的样本数
+_WINDOW = 200
+_MIN_SAMPLES = 20
+
+
+def _succeeded(result):
+    return isinstance(result, dict) and result.get("output", {}).get("task_status") == "SUCCEEDED"
+
+
+class HedgePolicy:
+    """按模型学习任务耗时分布，慢于分位数的任务提交一个重复任务，先成功的结果生效"""
+
+    def __init__(self, percentile, max_rate, max_per_hour):
+        self.percentile = percentile
+        self.max_rate = max_rate
+        self.max_per_hour = max_per_hour
+        self._lock = threading.Lock()
+        self._runtimes = {}
+        self._recent_hedges = deque()
+        self._stats = {"primaries": 0, "hedges": 0, "hedge_wins": 0, "primary_wins": 0, "skipped_by_budget": 0}
+
+    def record(self, model, runtime):
+        with self._lock:
+            self._runtimes.setdefault(model, deque(maxlen=_WINDOW)).append(runtime)
+
+    def threshold(self, model):
+        """该模型耗时的 PERCENTILE 分位数，样本不足时返回 None"""
+        with self._lock:
+            samples = sorted(self._runtimes.get(model, ()))
+        if len(samples) < _MIN_SAMPLES:
+            return None
+        index = min(len(samples) - 1, int(len(samples) * self.percentile / 100))
+        return samples[index]
+
+    def _try_acquire(self):
+        """检查对冲比例和每小时数量上限，允许时计入一次对冲"""
+        with self._lock:
+            now = time.monotonic()
+            while self._recent_hedges and self._recent_hedges[0] < now - 3600:
+                self._recent_hedges.popleft()
+            if self._stats["hedges"] + 1 > self.max_rate * self._stats["primaries"] or len(self._recent_hedges) >= self.max_per_hour:
+                self._stats["skipped_by_budget"] += 1
+                return False
+            self._recent_hedges.append(now)
+            self._stats["hedges"] += 1
+            return True
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    async def run(self, primary, make_hedge, model, started_at, enabled=True):
+        """等待主任务（已提交的轮询协程）的结果，超过耗时分位数时调用 make_hedge() 提交重复任务
+
+        先成功的结果生效，另一个任务被取消（正在轮询的任务会同时取消远端任务）。
+        未启用对冲时只记录耗时。
+        """
+        self._count("primaries")
+        primary_task = asyncio.ensure_future(primary)
+        tasks = {primary_task}
+        try:
+            threshold = self.threshold(model) if enabled else None
+            if threshold is not None:
+                await asyncio.wait(tasks, timeout=max(0, threshold - (time.monotonic() - started_at)))
+            if primary_task.done() or threshold is None or not self._try_acquire():
+                result = await primary_task
+                if _succeeded(result):
+                    self.record(model, time.monotonic() - started_at)
+                return result
+
+            logger.info(f"[BailianHedge] 任务耗时超过 {model} 的 P{self.percentile:g} ({threshold:.1f}秒)，提交对冲任务")
+            hedge_started_at = time.monotonic()
+            hedge_task = asyncio.ensure_future(make_hedge())
+            tasks.add(hedge_task)
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        if isinstance(task.exception(), InterruptProcessingException):
+                            raise task.exception()
+                        continue
+                    if _succeeded(task.result()):
+                        if task is hedge_task:
+                            self._count("hedge_wins")
+                            self.record(model, time.monotonic() - hedge_started_at)
+                        else:
+                            self._count("primary_wins")
+                            self.record(model, time.monotonic() - started_at)
+                        return task.result()
+            # 两个任务都没有成功，以主任务的结果为准
+            return primary_task.result()
+        finally:
+            # 输掉的任务（或收到取消请求时的所有任务）取消后等待其收尾
+            losers = [task for task in tasks if not task.done()]
+            for task in losers:
+                task.cancel()
+            if losers:
+                await asyncio.gather(*losers, return_exceptions=True)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["hedges_last_hour"] = len(self._recent_hedges)
+            stats["models"] = {model: len(samples) for model, samples in self._runtimes.items()}
+        stats["hedge_rate"] = stats["hedges"] / stats["primaries"] if stats["primaries"] else 0.0
+        stats["thresholds"] = {model: self.threshold(model) for model in stats["models"]}
+        return stats
+
+
+policy = HedgePolicy(PERCENTILE, MAX_RATE, MAX_PER_HOUR)
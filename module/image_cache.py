@@ -0,0 +1,203 @@
+import io
+import os
+import shutil
+import hashlib
+import tempfile
+import threading
+
+from . import transport
+from . import codec
+from . import utils
+from .lazy import lazy_import
+from .logging import logger
+
+asyncio = lazy_import("asyncio")
+np = lazy_import("numpy")
+Image = lazy_import("PIL.Image")
+
+
+# 结果图片缓存目录，多个 ComfyUI 进程可以共享
+CACHE_DIR = os.environ.get("BAILIAN_IMAGE_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "comfyui-bailian", "images"))
+# 缓存大小上限（MB），设置为 0 时关闭缓存
+MAX_MB = float(os.environ.get("BAILIAN_IMAGE_CACHE_MAX_MB", "2048"))
+
+
+def _sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def decode_image(data):
+    """解码图片字节为 float32 像素数组 (h, w, 3)"""
+    return utils.pil2numpy(Image.open(io.BytesIO(data)))
+
+
+class ImageCache:
+    """结果图片的磁盘 LRU 缓存
+
+    urls/<URL 的 sha256>          URL 对应的内容哈希
+    blobs/<内容哈希>/source       原始图片字节
+    blobs/<内容哈希>/pixels.npy   解码后的 float32 像素 (h, w, 3)，直接 mmap 成 IMAGE 张量，不需要再解码
+
+    不同 URL 指向相同内容时共享同一份像素。以 blob 目录的 mtime 作为最近访问时间，
+    总大小超过上限时淘汰最久未访问的 blob。写入都是先写临时文件再原子替换，多进程共享目录是安全的。
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total_bytes = None
+
+    def _url_path(self, url):
+        return os.path.join(self.directory, "urls", _sha256(url.encode("utf-8")))
+
+    def _blob_dir(self, content_hash):
+        return os.path.join(self.directory, "blobs", content_hash)
+
+    def _write_atomic(self, path, write):
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write(f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _load_pixels(self, content_hash):
+        blob_dir = self._blob_dir(content_hash)
+        try:
+            # copy-on-write 映射：张量与页缓存共享内存，下游节点原地修改时才会复制
+            pixels = np.load(os.path.join(blob_dir, "pixels.npy"), mmap_mode="c")
+        except (OSError, ValueError):
+            return None
+        try:
+            os.utime(blob_dir, None)
+        except OSError:
+            pass
+        return pixels
+
+    def lookup(self, url):
+        """返回 URL 对应的缓存像素（mmap 数组），未命中时返回 None"""
+        try:
+            with open(self._url_path(url), "r") as f:
+                content_hash = f.read().strip()
+        except OSError:
+            return None
+        return self._load_pixels(content_hash)
+
+    def link(self, url, data):
+        """已经缓存过相同内容（其他 URL）时记录 URL 并返回 mmap 的像素数组，否则返回 None"""
+        content_hash = _sha256(data)
+        pixels = self._load_pixels(content_hash)
+        if pixels is not None:
+            self._write_atomic(self._url_path(url), lambda f: f.write(content_hash.encode("ascii")))
+        return pixels
+
+    def store(self, url, data, decoded=None):
+        """缓存下载到的图片字节和解码后的像素（为 None 时在当前线程解码），返回 mmap 的像素数组"""
+        content_hash = _sha256(data)
+        pixels = self._load_pixels(content_hash)
+        if pixels is None:
+            if decoded is None:
+                decoded = decode_image(data)
+            blob_dir = self._blob_dir(content_hash)
+            self._write_atomic(os.path.join(blob_dir, "source"), lambda f: f.write(data))
+            self._write_atomic(os.path.join(blob_dir, "pixels.npy"), lambda f: np.save(f, decoded))
+            self._added(len(data) + decoded.nbytes)
+            pixels = self._load_pixels(content_hash)
+        self._write_atomic(self._url_path(url), lambda f: f.write(content_hash.encode("ascii")))
+        return pixels
+
+    def _scan(self):
+        """返回 [(mtime, 大小, blob 目录)]"""
+        blobs_dir = os.path.join(self.directory, "blobs")
+        entries = []
+        try:
+            names = os.listdir(blobs_dir)
+        except OSError:
+            return entries
+        for name in names:
+            blob_dir = os.path.join(blobs_dir, name)
+            try:
+                size = sum(entry.stat().st_size for entry in os.scandir(blob_dir) if entry.is_file())
+                entries.append((os.stat(blob_dir).st_mtime, size, blob_dir))
+            except OSError:
+                continue
+        return entries
+
+    def _added(self, size):
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(size for _, size, _ in self._scan())
+            else:
+                self._total_bytes += size
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # 其他进程也可能写入了缓存，淘汰前重新扫描
+        entries = sorted(self._scan())
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+        for _, size, blob_dir in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(blob_dir, ignore_errors=True)
+            total -= size
+            evicted += 1
+        self._total_bytes = total
+        if evicted:
+            # 指向已淘汰 blob 的 URL 记录在查找时会自然失效
+            logger.info(f"[BailianImageCache] 已淘汰 {evicted} 张缓存图片，当前占用 {total / 1024 / 1024:.1f}MB")
+
+    def stats(self):
+        entries = self._scan()
+        return {
+            "directory": self.directory,
+            "max_bytes": self.max_bytes,
+            "images": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """进程级的图片缓存，关闭缓存时返回 None"""
+    global _cache
+    if MAX_MB <= 0:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ImageCache(CACHE_DIR, int(MAX_MB * 1024 * 1024))
+        return _cache
+
+
+async def load_pixels(url, deadline=None):
+    """获取图片的 float32 像素数组 (h, w, 3)：缓存命中时直接 mmap，否则下载、解码并写入缓存"""
+    cache = get_cache()
+    if cache is not None:
+        pixels = cache.lookup(url)
+        if pixels is not None:
+            return pixels
+
+    data = await transport.request_bytes("GET", url, deadline=deadline)
+    # 解码在编解码进程池中执行，写盘放到线程中执行，都不阻塞事件循环
+    if cache is None:
+        return await codec.decode(data)
+    pixels = await asyncio.to_thread(cache.link, url, data)
+    if pixels is not None:
+        return pixels
+    decoded = await codec.decode(data)
+    return await asyncio.to_thread(cache.store, url, data, decoded)
+
+
+async def load_image(url, deadline=None):
+    """获取图片的 IMAGE 张量 (1, h, w, 3)"""
+    return utils.numpy2comfy(await load_pixels(url, deadline))
@@ -0,0 +1,86 @@
+import time
+
+from .lazy import lazy_import
+
+asyncio = lazy_import("asyncio")
+
+# 检查 ComfyUI 中断标志的粒度（秒）
+INTERRUPT_CHECK_INTERVAL = 0.2
+
+# comfy.model_management 会导入 torch，第一次检查中断标志时才导入；False 表示脱离 ComfyUI 运行
+_model_management = None
+_raised_class = None
+
+
+class InterruptProcessingException(Exception):
+    """插件内部捕获取消请求使用的异常类型
+
+    实际抛出的是同时继承 ComfyUI 的 InterruptProcessingException 的子类，ComfyUI 的执行器仍按取消处理。
+    """
+    pass
+
+
+def _get_model_management():
+    global _model_management
+    if _model_management is None:
+        try:
+            import comfy.model_management as model_management
+            _model_management = model_management
+        except ImportError:
+            # 脱离 ComfyUI 运行（如脚本调试）时没有中断标志
+            _model_management = False
+    return _model_management or None
+
+
+def _interrupt_exception():
+    global _raised_class
+    model_management = _get_model_management()
+    if model_management is None:
+        return InterruptProcessingException()
+    if _raised_class is None:
+        _raised_class = type("InterruptProcessingException", (InterruptProcessingException, model_management.InterruptProcessingException), {})
+    return _raised_class()
+
+
+def is_interrupted():
+    """ComfyUI 是否收到了取消请求"""
+    model_management = _get_model_management()
+    if model_management is None:
+        return False
+    return model_management.processing_interrupted()
+
+
+def check_interrupted():
+    """收到取消请求时抛出 InterruptProcessingException
+
+    不调用 throw_exception_if_processing_interrupted()，因为它会重置中断标志，
+    导致同一批次中其他并行等待的任务感知不到取消。ComfyUI 会在下一个 prompt 开始时重置标志。
+    """
+    if is_interrupted():
+        raise _interrupt_exception()
+
+
+async def async_sleep(seconds):
+    """可中断的 asyncio.sleep"""
+    end_time = time.monotonic() + seconds
+    while True:
+        check_interrupted()
+        remaining = end_time - time.monotonic()
+        if remaining <= 0:
+            return
+        await asyncio.sleep(min(INTERRUPT_CHECK_INTERVAL, remaining))
+
+
+async def wait_for(awaitable):
+    """等待一个协程完成，期间收到取消请求时取消它并抛出 InterruptProcessingException"""
+    check_interrupted()
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=INTERRUPT_CHECK_INTERVAL)
+            if done:
+                return task.result()
+            check_interrupted()
+    finally:
+        if not task.done():
+            task.cancel()
@@ -0,0 +1,34 @@
+import importlib
+import threading
+
+
+class LazyModule:
+    """模块代理：第一次访问属性时才真正导入模块，用于推迟 asyncio、aiohttp、torch 等重量级模块的加载"""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module {self._name!r} ({state})>"
+
+
+def lazy_import(name):
+    """返回模块的延迟导入代理，模块已经被导入过时直接返回模块本身"""
+    import sys
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    return LazyModule(name)
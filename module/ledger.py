@@ -0,0 +1,252 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import datetime
+import threading
+
+from . import interrupt
+from . import transport
+from .deadline import Deadline, CONNECT_TIMEOUT, READ_TIMEOUT
+from .lazy import lazy_import
+from .logging import logger
+
+asyncio = lazy_import("asyncio")
+
+
+# 是否记录异步任务的提交，重试和重新执行时复用已经提交的任务
+ENABLED = os.environ.get("BAILIAN_LEDGER", "1").lower() in ("1", "true", "yes", "on")
+# 账本文件，同一台机器上的多个 ComfyUI 进程共享
+LEDGER_PATH = os.environ.get("BAILIAN_LEDGER_PATH", os.path.join(os.path.expanduser("~"), ".cache", "comfyui-bailian", "ledger.sqlite3"))
+# 记录保留时间（秒），与 DashScope 任务结果的保留时间一致
+TTL = float(os.environ.get("BAILIAN_LEDGER_TTL", str(24 * 3600)))
+# 上一次提交结果未知、提交时间窗口内又有无法确认归属的任务时，是否仍然重新提交（可能产生重复计费的任务）
+RESUBMIT_UNKNOWN = os.environ.get("BAILIAN_LEDGER_RESUBMIT_UNKNOWN", "").lower() in ("1", "true", "yes", "on")
+
+TASKS_URL = "https://dashscope.aliyuncs.com/api/v1/tasks/"
+
+# 查询任务列表时在提交时间前后放宽的秒数（本机与服务端的时钟误差）
+_CLOCK_SLACK = 5
+# 任务列表的查询条件按北京时间
+_DASHSCOPE_TZ = datetime.timezone(datetime.timedelta(hours=8))
+
+# 本进程中正在处理的幂等键：同一个节点的两次执行并行提交相同的请求时，后一次等前一次拿到 task_id
+_sending = set()
+
+
+class UnknownSubmission(Exception):
+    """上一次提交的结果未知，DashScope 可能已经创建了任务，无法确认时拒绝自动重新提交"""
+    pass
+
+
+def idempotency_key(endpoint, headers, request_data, unique_id=None, slot=None, scope=None):
+    """一次逻辑提交的幂等键：请求内容 + API Key 的摘要 + 节点 ID（+ 批次内的序号）
+
+    不包含 prompt_id：ComfyUI 重新排队（包括崩溃重启后）会分配新的 prompt_id，
+    同一个节点的相同请求在 TTL 内仍然得到同一个键。scope 不为空时代替节点 ID，如批量任务的输出文件。
+    只用于异步任务；未开启账本、同步调用或没有节点 ID 时返回 None，按原来的方式直接提交。
+    """
+    if not ENABLED or headers.get("X-DashScope-Async") != "enable":
+        return None
+    if scope is None:
+        if unique_id is None:
+            return None
+        scope = ["node", unique_id]
+    identity = {
+        "endpoint": endpoint,
+        "request": request_data,
+        "credential": hashlib.sha256(headers.get("Authorization", "").encode("utf-8")).hexdigest(),
+        "scope": scope,
+        "slot": slot,
+    }
+    return hashlib.sha256(json.dumps(identity, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class Ledger:
+    """本地提交账本：发送前记录为 pending，收到 task_id 后记录为 submitted
+
+    pending 的记录表示上一次发送的结果未知（超时、进程崩溃），DashScope 可能已经创建了任务。
+    sqlite 等待其他进程的写锁时最长阻塞 10 秒，在事件循环中通过 asyncio.to_thread 调用。
+    """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS submissions ("
+            "key TEXT PRIMARY KEY, model TEXT, endpoint TEXT, task_id TEXT, sent_at REAL, updated_at REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS submissions_task_id ON submissions (task_id)")
+        self.purge()
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def purge(self):
+        self._execute("DELETE FROM submissions WHERE updated_at < ?", (time.time() - TTL,))
+
+    def get(self, key):
+        rows = self._execute("SELECT task_id, sent_at FROM submissions WHERE key = ? AND updated_at >= ?", (key, time.time() - TTL))
+        if not rows:
+            return None
+        return {"task_id": rows[0][0], "sent_at": rows[0][1]}
+
+    def begin(self, key, model, endpoint):
+        now = time.time()
+        self._execute(
+            "INSERT OR REPLACE INTO submissions (key, model, endpoint, task_id, sent_at, updated_at) VALUES (?, ?, ?, NULL, ?, ?)",
+            (key, model, endpoint, now, now),
+        )
+
+    def complete(self, key, task_id):
+        self._execute("UPDATE submissions SET task_id = ?, updated_at = ? WHERE key = ?", (task_id, time.time(), key))
+
+    def discard(self, key):
+        self._execute("DELETE FROM submissions WHERE key = ?", (key,))
+
+    def forget_task(self, task_id):
+        self._execute("DELETE FROM submissions WHERE task_id = ?", (task_id,))
+
+    def known_task_ids(self, task_ids):
+        if not task_ids:
+            return set()
+        placeholders = ",".join("?" * len(task_ids))
+        return {row[0] for row in self._execute(f"SELECT task_id FROM submissions WHERE task_id IN ({placeholders})", tuple(task_ids))}
+
+
+_ledger = None
+_ledger_lock = threading.Lock()
+
+
+def get_ledger():
+    global _ledger
+    with _ledger_lock:
+        if _ledger is None:
+            _ledger = Ledger(LEDGER_PATH)
+        return _ledger
+
+
+def _format_time(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, _DASHSCOPE_TZ).strftime("%Y%m%d%H%M%S")
+
+
+async def _recent_tasks(model, start, end, headers, deadline):
+    """查询 [start, end] 内创建的该模型的任务 ID"""
+    url = f"{TASKS_URL}?start_time={_format_time(start)}&end_time={_format_time(end)}&model_name={model}&page_size=100"
+    response = await transport.request_json("GET", url, headers={"Authorization": headers.get("Authorization", "")}, deadline=deadline)
+    task_ids = []
+    for task in response.get("data") or []:
+        created = task.get("gmt_create")
+        # gmt_create 为毫秒时间戳，比查询条件的秒级精度更准确
+        if isinstance(created, (int, float)) and not (start <= created / 1000 <= end):
+            continue
+        if task.get("task_id"):
+            task_ids.append(task["task_id"])
+    return task_ids
+
+
+async def _reconcile(ledger, record, model, headers, deadline):
+    """上一次发送结果未知时，确认 DashScope 没有创建任务后才允许重新提交
+
+    提交时间窗口内该模型没有账本之外的任务时，说明上一次提交没有被接受，可以安全地重新提交；
+    否则无法确认这些任务是否由它创建（可能属于其他进程或其他用户），抛出 UnknownSubmission，
+    除非设置了 RESUBMIT_UNKNOWN。查询任务列表失败时同样无法确认。
+    """
+    start = record["sent_at"] - _CLOCK_SLACK
+    end = record["sent_at"] + CONNECT_TIMEOUT + READ_TIMEOUT + _CLOCK_SLACK
+    try:
+        candidates = await _recent_tasks(model, start, end, headers, deadline or Deadline(CONNECT_TIMEOUT + READ_TIMEOUT))
+        known = await asyncio.to_thread(ledger.known_task_ids, candidates)
+    except (transport.RequestError, sqlite3.Error) as e:
+        reason = f"查询任务列表失败: {str(e)}"
+    else:
+        unclaimed = [task_id for task_id in candidates if task_id not in known]
+        if not unclaimed:
+            logger.info(f"[BailianLedger] 上一次提交没有创建任务，重新提交")
+            return
+        reason = f"提交时间窗口内有 {len(unclaimed)} 个可能由它创建的任务: {', '.join(unclaimed)}"
+
+    if RESUBMIT_UNKNOWN:
+        logger.info(f"[BailianLedger] 上一次提交结果未知（{reason}），按 BAILIAN_LEDGER_RESUBMIT_UNKNOWN 重新提交")
+        return
+    raise UnknownSubmission(
+        f"上一次提交的结果未知，DashScope 可能已经创建了任务（{reason}）。"
+        f"可以用 BailianAPIPoll 查询这些任务；确认需要重新提交时设置 BAILIAN_LEDGER_RESUBMIT_UNKNOWN=1，"
+        f"或等待 {TTL:.0f} 秒后记录过期"
+    )
+
+
+def _reused(task_id):
+    # 与提交接口的返回格式一致，调用方按 PENDING 继续轮询，任务已结束时第一次查询即返回结果
+    return {"output": {"task_id": task_id, "task_status": "PENDING"}, "ledger": "reused"}
+
+
+async def _record(action, *args):
+    """提交后更新记录，账本出错时只记录日志，不影响已经拿到的结果"""
+    try:
+        await asyncio.to_thread(action, *args)
+    except sqlite3.Error as e:
+        logger.info(f"[BailianLedger] 更新记录失败: {str(e)}")
+
+
+async def submit(key, endpoint, headers, request_data, deadline, send):
+    """按幂等键提交任务：账本中已有 task_id 时直接复用，否则调用 send() 提交
+
+    上一次发送结果未知时先对账（见 _reconcile），不能确认没有创建任务时抛出 UnknownSubmission。
+    本进程中相同的键依次处理，后来的提交读到前一次记录的 task_id 后直接复用。
+    """
+    while key in _sending:
+        if deadline is not None:
+            deadline.check("等待相同请求的提交")
+        await interrupt.async_sleep(0.2)
+    _sending.add(key)
+    try:
+        return await _submit(key, endpoint, headers, request_data, deadline, send)
+    finally:
+        _sending.discard(key)
+
+
+async def _submit(key, endpoint, headers, request_data, deadline, send):
+    model = request_data.get("model", "")
+    try:
+        ledger = await asyncio.to_thread(get_ledger)
+        record = await asyncio.to_thread(ledger.get, key)
+    except (sqlite3.Error, OSError) as e:
+        logger.info(f"[BailianLedger] 账本不可用，直接提交: {str(e)}")
+        return await send()
+
+    if record is not None:
+        if record["task_id"]:
+            logger.info(f"[BailianLedger] 复用已提交的任务: {record['task_id']}")
+            return _reused(record["task_id"])
+        await _reconcile(ledger, record, model, headers, deadline)
+
+    await _record(ledger.begin, key, model, endpoint)
+    try:
+        response_data = await send()
+    except transport.APIError as e:
+        # 4xx 说明请求被拒绝，没有创建任务；5xx 时任务可能已经创建，保留 pending 记录
+        if e.status < 500:
+            await _record(ledger.discard, key)
+        raise
+    task_id = response_data.get("output", {}).get("task_id")
+    if task_id:
+        await _record(ledger.complete, key, task_id)
+    else:
+        await _record(ledger.discard, key)
+    return response_data
+
+
+async def forget_task(task_id):
+    """任务失败或被取消后删除对应的记录，之后重试时重新提交而不是复用失败的任务"""
+    if not ENABLED:
+        return
+    try:
+        ledger = await asyncio.to_thread(get_ledger)
+        await asyncio.to_thread(ledger.forget_task, task_id)
+    except (sqlite3.Error, OSError) as e:
+        logger.info(f"[BailianLedger] 删除记录失败: {str(e)}")
@@ -1,148 +1,192 @@
+import os
 import json
-import requests
 import time
-import asyncio
-import aiohttp
+from . import interrupt
+from . import callback
+from . import eventloop
+from . import transport
+from . import image_cache
+from . import preflight as preflight_module
+from . import preprocess as preprocess_module
+from . import upload
+from . import hedge
+from . import batch_job
+from . import profiling
+from . import ledger
+from . import coordination
+from . import adaptive
+from . import archive
+from . import pipeline
+from . import utils
+from .interrupt import InterruptProcessingException
+from .deadline import Deadline
+from .context import owner_key
+from .scheduler import scheduler
+from .registry import registry
+from .lazy import lazy_import
 from .logging import logger
 
+asyncio = lazy_import("asyncio")
 
-def _poll_task_result(task_id, api_key, poll_interval, max_wait_time):
-    """轮询任务结果"""
-    task_url = f"https://dashscope.aliyuncs.com/api/v1/tasks/{task_id}"
+
+async def _async_cancel_task(task_id, api_key):
+    """异步取消远端任务（仅 PENDING 状态的任务可以被取消），尽力而为"""
+    cancel_url = f"https://dashscope.aliyuncs.com/api/v1/tasks/{task_id}/cancel"
     headers = {
         "Authorization": f"Bearer {api_key}" if api_key else ""
     }
-    
-    start_time = time.time()
-    
+    try:
+        await transport.request_json("POST", cancel_url, headers=headers, deadline=Deadline(3))
+        logger.info(f"[BailianAPI] 已取消任务: {task_id}")
+    except Exception as e:
+        logger.info(f"[BailianAPI] 取消任务失败: {task_id} {str(e)}")
+
+async def _async_submit_task(endpoint, headers, request_data, deadline, ledger_key=None, slot=None, phase="task"):
+    """提交任务，等待期间可被 ComfyUI 取消
+
+    ledger_key 不为空时通过提交账本去重；配置了协调后端时还会遵守集群共享的提交配额，
+    并复用其他进程提交的相同请求（slot 为批次内的序号，区分批次中相同的参数）。
+    拿到 task_id 的任务按 phase（coarse、refiner、hedge 等）登记到任务登记表。
+    """
+    async def post():
+        # 扇出的条目已经在整个任务期间占用了该接口地址的自适应并发名额，其他提交只在请求期间占用；提交结果反馈给自适应并发控制
+        async with adaptive.slot(endpoint, deadline):
+            started = time.monotonic()
+            try:
+                response_data = await interrupt.wait_for(transport.request_json("POST", endpoint, headers=headers, json=request_data, deadline=deadline))
+            except transport.APIError as e:
+                if e.status == 429:
+                    adaptive.record_throttle(endpoint, started)
+                raise
+            adaptive.record_success(endpoint, started, time.monotonic() - started)
+            return response_data
+
+    def send():
+        return coordination.submit(coordination.work_key(endpoint, headers, request_data, slot), post, deadline)
+
+    if ledger_key is None:
+        response_data = await send()
+    else:
+        response_data = await ledger.submit(ledger_key, endpoint, headers, request_data, deadline, send)
+    output = response_data.get("output", {})
+    if output.get("task_id"):
+        registry.submitted(output["task_id"], request_data.get("model", ""), phase, output.get("task_status", "PENDING"))
+    return response_data
+
+async def _async_submit_with_retry(endpoint, headers, request_data, deadline, max_retries, ledger_key=None, slot=None, phase="task", throttle_only=False):
+    """提交任务，遇到网络错误、限流（429）或服务端错误（5xx）时指数退避重试
+
+    重试使用同一个幂等键，上一次超时但服务端已经创建了任务时复用该任务，不会重复提交。
+    throttle_only 为 True 时只重试限流（请求被拒绝，一定没有创建任务）。
+    """
+    attempt = 0
     while True:
         try:
-            # 检查是否超时
-            if time.time() - start_time > max_wait_time:
-                error_msg = f"任务轮询超时 ({max_wait_time}秒)"
-                logger.info(f"[BailianAPI] {error_msg}")
-                return {"error": error_msg, "task_id": task_id}
-            
-            logger.info(f"[BailianAPI] 轮询任务状态: {task_id}")
-            
-            # 查询任务状态
-            response = requests.get(task_url, headers=headers, timeout=10)
-            response.raise_for_status()
-            
-            result_data = response.json()
-            task_status = result_data.get("output", {}).get("task_status", "")
-            
-            logger.info(f"[BailianAPI] 任务状态: {task_status}")
-            
-            # 任务完成
-            if task_status == "SUCCEEDED":
-                logger.info(f"[BailianAPI] 任务完成成功")
-                return result_data
-            
-            # 任务失败
-            elif task_status == "FAILED":
-                error_code = result_data.get("output", {}).get("code", "unknown")
-                error_message = result_data.get("output", {}).get("message", "任务执行失败")
-                logger.info(f"[BailianAPI] 任务执行失败: {error_code} - {error_message}")
-                return result_data
-            
-            # 继续等待
-            elif task_status in ["PENDING", "RUNNING"]:
-                time.sleep(poll_interval)
-                continue
-            
-            # 未知状态
-            else:
-                logger.info(f"[BailianAPI] 未知任务状态: {task_status}")
-                return result_data
-                
-        except requests.exceptions.RequestException as e:
-            error_msg = f"轮询请求失败: {str(e)}"
-            logger.info(f"[BailianAPI] {error_msg}，继续重试...")
-            # 检查是否超时
-            if time.time() - start_time > max_wait_time:
-                error_msg = f"任务轮询超时 ({max_wait_time}秒)，最后一次请求失败: {str(e)}"
-                logger.info(f"[BailianAPI] {error_msg}")
-                return {"error": error_msg, "task_id": task_id}
-            # 等待后继续重试
-            time.sleep(poll_interval)
-            continue
-            
-        except Exception as e:
-            error_msg = f"轮询过程出错: {str(e)}"
-            logger.info(f"[BailianAPI] {error_msg}，继续重试...")
-            # 检查是否超时
-            if time.time() - start_time > max_wait_time:
-                error_msg = f"任务轮询超时 ({max_wait_time}秒)，最后一次请求出错: {str(e)}"
-                logger.info(f"[BailianAPI] {error_msg}")
-                return {"error": error_msg, "task_id": task_id}
-            # 等待后继续重试
-            time.sleep(poll_interval)
-            continue
+            return await _async_submit_task(endpoint, headers, request_data, deadline, ledger_key, slot, phase)
+        except transport.RequestError as e:
+            throttled = isinstance(e, transport.APIError) and e.status == 429
+            retryable = throttled if throttle_only else (not isinstance(e, transport.APIError) or throttled or e.status >= 500)
+            backoff = min(2 ** attempt, 30)
+            if not retryable or attempt >= max_retries or deadline.remaining() <= backoff:
+                raise
+            attempt += 1
+            logger.info(f"[BailianAPI] 提交失败: {str(e)}，{backoff}秒后第 {attempt} 次重试...")
+            await interrupt.async_sleep(backoff)
 
-async def _async_poll_task_result(session, task_id, api_key, poll_interval, max_wait_time):
-    """异步轮询任务结果"""
+async def _async_query_task(task_id, api_key, deadline):
+    """查询一次任务状态，回调模式下优先使用已推送的结果"""
+    result_data = callback.take(task_id)
+    if result_data is None:
+        # 其他进程已经拿到的结果（包括投递到其他进程的回调）
+        result_data = await coordination.cached_result(task_id)
+    if result_data is None:
+        result_data = await _async_fetch_task(task_id, api_key, deadline)
+    registry.polled(task_id, result_data.get("output", {}).get("task_status", ""))
+    return result_data
+
+async def _async_fetch_task(task_id, api_key, deadline):
+    """向 DashScope 查询任务状态，结束的结果写入协调后端供其他进程复用"""
     task_url = f"https://dashscope.aliyuncs.com/api/v1/tasks/{task_id}"
     headers = {
         "Authorization": f"Bearer {api_key}" if api_key else ""
     }
-    
-    start_time = time.time()
-    
-    while True:
-        try:
-            # 检查是否超时
-            if time.time() - start_time > max_wait_time:
-                error_msg = f"任务轮询超时 ({max_wait_time}秒)"
-                logger.info(f"[BailianAPI] {error_msg}")
-                return {"error": error_msg, "task_id": task_id}
-            
-            logger.info(f"[BailianAPI] 轮询任务状态: {task_id}")
-            
-            # 查询任务状态
-            async with session.get(task_url, headers=headers) as response:
-                response.raise_for_status()
-                result_data = await response.json()
-            
-            task_status = result_data.get("output", {}).get("task_status", "")
-            logger.info(f"[BailianAPI] 任务状态: {task_status}")
-            
-            # 任务完成
-            if task_status == "SUCCEEDED":
-                logger.info(f"[BailianAPI] 任务完成成功")
-                return result_data
-            
-            # 任务失败
-            elif task_status == "FAILED":
-                error_code = result_data.get("output", {}).get("code", "unknown")
-                error_message = result_data.get("output", {}).get("message", "任务执行失败")
-                logger.info(f"[BailianAPI] 任务执行失败: {error_code} - {error_message}")
-                return result_data
+    result_data = await interrupt.wait_for(transport.request_json("GET", task_url, headers=headers, deadline=deadline))
+    if result_data.get("output", {}).get("task_status") in callback.TERMINAL_STATUSES:
+        await coordination.store_result(task_id, result_data)
+    return result_data
+
+async def _forget_task(task_id):
+    """任务失败或被取消后删除账本和协调后端中的记录，之后相同的请求重新提交而不是复用这个任务"""
+    await ledger.forget_task(task_id)
+    await coordination.forget_task(task_id)
+
+async def _async_poll_task_result(task_id, api_key, poll_interval, deadline):
+    """在 deadline 的剩余预算内异步轮询任务结果，收到取消请求时取消远端任务并抛出 InterruptProcessingException"""
+    try:
+        while True:
+            try:
+                # 检查是否超时
+                if deadline.expired():
+                    error_msg = f"任务轮询超时 ({deadline.budget}秒)"
+                    logger.info(f"[BailianAPI] {error_msg}")
+                    registry.finished(task_id, "TIMEOUT")
+                    return {"error": error_msg, "task_id": task_id}
+                
+                logger.info(f"[BailianAPI] 轮询任务状态: {task_id}")
+                
+                # 查询任务状态
+                result_data = await _async_query_task(task_id, api_key, deadline)
+                
+                task_status = result_data.get("output", {}).get("task_status", "")
+                logger.info(f"[BailianAPI] 任务状态: {task_status}")
+                
+                # 任务完成
+                if task_status == "SUCCEEDED":
+                    logger.info(f"[BailianAPI] 任务完成成功")
+                    return result_data
+                
+                # 任务失败
+                elif task_status == "FAILED":
+                    error_code = result_data.get("output", {}).get("code", "unknown")
+                    error_message = result_data.get("output", {}).get("message", "任务执行失败")
+                    logger.info(f"[BailianAPI] 任务执行失败: {error_code} - {error_message}")
+                    await _forget_task(task_id)
+                    return result_data
+                
+                # 继续等待
+                elif task_status in ["PENDING", "RUNNING"]:
+                    await callback.async_wait(task_id, min(callback.next_poll_interval(poll_interval), deadline.remaining()))
+                    continue
+                
+                # 未知状态
+                else:
+                    logger.info(f"[BailianAPI] 未知任务状态: {task_status}")
+                    return result_data
             
-            # 继续等待
-            elif task_status in ["PENDING", "RUNNING"]:
-                await asyncio.sleep(poll_interval)
+            except InterruptProcessingException:
+                raise
+                    
+            except Exception as e:
+                error_msg = f"轮询过程出错: {str(e)}"
+                logger.info(f"[BailianAPI] {error_msg}，继续重试...")
+                # 检查是否超时
+                if deadline.expired():
+                    error_msg = f"任务轮询超时 ({deadline.budget}秒)，最后一次请求出错: {str(e)}"
+                    logger.info(f"[BailianAPI] {error_msg}")
+                    registry.finished(task_id, "TIMEOUT")
+                    return {"error": error_msg, "task_id": task_id}
+                # 等待后继续重试
+                await interrupt.async_sleep(min(poll_interval, deadline.remaining()))
                 continue
-            
-            # 未知状态
-            else:
-                logger.info(f"[BailianAPI] 未知任务状态: {task_status}")
-                return result_data
-                
-        except Exception as e:
-            error_msg = f"轮询过程出错: {str(e)}"
-            logger.info(f"[BailianAPI] {error_msg}，继续重试...")
-            # 检查是否超时
-            if time.time() - start_time > max_wait_time:
-                error_msg = f"任务轮询超时 ({max_wait_time}秒)，最后一次请求出错: {str(e)}"
-                logger.info(f"[BailianAPI] {error_msg}")
-                return {"error": error_msg, "task_id": task_id}
-            # 等待后继续重试
-            await asyncio.sleep(poll_interval)
-            continue
+    except (InterruptProcessingException, asyncio.CancelledError):
+        logger.info(f"[BailianAPI] 收到取消请求，停止轮询任务: {task_id}")
+        await asyncio.shield(_async_cancel_task(task_id, api_key))
+        registry.finished(task_id, "CANCELED")
+        await asyncio.shield(_forget_task(task_id))
+        raise
 
-async def _async_create_and_poll_refiner_task(session, endpoint, gender, input, result_image_url, api_key, poll_interval, max_wait_time):
-    """异步创建和轮询refiner任务"""
+async def _async_create_and_poll_refiner_task(endpoint, gender, input, result_image_url, api_key, poll_interval, deadline):
+    """异步创建和轮询refiner任务，只使用粗略结果完成后剩余的时间预算"""
     request_data = {
         "model": "aitryon-refiner",
         "input": {
@@ -154,18 +198,20 @@ async def _async_create_and_poll_refiner_task(session, endpoint, gender, input,
         }
     }
     logger.info(f"[VirtualTryOn Refiner] 发送请求到: {endpoint}, 请求数据: {request_data}")
+    deadline.check("提交refiner任务")
     
     headers = {
         "Content-Type": "application/json",
         "Authorization": f"Bearer {api_key}" if api_key else "",
         "X-DashScope-Async": "enable"
     }
+    # 输入图片经过预处理上传到临时存储空间时需要解析 oss:// 地址
+    if any(isinstance(value, str) and value.startswith("oss://") for value in input.values()):
+        headers[upload.OSS_RESOLVE_HEADER] = "enable"
     
-    async with session.post(endpoint, headers=headers, json=request_data) as response:
-        if response.status != 200:
-            response_text = await response.text()
-            raise ValueError(f"API 请求失败: {response.status} {response_text}")
-        response_data = await response.json()
+    # refiner 的输入包含粗略结果的地址，不会与其他任务冲突
+    ledger_key = ledger.idempotency_key(endpoint, headers, request_data, scope=["refiner"])
+    response_data = await _async_submit_with_retry(endpoint, headers, request_data, deadline, adaptive.THROTTLE_RETRIES, ledger_key, phase="refiner", throttle_only=True)
     
     logger.info(f"[VirtualTryOn] 请求成功: {response_data}")
     
@@ -178,21 +224,48 @@ async def _async_create_and_poll_refiner_task(session, endpoint, gender, input,
         
         # 如果任务是PENDING状态，开始轮询
         if task_status == "PENDING":
-            response_data = await _async_poll_task_result(session, task_id, api_key, poll_interval, max_wait_time)
+            response_data = await _async_poll_task_result(task_id, api_key, poll_interval, deadline)
             return response_data
         else:
             return response_data
     else:
         return response_data
 
-async def _async_process_single_person(session, person_image, top_garment_image, bottom_garment_image, model, parameters, endpoint, headers, async_mode, enable_refiner, gender, api_key, poll_interval, max_wait_time):
-    """异步处理单个人物图像"""
+async def _async_submit_and_poll(endpoint, headers, request_data, api_key, poll_interval, deadline):
+    """提交任务并轮询到结束（用于对冲任务）"""
+    response_data = await _async_submit_task(endpoint, headers, request_data, deadline, phase="hedge")
+    if response_data.get("output", {}).get("task_status", "") == "PENDING":
+        return await _async_poll_task_result(response_data["output"]["task_id"], api_key, poll_interval, deadline)
+    return response_data
+
+def _tryon_input(person_image, top_garment_image, bottom_garment_image):
+    return {
+        "top_garment_url": top_garment_image,
+        "bottom_garment_url": bottom_garment_image if bottom_garment_image is not None and bottom_garment_image.strip() != "" else "",
+        "person_image_url": person_image,
+    }
+
+async def _async_refine(response_data, input, endpoint, gender, api_key, poll_interval, deadline):
+    """用粗略结果创建 refiner 任务并等待结果，refiner 失败时保留粗略结果"""
     try:
-        input = {
-            "top_garment_url": top_garment_image,
-            "bottom_garment_url": bottom_garment_image if bottom_garment_image is not None and bottom_garment_image.strip() != "" else "",
-            "person_image_url": person_image,
-        }
+        return await _async_create_and_poll_refiner_task(endpoint, gender, input, response_data["output"]["image_url"], api_key, poll_interval, deadline)
+    except InterruptProcessingException:
+        raise
+    except Exception as e:
+        error_msg = f"处理refiner任务失败: {str(e)}"
+        logger.info(f"[VirtualTryOn] {error_msg}")
+        return response_data
+
+async def _async_process_single_person(person_image, top_garment_image, bottom_garment_image, model, parameters, endpoint, headers, async_mode, enable_refiner, gender, api_key, poll_interval, deadline, hedged=False, ledger_identity=None, public_input=None):
+    """异步处理单个人物图像，hedged 为 True 时粗略结果的任务按对冲策略处理长尾
+
+    ledger_identity 为幂等键的参数（unique_id、slot、scope），见 ledger.idempotency_key；
+    public_input 为使用原图公网地址的输入：预处理上传的 oss:// 地址只对 model 有效，
+    refiner 和使用其他模型的对冲任务改用原图
+    """
+    try:
+        input = _tryon_input(person_image, top_garment_image, bottom_garment_image)
+        public_input = public_input or input
         request_data = {
             "model": model,
             "input": input,
@@ -203,12 +276,13 @@ async def _async_process_single_person(session, person_image, top_garment_image,
             request_data["parameters"] = {}
         
         logger.info(f"[VirtualTryOn] 发送请求到: {endpoint}, 请求数据: {request_data}")
+        deadline.check("提交任务")
         
-        async with session.post(endpoint, headers=headers, json=request_data) as response:
-            if response.status != 200:
-                response_text = await response.text()
-                raise ValueError(f"API 请求失败: {response.status} {response_text}")
-            response_data = await response.json()
+        started_at = time.monotonic()
+        ledger_key = ledger.idempotency_key(endpoint, headers, request_data, **ledger_identity) if ledger_identity is not None else None
+        slot = ledger_identity.get("slot") if ledger_identity is not None else None
+        # 被限流时自适应上限已经下调，退避后重试，不直接让这个人物失败
+        response_data = await _async_submit_with_retry(endpoint, headers, request_data, deadline, adaptive.THROTTLE_RETRIES, ledger_key, slot, phase="coarse", throttle_only=True)
         
         logger.info(f"[VirtualTryOn] 请求成功: {response_data}")
         
@@ -221,70 +295,34 @@ async def _async_process_single_person(session, person_image, top_garment_image,
             
             # 如果任务是PENDING状态，开始轮询
             if task_status == "PENDING":
-                response_data = await _async_poll_task_result(session, task_id, api_key, poll_interval, max_wait_time)
+                # 对冲任务可以使用备用的接口地址和模型
+                alternate_model = hedge.ALTERNATE_MODEL or model
+                hedge_request_data = dict(request_data, model=alternate_model, input=input if alternate_model == model else public_input)
+                response_data = await hedge.policy.run(
+                    _async_poll_task_result(task_id, api_key, poll_interval, deadline),
+                    lambda: _async_submit_and_poll(hedge.ALTERNATE_ENDPOINT or endpoint, headers, hedge_request_data, api_key, poll_interval, deadline),
+                    model, started_at, enabled=hedged
+                )
                 if enable_refiner:
-                    try:
-                        response_data = await _async_create_and_poll_refiner_task(session, endpoint, gender, input, response_data["output"]["image_url"], api_key, poll_interval, max_wait_time)
-                    except Exception as e:
-                        error_msg = f"处理refiner任务失败: {str(e)}"
-                        logger.info(f"[VirtualTryOn] {error_msg}")
+                    response_data = await _async_refine(response_data, public_input, endpoint, gender, api_key, poll_interval, deadline)
                         
-                return response_data
+            return response_data
         else:
             # 同步模式
             if enable_refiner:
-                try:
-                    response_data = await _async_create_and_poll_refiner_task(session, endpoint, gender, input, response_data["output"]["image_url"], api_key, poll_interval, max_wait_time)
-                except Exception as e:
-                    error_msg = f"处理refiner任务失败: {str(e)}"
-                    logger.info(f"[VirtualTryOn] {error_msg}")
+                response_data = await _async_refine(response_data, public_input, endpoint, gender, api_key, poll_interval, deadline)
             return response_data
+    
+    except InterruptProcessingException:
+        raise
             
     except Exception as e:
         error_msg = f"处理人物图像失败: {str(e)}"
         logger.info(f"[VirtualTryOn] {error_msg}")
         return {"error": error_msg, "person_image": person_image}
 
-def create_and_poll_refiner_task(endpoint, gender, input, result_image_url, api_key, poll_interval, max_wait_time):
-    request_data = {
-        "model": "aitryon-refiner",
-        "input": {
-            "coarse_image_url": result_image_url,
-            **input
-        },
-        "parameters": {
-            "gender": gender,
-        }
-    }
-    logger.info(f"[VirtualTryOn Refiner] 发送请求到: {endpoint}, 请求数据: {request_data}")
-    # 设置请求头
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {api_key}" if api_key else "",
-        "X-DashScope-Async": "enable"
-    }
-    
-    response = requests.post(endpoint, headers=headers, json=request_data)
-    if response.status_code != 200:
-        raise ValueError(f"API 请求失败: {response.status_code} {response.text}")
-    response_data = response.json()
-    logger.info(f"[VirtualTryOn] 请求成功: {response_data}")
-    # 如果是异步模式且有task_id，需要轮询结果
-    if "output" in response_data and "task_id" in response_data["output"]:
-        task_id = response_data["output"]["task_id"]
-        task_status = response_data["output"].get("task_status", "")
-        
-        logger.info(f"[BailianAPI] 获取到任务ID: {task_id}, 状态: {task_status}")
-        
-        # 如果任务是PENDING状态，开始轮询
-        if task_status == "PENDING":
-            response_data = _poll_task_result(task_id, api_key, poll_interval, max_wait_time)
-            return response_data
-        else:
-            return response_data
-    else:
-        return response_data
-
+@profiling.profiled
+@eventloop.async_node
 class BailianAPI:
     @classmethod
     def INPUT_TYPES(s):
@@ -299,6 +337,10 @@ class BailianAPI:
                 "async_mode": ("BOOLEAN", {"default": True}),
                 "poll_interval": ("INT", {"default": 3, "min": 1, "max": 30}),
                 "max_wait_time": ("INT", {"default": 300, "min": 30, "max": 1800}),
+                "priority": ("INT", {"default": 1, "min": 1, "max": 10}),
+            },
+            "hidden": {
+                "unique_id": "UNIQUE_ID",
             }
         }
 
@@ -311,7 +353,11 @@ class BailianAPI:
 
     CATEGORY = "Malette"
 
-    def run(self, endpoint, params, api_key="", model="aitryon-plus", async_mode=True, poll_interval=3, max_wait_time=300):
+    async def run(self, endpoint, params, api_key="", model="aitryon-plus", async_mode=True, poll_interval=3, max_wait_time=300, priority=1, unique_id=None):
+        # 提交、轮询共享同一个截止时间
+        deadline = Deadline(max_wait_time)
+        owner = owner_key(unique_id)
+        acquired = False
         try:
             # 解析输入参数
             input_params = json.loads(params) if isinstance(params, str) else params
@@ -333,21 +379,15 @@ class BailianAPI:
             if async_mode:
                 headers["X-DashScope-Async"] = "enable"
             
-            logger.info(f"[BailianAPI] 发送请求到: {endpoint}")
+            # 在进程级调度器中排队，任务结束前一直占用名额
+            await scheduler.async_acquire(owner, priority, deadline)
+            acquired = True
             
-            # 发送 POST 请求
-            response = requests.post(
-                endpoint,
-                headers=headers,
-                json=request_data,
-                timeout=30
-            )
-            
-            # 检查响应状态
-            response.raise_for_status()
+            logger.info(f"[BailianAPI] 发送请求到: {endpoint}")
             
-            # 返回响应内容
-            response_data = response.json()
+            # 发送 POST 请求，重新执行时复用账本中已经提交的任务
+            ledger_key = ledger.idempotency_key(endpoint, headers, request_data, unique_id)
+            response_data = await _async_submit_task(endpoint, headers, request_data, deadline, ledger_key)
             
             # 如果是异步模式且有task_id，需要轮询结果
             if async_mode and "output" in response_data and "task_id" in response_data["output"]:
@@ -358,13 +398,16 @@ class BailianAPI:
                 
                 # 如果任务是PENDING状态，开始轮询
                 if task_status == "PENDING":
-                    task_result = _poll_task_result(task_id, api_key, poll_interval, max_wait_time)
+                    task_result = await _async_poll_task_result(task_id, api_key, poll_interval, deadline)
                     return (json.dumps(task_result, ensure_ascii=False, indent=2),)
                 
             # 直接返回结果（同步模式或已完成的任务）
             return (json.dumps(response_data, ensure_ascii=False, indent=2),)
+        
+        except InterruptProcessingException:
+            raise
             
-        except requests.exceptions.RequestException as e:
+        except transport.RequestError as e:
             error_msg = f"API 请求失败: {str(e)}"
             logger.info(f"[BailianAPI] {error_msg}")
             return (json.dumps({"error": error_msg}, ensure_ascii=False),)
@@ -378,7 +421,164 @@ class BailianAPI:
             error_msg = f"未知错误: {str(e)}"
             logger.info(f"[BailianAPI] {error_msg}")
             return (json.dumps({"error": error_msg}, ensure_ascii=False),)
+        
+        finally:
+            if acquired:
+                scheduler.release(owner)
+
+def _render_template(template, value, placeholder):
+    """用一个替换值渲染参数模板：值为对象时按键替换 {{key}}，否则替换 placeholder"""
+    replacements = {f"{{{{{key}}}}}": v for key, v in value.items()} if isinstance(value, dict) else {placeholder: value}
+    for name, v in replacements.items():
+        # 占位符单独作为一个 JSON 字符串时整体替换，数字、对象等非字符串值可以保留类型
+        template = template.replace(json.dumps(name), json.dumps(v, ensure_ascii=False))
+        text = v if isinstance(v, str) else json.dumps(v, ensure_ascii=False)
+        template = template.replace(name, json.dumps(text, ensure_ascii=False)[1:-1])
+    return json.loads(template)
+
+
+@profiling.profiled
+@eventloop.async_node
+class BailianAPIBatch:
+    """批量调用阿里云百炼API：并发提交、轮询多组参数，按输入顺序返回结果"""
+    
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "endpoint": ("STRING", {"default": "https://dashscope.aliyuncs.com/api/v1/services/aigc/image2image/image-synthesis/"}),
+                "params": ("STRING", {"forceInput": True}),
+            },
+            "optional": {
+                "values": ("STRING", {"default": ""}),
+                "placeholder": ("STRING", {"default": "{{value}}"}),
+                "api_key": ("STRING", {"default": ""}),
+                "model": ("STRING", {"default": "aitryon-plus"}),
+                "async_mode": ("BOOLEAN", {"default": True}),
+                "max_concurrency": ("INT", {"default": 8, "min": 1, "max": 100}),
+                "max_retries": ("INT", {"default": 2, "min": 0, "max": 10}),
+                "poll_interval": ("INT", {"default": 3, "min": 1, "max": 30}),
+                "max_wait_time": ("INT", {"default": 600, "min": 30, "max": 7200}),
+                "priority": ("INT", {"default": 1, "min": 1, "max": 10}),
+            },
+            "hidden": {
+                "unique_id": "UNIQUE_ID",
+            }
+        }
+
+    RETURN_TYPES = ("STRING",)
+    RETURN_NAMES = ("responses",)
+
+    FUNCTION = "run"
+
+    OUTPUT_NODE = True
+
+    CATEGORY = "Malette"
+
+    def _build_items(self, params, values, placeholder):
+        """params 为 {input, parameters} 列表；或者为单个模板，配合 values 中的每个替换值生成一组参数"""
+        if values is not None and values.strip() != "":
+            value_list = json.loads(values)
+            if not isinstance(value_list, list):
+                raise ValueError("values 必须是 JSON 数组")
+            template = params if isinstance(params, str) else json.dumps(params, ensure_ascii=False)
+            return [_render_template(template, value, placeholder) for value in value_list]
+
+        items = json.loads(params) if isinstance(params, str) else params
+        if not isinstance(items, list):
+            raise ValueError("params 必须是 JSON 数组，或者配合 values 使用单个模板")
+        return items
+
+    async def _run_item(self, index, item, endpoint, headers, model, api_key, async_mode, poll_interval, max_retries, deadline, unique_id):
+        try:
+            request_data = {
+                "model": item.get("model", model),
+                "input": item.get("input", {}),
+                "parameters": item.get("parameters", {})
+            }
+            deadline.check("提交任务")
+            # 批次中可能有相同的参数，幂等键中包含序号
+            ledger_key = ledger.idempotency_key(endpoint, headers, request_data, unique_id, slot=index)
+            response_data = await _async_submit_with_retry(endpoint, headers, request_data, deadline, max_retries, ledger_key, index)
+
+            # 如果是异步模式且有task_id，需要轮询结果
+            if async_mode and "output" in response_data and "task_id" in response_data["output"]:
+                task_id = response_data["output"]["task_id"]
+                logger.info(f"[BailianAPIBatch] 第 {index+1} 项获取到任务ID: {task_id}")
+                if response_data["output"].get("task_status", "") == "PENDING":
+                    response_data = await _async_poll_task_result(task_id, api_key, poll_interval, deadline)
+            return response_data
+
+        except InterruptProcessingException:
+            raise
+
+        except Exception as e:
+            error_msg = f"处理第 {index+1} 项失败: {str(e)}"
+            logger.info(f"[BailianAPIBatch] {error_msg}")
+            return {"error": error_msg, "index": index}
+
+    async def run(self, endpoint, params, values="", placeholder="{{value}}", api_key="", model="aitryon-plus", async_mode=True, max_concurrency=8, max_retries=2, poll_interval=3, max_wait_time=600, priority=1, unique_id=None):
+        try:
+            items = self._build_items(params, values, placeholder)
+            if len(items) == 0:
+                raise ValueError("params 不能为空")
+
+            # 设置请求头
+            headers = {
+                "Content-Type": "application/json",
+                "Authorization": f"Bearer {api_key}" if api_key else ""
+            }
+            
+            # 如果启用异步模式，添加异步头
+            if async_mode:
+                headers["X-DashScope-Async"] = "enable"
+
+            # 整个批次共享同一个截止时间
+            deadline = Deadline(max_wait_time)
+            owner = owner_key(unique_id)
+            # 本节点自身的并发上限，同时还受接口地址的自适应并发上限和进程级调度器的名额限制
+            semaphore = asyncio.Semaphore(max_concurrency)
+
+            async def process_scheduled(index, item):
+                async with semaphore:
+                    async with adaptive.slot(endpoint, deadline), scheduler.async_slot(owner, priority, deadline):
+                        return await self._run_item(index, item, endpoint, headers, model, api_key, async_mode, poll_interval, max_retries, deadline, unique_id)
+
+            logger.info(f"[BailianAPIBatch] 开始并发处理 {len(items)} 项，并发上限: {max_concurrency}")
+            response_data_list = await asyncio.gather(*[process_scheduled(i, item) for i, item in enumerate(items)], return_exceptions=True)
+            for result in response_data_list:
+                if isinstance(result, InterruptProcessingException):
+                    logger.info(f"[BailianAPIBatch] 收到取消请求，已停止所有任务的处理")
+                    raise result
+
+            processed_results = []
+            for i, result in enumerate(response_data_list):
+                if isinstance(result, Exception):
+                    error_msg = f"处理第 {i+1} 项时发生异常: {str(result)}"
+                    logger.info(f"[BailianAPIBatch] {error_msg}")
+                    processed_results.append({"error": error_msg, "index": i})
+                else:
+                    processed_results.append(result)
+
+            logger.info(f"[BailianAPIBatch] 处理完成，成功 {len([r for r in processed_results if 'error' not in r])} 项，失败 {len([r for r in processed_results if 'error' in r])} 项")
+            return (json.dumps(processed_results, ensure_ascii=False, indent=2),)
+
+        except InterruptProcessingException:
+            raise
+
+        except json.JSONDecodeError as e:
+            error_msg = f"JSON 解析失败: {str(e)}"
+            logger.info(f"[BailianAPIBatch] {error_msg}")
+            return (json.dumps({"error": error_msg}, ensure_ascii=False),)
 
+        except Exception as e:
+            error_msg = f"未知错误: {str(e)}"
+            logger.info(f"[BailianAPIBatch] {error_msg}")
+            return (json.dumps({"error": error_msg}, ensure_ascii=False),)
+
+
+@profiling.profiled
+@eventloop.async_node
 class BailianAPISubmit:
     """提交阿里云百炼API任务，返回task_id"""
     
@@ -393,6 +593,10 @@ class BailianAPISubmit:
                 "api_key": ("STRING", {"default": ""}),
                 "model": ("STRING", {"default": "aitryon-plus"}),
                 "async_mode": ("BOOLEAN", {"default": True}),
+                "priority": ("INT", {"default": 1, "min": 1, "max": 10}),
+            },
+            "hidden": {
+                "unique_id": "UNIQUE_ID",
             }
         }
 
@@ -405,7 +609,9 @@ class BailianAPISubmit:
 
     CATEGORY = "Malette"
 
-    def submit(self, endpoint, params, api_key="", model="aitryon-plus", async_mode=True):
+    async def submit(self, endpoint, params, api_key="", model="aitryon-plus", async_mode=True, priority=1, unique_id=None):
+        owner = owner_key(unique_id)
+        acquired = False
         try:
             # 解析输入参数
             input_params = json.loads(params) if isinstance(params, str) else params
@@ -427,21 +633,15 @@ class BailianAPISubmit:
             if async_mode:
                 headers["X-DashScope-Async"] = "enable"
             
-            logger.info(f"[BailianAPISubmit] 提交任务到: {endpoint}")
-            
-            # 发送 POST 请求
-            response = requests.post(
-                endpoint,
-                headers=headers,
-                json=request_data,
-                timeout=30
-            )
+            # 在进程级调度器中排队，只在提交期间占用名额
+            await scheduler.async_acquire(owner, priority)
+            acquired = True
             
-            # 检查响应状态
-            response.raise_for_status()
+            logger.info(f"[BailianAPISubmit] 提交任务到: {endpoint}")
             
-            # 返回响应内容
-            response_data = response.json()
+            # 发送 POST 请求，重新执行时复用账本中已经提交的任务
+            ledger_key = ledger.idempotency_key(endpoint, headers, request_data, unique_id)
+            response_data = await _async_submit_task(endpoint, headers, request_data, None, ledger_key)
             
             # 提取task_id
             task_id = ""
@@ -454,8 +654,11 @@ class BailianAPISubmit:
             
             response_json = json.dumps(response_data, ensure_ascii=False, indent=2)
             return (task_id, response_json)
+        
+        except InterruptProcessingException:
+            raise
             
-        except requests.exceptions.RequestException as e:
+        except transport.RequestError as e:
             error_msg = f"API 请求失败: {str(e)}"
             logger.info(f"[BailianAPISubmit] {error_msg}")
             error_response = json.dumps({"error": error_msg}, ensure_ascii=False)
@@ -472,8 +675,14 @@ class BailianAPISubmit:
             logger.info(f"[BailianAPISubmit] {error_msg}")
             error_response = json.dumps({"error": error_msg}, ensure_ascii=False)
             return ("", error_response)
+        
+        finally:
+            if acquired:
+                scheduler.release(owner)
 
 
+@profiling.profiled
+@eventloop.async_node
 class BailianAPIPoll:
     """轮询阿里云百炼API任务结果"""
     
@@ -500,97 +709,335 @@ class BailianAPIPoll:
 
     CATEGORY = "Malette"
 
-    def poll(self, task_id, api_key="", poll_interval=3, max_wait_time=300, single_query=False):
+    async def poll(self, task_id, api_key="", poll_interval=3, max_wait_time=300, single_query=False):
         if not task_id or task_id.strip() == "":
             error_msg = "task_id 不能为空"
             logger.info(f"[BailianAPIPoll] {error_msg}")
             error_response = json.dumps({"error": error_msg}, ensure_ascii=False)
             return (error_response, "ERROR")
         
-        task_url = f"https://dashscope.aliyuncs.com/api/v1/tasks/{task_id.strip()}"
-        headers = {
-            "Authorization": f"Bearer {api_key}" if api_key else ""
-        }
-        
-        start_time = time.time()
+        task_id = task_id.strip()
+        deadline = Deadline(max_wait_time)
         
-        while True:
-            try:
-                logger.info(f"[BailianAPIPoll] 查询任务状态: {task_id}")
-                
-                # 查询任务状态
-                response = requests.get(task_url, headers=headers, timeout=10)
-                response.raise_for_status()
-                
-                result_data = response.json()
-                task_status = result_data.get("output", {}).get("task_status", "")
-                
-                logger.info(f"[BailianAPIPoll] 任务状态: {task_status}")
-                
-                # 任务完成
-                if task_status == "SUCCEEDED":
-                    logger.info(f"[BailianAPIPoll] 任务完成成功")
-                    result_json = json.dumps(result_data, ensure_ascii=False, indent=2)
-                    return (result_json, "SUCCEEDED")
-                
-                # 任务失败
-                elif task_status == "FAILED":
-                    error_code = result_data.get("output", {}).get("code", "unknown")
-                    error_message = result_data.get("output", {}).get("message", "任务执行失败")
-                    logger.info(f"[BailianAPIPoll] 任务执行失败: {error_code} - {error_message}")
-                    result_json = json.dumps(result_data, ensure_ascii=False, indent=2)
-                    return (result_json, "FAILED")
-                
-                # 如果是单次查询模式，直接返回当前状态
-                if single_query:
-                    result_json = json.dumps(result_data, ensure_ascii=False, indent=2)
-                    return (result_json, task_status)
+        try:
+            while True:
+                try:
+                    logger.info(f"[BailianAPIPoll] 查询任务状态: {task_id}")
+                    
+                    # 查询任务状态
+                    result_data = await _async_query_task(task_id, api_key, deadline)
+                    task_status = result_data.get("output", {}).get("task_status", "")
+                    
+                    logger.info(f"[BailianAPIPoll] 任务状态: {task_status}")
+                    
+                    # 任务完成
+                    if task_status == "SUCCEEDED":
+                        logger.info(f"[BailianAPIPoll] 任务完成成功")
+                        result_json = json.dumps(result_data, ensure_ascii=False, indent=2)
+                        return (result_json, "SUCCEEDED")
+                    
+                    # 任务失败
+                    elif task_status == "FAILED":
+                        error_code = result_data.get("output", {}).get("code", "unknown")
+                        error_message = result_data.get("output", {}).get("message", "任务执行失败")
+                        logger.info(f"[BailianAPIPoll] 任务执行失败: {error_code} - {error_message}")
+                        await _forget_task(task_id)
+                        result_json = json.dumps(result_data, ensure_ascii=False, indent=2)
+                        return (result_json, "FAILED")
+                    
+                    # 如果是单次查询模式，直接返回当前状态
+                    if single_query:
+                        result_json = json.dumps(result_data, ensure_ascii=False, indent=2)
+                        return (result_json, task_status)
+                    
+                    # 继续等待
+                    elif task_status in ["PENDING", "RUNNING"]:
+                        # 检查是否超时
+                        if deadline.expired():
+                            error_msg = f"任务轮询超时 ({deadline.budget}秒)"
+                            logger.info(f"[BailianAPIPoll] {error_msg}")
+                            error_response = json.dumps({"error": error_msg, "task_id": task_id, "last_status": task_status}, ensure_ascii=False)
+                            registry.finished(task_id, "TIMEOUT")
+                            return (error_response, "TIMEOUT")
+                        
+                        await callback.async_wait(task_id, min(callback.next_poll_interval(poll_interval), deadline.remaining()))
+                        continue
+                    
+                    # 未知状态
+                    else:
+                        logger.info(f"[BailianAPIPoll] 未知任务状态: {task_status}")
+                        registry.finished(task_id, task_status or "UNKNOWN")
+                        result_json = json.dumps(result_data, ensure_ascii=False, indent=2)
+                        return (result_json, task_status)
                 
-                # 继续等待
-                elif task_status in ["PENDING", "RUNNING"]:
+                except InterruptProcessingException:
+                    raise
+                        
+                except transport.RequestError as e:
+                    error_msg = f"轮询请求失败: {str(e)}"
+                    logger.info(f"[BailianAPIPoll] {error_msg}，继续重试...")
                     # 检查是否超时
-                    if time.time() - start_time > max_wait_time:
-                        error_msg = f"任务轮询超时 ({max_wait_time}秒)"
+                    if deadline.expired():
+                        error_msg = f"任务轮询超时 ({deadline.budget}秒)，最后一次请求失败: {str(e)}"
                         logger.info(f"[BailianAPIPoll] {error_msg}")
-                        error_response = json.dumps({"error": error_msg, "task_id": task_id, "last_status": task_status}, ensure_ascii=False)
+                        error_response = json.dumps({"error": error_msg, "task_id": task_id}, ensure_ascii=False)
+                        registry.finished(task_id, "TIMEOUT")
                         return (error_response, "TIMEOUT")
-                    
-                    time.sleep(poll_interval)
+                    # 等待后继续重试
+                    await interrupt.async_sleep(min(poll_interval, deadline.remaining()))
                     continue
-                
-                # 未知状态
-                else:
-                    logger.info(f"[BailianAPIPoll] 未知任务状态: {task_status}")
-                    result_json = json.dumps(result_data, ensure_ascii=False, indent=2)
-                    return (result_json, task_status)
                     
-            except requests.exceptions.RequestException as e:
-                error_msg = f"轮询请求失败: {str(e)}"
-                logger.info(f"[BailianAPIPoll] {error_msg}，继续重试...")
-                # 检查是否超时
-                if time.time() - start_time > max_wait_time:
-                    error_msg = f"任务轮询超时 ({max_wait_time}秒)，最后一次请求失败: {str(e)}"
-                    logger.info(f"[BailianAPIPoll] {error_msg}")
-                    error_response = json.dumps({"error": error_msg, "task_id": task_id}, ensure_ascii=False)
-                    return (error_response, "TIMEOUT")
-                # 等待后继续重试
-                time.sleep(poll_interval)
-                continue
-                
+                except Exception as e:
+                    error_msg = f"轮询过程出错: {str(e)}"
+                    logger.info(f"[BailianAPIPoll] {error_msg}，继续重试...")
+                    # 检查是否超时
+                    if deadline.expired():
+                        error_msg = f"任务轮询超时 ({deadline.budget}秒)，最后一次请求出错: {str(e)}"
+                        logger.info(f"[BailianAPIPoll] {error_msg}")
+                        error_response = json.dumps({"error": error_msg, "task_id": task_id}, ensure_ascii=False)
+                        registry.finished(task_id, "TIMEOUT")
+                        return (error_response, "TIMEOUT")
+                    # 等待后继续重试
+                    await interrupt.async_sleep(min(poll_interval, deadline.remaining()))
+                    continue
+        except (InterruptProcessingException, asyncio.CancelledError):
+            logger.info(f"[BailianAPIPoll] 收到取消请求，停止轮询任务: {task_id}")
+            await asyncio.shield(_async_cancel_task(task_id, api_key))
+            registry.finished(task_id, "CANCELED")
+            await asyncio.shield(_forget_task(task_id))
+            raise
+
+
+def _parse_task_ids(task_ids):
+    """解析 task_id 列表：支持 JSON 数组（元素为 task_id 或 BailianAPISubmit 的 response），以及逗号/换行分隔的字符串"""
+    try:
+        items = json.loads(task_ids) if isinstance(task_ids, str) else task_ids
+    except json.JSONDecodeError:
+        items = [item.strip() for line in task_ids.splitlines() for item in line.split(",") if item.strip()]
+    if not isinstance(items, list):
+        items = [items]
+
+    parsed = []
+    for item in items:
+        if isinstance(item, str) and item.strip().startswith("{"):
+            item = json.loads(item)
+        if isinstance(item, dict):
+            item = item.get("output", {}).get("task_id", "")
+        # 空项保留位置，结果与输入一一对应
+        parsed.append(str(item).strip() if item is not None else "")
+    return parsed
+
+
+@profiling.profiled
+@eventloop.async_node
+class BailianAPIGather:
+    """同时等待多个阿里云百炼API任务的结果"""
+    
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "task_ids": ("STRING", {"forceInput": True}),
+            },
+            "optional": {
+                "api_key": ("STRING", {"default": ""}),
+                "mode": (["all", "first_k", "any"], {"default": "all"}),
+                "k": ("INT", {"default": 1, "min": 1, "max": 10000}),
+                "poll_interval": ("INT", {"default": 3, "min": 1, "max": 30}),
+                "max_wait_time": ("INT", {"default": 300, "min": 30, "max": 1800}),
+            }
+        }
+
+    RETURN_TYPES = ("STRING", "STRING")
+    RETURN_NAMES = ("results", "statuses")
+
+    FUNCTION = "gather"
+
+    OUTPUT_NODE = True
+
+    CATEGORY = "Malette"
+
+    async def gather(self, task_ids, api_key="", mode="all", k=1, poll_interval=3, max_wait_time=300):
+        try:
+            task_id_list = _parse_task_ids(task_ids)
+        except Exception as e:
+            error_msg = f"task_ids 解析失败: {str(e)}"
+            logger.info(f"[BailianAPIGather] {error_msg}")
+            return (json.dumps({"error": error_msg}, ensure_ascii=False), json.dumps(["ERROR"]))
+
+        if len(task_id_list) == 0:
+            error_msg = "task_ids 不能为空"
+            logger.info(f"[BailianAPIGather] {error_msg}")
+            return (json.dumps({"error": error_msg}, ensure_ascii=False), json.dumps(["ERROR"]))
+
+        # all：等待全部结束；first_k：k 个任务成功后返回；any：任意一个任务成功后返回
+        required = len(task_id_list) if mode == "all" else (1 if mode == "any" else min(k, len(task_id_list)))
+
+        results = [None] * len(task_id_list)
+        statuses = [""] * len(task_id_list)
+        pending = []
+        for i, task_id in enumerate(task_id_list):
+            if task_id:
+                pending.append(i)
+            else:
+                results[i] = {"error": "task_id 不能为空"}
+                statuses[i] = "ERROR"
+
+        deadline = Deadline(max_wait_time)
+        logger.info(f"[BailianAPIGather] 开始等待 {len(pending)} 个任务，模式: {mode}")
+
+        async def query(i):
+            try:
+                return await _async_query_task(task_id_list[i], api_key, deadline)
+            except InterruptProcessingException:
+                raise
             except Exception as e:
-                error_msg = f"轮询过程出错: {str(e)}"
-                logger.info(f"[BailianAPIPoll] {error_msg}，继续重试...")
-                # 检查是否超时
-                if time.time() - start_time > max_wait_time:
-                    error_msg = f"任务轮询超时 ({max_wait_time}秒)，最后一次请求出错: {str(e)}"
-                    logger.info(f"[BailianAPIPoll] {error_msg}")
-                    error_response = json.dumps({"error": error_msg, "task_id": task_id}, ensure_ascii=False)
-                    return (error_response, "TIMEOUT")
-                # 等待后继续重试
-                time.sleep(poll_interval)
-                continue
+                # 单个任务查询失败时保留上一次的状态，下一轮继续查询
+                logger.info(f"[BailianAPIGather] 查询任务 {task_id_list[i]} 失败: {str(e)}，继续重试...")
+                return None
+
+        try:
+            while pending:
+                # 每一轮并发查询所有未结束的任务
+                round_results = await asyncio.gather(*[query(i) for i in pending])
+                for i, result_data in zip(list(pending), round_results):
+                    if result_data is None:
+                        continue
+                    results[i] = result_data
+                    statuses[i] = result_data.get("output", {}).get("task_status", "")
+                    if statuses[i] in callback.TERMINAL_STATUSES:
+                        pending.remove(i)
+                        if statuses[i] == "FAILED":
+                            await _forget_task(task_id_list[i])
+
+                succeeded = statuses.count("SUCCEEDED")
+                logger.info(f"[BailianAPIGather] 成功 {succeeded} 个，未结束 {len(pending)} 个")
+                if succeeded >= required or not pending:
+                    # first_k/any 提前返回时，剩下的任务不再有节点等待
+                    for i in pending:
+                        registry.finished(task_id_list[i], "DETACHED")
+                    break
+
+                if deadline.expired():
+                    for i in pending:
+                        last_status = statuses[i]
+                        results[i] = {"error": f"任务轮询超时 ({deadline.budget}秒)", "task_id": task_id_list[i], "last_status": last_status}
+                        statuses[i] = "TIMEOUT"
+                        registry.finished(task_id_list[i], "TIMEOUT")
+                    logger.info(f"[BailianAPIGather] 等待超时，{len(pending)} 个任务未结束")
+                    break
+
+                # 所有未结束的任务共用一次等待，回调模式下任意一个任务完成都会提前唤醒
+                await callback.async_wait_any(
+                    [task_id_list[i] for i in pending],
+                    min(callback.next_poll_interval(poll_interval), deadline.remaining())
+                )
+        except (InterruptProcessingException, asyncio.CancelledError):
+            logger.info(f"[BailianAPIGather] 收到取消请求，停止等待 {len(pending)} 个任务")
+            await asyncio.shield(asyncio.gather(*[_async_cancel_task(task_id_list[i], api_key) for i in pending]))
+            for i in pending:
+                registry.finished(task_id_list[i], "CANCELED")
+            await asyncio.shield(asyncio.gather(*[_forget_task(task_id_list[i]) for i in pending]))
+            raise
+
+        return (json.dumps(results, ensure_ascii=False, indent=2), json.dumps(statuses, ensure_ascii=False))
+
+
+def _extract_image_urls(images):
+    """解析图片 URL：支持单个 URL、逗号/换行分隔的 URL、JSON 数组，以及百炼任务结果（output.image_url 或 output.results[].url）"""
+    try:
+        items = json.loads(images) if isinstance(images, str) else images
+    except json.JSONDecodeError:
+        items = [item.strip() for line in images.splitlines() for item in line.split(",") if item.strip()]
+    if not isinstance(items, list):
+        items = [items]
+
+    urls = []
+    for item in items:
+        if isinstance(item, dict):
+            output = item.get("output", item)
+            if output.get("image_url"):
+                urls.append(output["image_url"])
+            for result in output.get("results", None) or []:
+                if isinstance(result, dict) and result.get("url"):
+                    urls.append(result["url"])
+        elif isinstance(item, str) and item.strip():
+            urls.append(item.strip())
+    return urls
+
+
+async def _load_result_pixels(response_data, deadline):
+    """下载任务结果的第一张图片并解码为像素数组，任务失败或下载失败时返回 None"""
+    if not isinstance(response_data, dict) or "error" in response_data:
+        return None
+    urls = _extract_image_urls([response_data])
+    if not urls:
+        return None
+    try:
+        return await image_cache.load_pixels(urls[0], deadline)
+    except InterruptProcessingException:
+        raise
+    except Exception as e:
+        response_data["image_error"] = f"下载结果图片失败: {str(e)}"
+        logger.info(f"[VirtualTryOn] {response_data['image_error']}")
+        return None
+
+
+def _image_batch(pixels_list):
+    """按顺序把像素数组拼成 IMAGE 批次：尺寸不同时居中补黑边到最大尺寸，缺失（失败）的图片用黑图占位"""
+    loaded = [pixels for pixels in pixels_list if pixels is not None]
+    height = max((pixels.shape[0] for pixels in loaded), default=64)
+    width = max((pixels.shape[1] for pixels in loaded), default=64)
+    batch = utils.torch.zeros((len(pixels_list), height, width, 3), dtype=utils.torch.float32)
+    for i, pixels in enumerate(pixels_list):
+        if pixels is None:
+            continue
+        top = (height - pixels.shape[0]) // 2
+        left = (width - pixels.shape[1]) // 2
+        batch[i, top:top + pixels.shape[0], left:left + pixels.shape[1]] = utils.torch.from_numpy(pixels)
+    return batch
+
+
+@profiling.profiled
+@eventloop.async_node
+class BailianLoadImages:
+    """下载百炼任务的结果图片并输出为 IMAGE，已下载过的图片直接从磁盘缓存映射，不需要重新下载和解码"""
+    
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "images": ("STRING", {"forceInput": True}),
+            },
+            "optional": {
+                "max_wait_time": ("INT", {"default": 120, "min": 10, "max": 1800}),
+            }
+        }
+
+    RETURN_TYPES = ("IMAGE",)
+    RETURN_NAMES = ("images",)
+
+    FUNCTION = "load"
+
+    CATEGORY = "Malette"
+
+    async def load(self, images, max_wait_time=120):
+        urls = _extract_image_urls(images)
+        if len(urls) == 0:
+            raise ValueError("没有找到图片 URL")
+
+        deadline = Deadline(max_wait_time)
+        logger.info(f"[BailianLoadImages] 加载 {len(urls)} 张图片")
+        tensors = await asyncio.gather(*[image_cache.load_image(url, deadline) for url in urls])
+
+        if len(tensors) == 1:
+            return (tensors[0],)
+        if any(tensor.shape != tensors[0].shape for tensor in tensors):
+            raise ValueError("图片尺寸不一致，无法合并为一个批次")
+        return (utils.torch.cat(tensors, dim=0),)
 
 
+@profiling.profiled
 class MaletteJSONExtractor:
     """从JSON中提取嵌套键值的工具节点"""
     
@@ -676,6 +1123,7 @@ class MaletteJSONExtractor:
             return (default_value,)
 
 
+@profiling.profiled
 class MaletteJSONModifier:
     """修改JSON中嵌套键值的工具节点"""
     
@@ -838,6 +1286,8 @@ class MaletteJSONModifier:
         else:
             raise TypeError(f"无法在类型 {type(current)} 上设置键 '{final_key}'")
 
+@profiling.profiled
+@eventloop.async_node
 class VirtualTryOn:
     """虚拟试穿"""
     
@@ -874,124 +1324,130 @@ class VirtualTryOn:
                 "gender": ("STRING", {"default": "male", "choices": ["male", "female"]}),
                 "poll_interval": ("INT", {"default": 3, "min": 1, "max": 30}),
                 "max_wait_time": ("INT", {"default": 300, "min": 30, "max": 1800}),
+                "priority": ("INT", {"default": 1, "min": 1, "max": 10}),
+                "preflight": ("BOOLEAN", {"default": False}),
+                "preprocess": ("BOOLEAN", {"default": False}),
+                "hedge": ("BOOLEAN", {"default": False}),
+                "load_images": ("BOOLEAN", {"default": False}),
+            },
+            "hidden": {
+                "unique_id": "UNIQUE_ID",
             }
         }
     
-    RETURN_TYPES = ("STRING",)
-    RETURN_NAMES = ("response",)
+    RETURN_TYPES = ("STRING", "IMAGE")
+    RETURN_NAMES = ("response", "images")
     
     FUNCTION = "run"
     
     
     CATEGORY = "Malette"
     
-    async def _async_process_all_persons(self, person_images, top_garment_image, bottom_garment_image, model, parameters, endpoint, headers, async_mode, enable_refiner, gender, api_key, poll_interval, max_wait_time):
-        """异步并行处理所有人物图像"""
-        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=300)) as session:
-            # 创建所有异步任务
-            tasks = [
-                _async_process_single_person(
-                    session, person_image, top_garment_image, bottom_garment_image,
-                    model, parameters, endpoint, headers, async_mode, enable_refiner,
-                    gender, api_key, poll_interval, max_wait_time
+    async def _async_process_all_persons(self, person_images, top_garment_image, bottom_garment_image, model, parameters, endpoint, headers, async_mode, enable_refiner, gender, api_key, poll_interval, deadline, owner, priority, rejected=None, preprocessed=None, hedged=False, unique_id=None, images=None):
+        """异步并行处理所有人物图像，rejected 中预检不通过的人物图像不会提交，preprocessed 为人物图像的预处理报告
+
+        images 不为 None 时，每个人物的任务（包括 refiner）一成功就立即下载、解码结果图片，
+        与其他人物的任务并行，像素数组按人物序号存入 images。
+        开启 refiner 时按流水线执行：粗略结果、refiner、下载三个阶段各有自己的工作协程、队列和速率限制，
+        粗略结果一完成就进入 refiner 阶段，两个模型的配额互不影响。
+        """
+        rejected = rejected or {}
+        preprocessed = preprocessed or {}
+
+        def person_url(person_image):
+            report = preprocessed.get(person_image)
+            return report["url"] if report else person_image
+
+        # 预处理上传的 oss:// 地址只能用于 model，refiner 和其他模型的对冲任务使用原图的公网地址
+        sources = {report["url"]: url for url, report in preprocessed.items()}
+
+        def public_input(person_image):
+            return _tryon_input(person_image, sources.get(top_garment_image, top_garment_image), sources.get(bottom_garment_image, bottom_garment_image))
+
+        async def coarse(index, person_image, refine):
+            # 每个人物图像先等待接口地址的自适应并发名额，再在进程级调度器中排队，任务完成前一直占用名额
+            async with adaptive.slot(endpoint, deadline), scheduler.async_slot(owner, priority, deadline):
+                return await _async_process_single_person(
+                    person_url(person_image), top_garment_image, bottom_garment_image,
+                    model, parameters, endpoint, headers, async_mode, refine,
+                    gender, api_key, poll_interval, deadline, hedged,
+                    {"unique_id": unique_id, "slot": index}, public_input(person_image)
                 )
-                for person_image in person_images
-            ]
+
+        async def refine(index, response_data):
+            # 粗略结果失败时不提交 refiner 任务
+            if "error" in response_data or not response_data.get("output", {}).get("image_url"):
+                return response_data
+            # refiner 阶段在调度器中单独排队，与粗略结果阶段公平分配空闲名额
+            async with adaptive.slot(endpoint, deadline), scheduler.async_slot(f"{owner}:refiner", priority, deadline):
+                return await _async_refine(response_data, public_input(person_images[index]), endpoint, gender, api_key, poll_interval, deadline)
+
+        async def finish(index, response_data):
+            report = preprocessed.get(person_images[index])
+            if report and isinstance(response_data, dict):
+                response_data["preprocess"] = report
+            # 下载和归档转存不占用调度器的名额，两者并行
+            archiving = asyncio.ensure_future(archive.archive_result(response_data))
+            try:
+                if images is not None:
+                    images[index] = await _load_result_pixels(response_data, deadline)
+            except BaseException:
+                archiving.cancel()
+                raise
+            await archiving
+            return response_data
+
+        def rejection(person_image):
+            return {"error": f"图片预检失败: {rejected[person_image]}", "person_image": person_image}
+
+        async def process_scheduled(index, person_image):
+            if person_image in rejected:
+                return rejection(person_image)
+            return await finish(index, await coarse(index, person_image, enable_refiner))
+
+        if enable_refiner:
+            logger.info(f"[VirtualTryOn] 开始按流水线处理 {len(person_images)} 个人物图像（粗略结果 -> refiner）")
+            staged = pipeline.Pipeline("VirtualTryOn", [
+                pipeline.Stage("coarse", lambda index, person_image: coarse(index, person_image, False),
+                               pipeline.COARSE_WORKERS, pipeline.rate_limiter(model, pipeline.COARSE_RATE)),
+                pipeline.Stage("refiner", refine, pipeline.REFINER_WORKERS, pipeline.rate_limiter("aitryon-refiner", pipeline.REFINER_RATE)),
+                pipeline.Stage("download", finish, pipeline.DOWNLOAD_WORKERS),
+            ], deadline)
+            try:
+                results = await staged.run([(i, person_image) for i, person_image in enumerate(person_images) if person_image not in rejected])
+            except InterruptProcessingException:
+                logger.info(f"[VirtualTryOn] 收到取消请求，已停止所有人物图像的处理")
+                raise
+            response_data_list = [rejection(person_image) if person_image in rejected else results.get(i) for i, person_image in enumerate(person_images)]
+        else:
+            # 创建所有异步任务
+            tasks = [process_scheduled(i, person_image) for i, person_image in enumerate(person_images)]
             
             # 并行执行所有任务
             logger.info(f"[VirtualTryOn] 开始并行处理 {len(tasks)} 个人物图像")
+            # 收到取消请求时每个任务都会各自取消远端任务，等全部收尾后再向上抛出
             response_data_list = await asyncio.gather(*tasks, return_exceptions=True)
-            
-            # 处理异常结果
-            processed_results = []
-            for i, result in enumerate(response_data_list):
-                if isinstance(result, Exception):
-                    error_msg = f"处理第 {i+1} 个人物图像时发生异常: {str(result)}"
-                    logger.info(f"[VirtualTryOn] {error_msg}")
-                    processed_results.append({"error": error_msg, "person_image": person_images[i]})
-                else:
-                    processed_results.append(result)
-            
-            logger.info(f"[VirtualTryOn] 并行处理完成，成功处理 {len([r for r in processed_results if 'error' not in r])} 个，失败 {len([r for r in processed_results if 'error' in r])} 个")
-            return processed_results
-    
-    def _sync_process_all_persons(self, person_images, top_garment_image, bottom_garment_image, model, parameters, endpoint, headers, async_mode, enable_refiner, gender, api_key, poll_interval, max_wait_time):
-        """同步处理所有人物图像"""
-        logger.info(f"[VirtualTryOn] 开始同步处理 {len(person_images)} 个人物图像")
-        processed_results = []
+            for result in response_data_list:
+                if isinstance(result, InterruptProcessingException):
+                    logger.info(f"[VirtualTryOn] 收到取消请求，已停止所有人物图像的处理")
+                    raise result
         
-        for i, person_image in enumerate(person_images):
-            try:
-                logger.info(f"[VirtualTryOn] 处理第 {i+1}/{len(person_images)} 个人物图像")
-                
-                # 构建请求数据
-                input_data = {
-                    "top_garment_url": top_garment_image,
-                    "bottom_garment_url": bottom_garment_image if bottom_garment_image is not None and bottom_garment_image.strip() != "" else "",
-                    "person_image_url": person_image,
-                }
-                
-                request_data = {
-                    "model": model,
-                    "input": input_data,
-                }
-                
-                if parameters is not None and parameters.strip() != "":
-                    request_data["parameters"] = parameters if isinstance(parameters, dict) else json.loads(parameters)
-                else:
-                    request_data["parameters"] = {}
-                
-                logger.info(f"[VirtualTryOn] 发送请求到: {endpoint}, 请求数据: {request_data}")
-                
-                # 发送请求
-                response = requests.post(endpoint, headers=headers, json=request_data, timeout=300)
-                if response.status_code != 200:
-                    response_text = response.text
-                    raise ValueError(f"API 请求失败: {response.status_code} {response_text}")
-                
-                response_data = response.json()
-                logger.info(f"[VirtualTryOn] 请求成功: {response_data}")
-                
-                # 如果是异步模式且有task_id，需要轮询结果
-                if async_mode and "output" in response_data and "task_id" in response_data["output"]:
-                    task_id = response_data["output"]["task_id"]
-                    task_status = response_data["output"].get("task_status", "")
-                    
-                    logger.info(f"[VirtualTryOn] 获取到任务ID: {task_id}, 状态: {task_status}")
-                    
-                    # 如果任务是PENDING状态，开始轮询
-                    if task_status == "PENDING":
-                        response_data = _poll_task_result(task_id, api_key, poll_interval, max_wait_time)
-                        if enable_refiner:
-                            try:
-                                response_data = create_and_poll_refiner_task(endpoint, gender, input_data, response_data["output"]["image_url"], api_key, poll_interval, max_wait_time)
-                            except Exception as e:
-                                error_msg = f"处理refiner任务失败: {str(e)}"
-                                logger.info(f"[VirtualTryOn] {error_msg}")
-                        
-                        processed_results.append(response_data)
-                    else:
-                        processed_results.append(response_data)
-                else:
-                    # 同步模式
-                    if enable_refiner:
-                        try:
-                            response_data = create_and_poll_refiner_task(endpoint, gender, input_data, response_data["output"]["image_url"], api_key, poll_interval, max_wait_time)
-                        except Exception as e:
-                            error_msg = f"处理refiner任务失败: {str(e)}"
-                            logger.info(f"[VirtualTryOn] {error_msg}")
-                    
-                    processed_results.append(response_data)
-                    
-            except Exception as e:
-                error_msg = f"处理第 {i+1} 个人物图像失败: {str(e)}"
+        # 处理异常结果
+        processed_results = []
+        for i, result in enumerate(response_data_list):
+            if isinstance(result, Exception):
+                error_msg = f"处理第 {i+1} 个人物图像时发生异常: {str(result)}"
                 logger.info(f"[VirtualTryOn] {error_msg}")
-                processed_results.append({"error": error_msg, "person_image": person_image})
+                processed_results.append({"error": error_msg, "person_image": person_images[i]})
+            else:
+                processed_results.append(result)
         
-        logger.info(f"[VirtualTryOn] 同步处理完成，成功处理 {len([r for r in processed_results if 'error' not in r])} 个，失败 {len([r for r in processed_results if 'error' in r])} 个")
+        if hedged:
+            logger.info(f"[VirtualTryOn] 对冲统计: {json.dumps(hedge.policy.stats(), ensure_ascii=False)}")
+        logger.info(f"[VirtualTryOn] 并行处理完成，成功处理 {len([r for r in processed_results if 'error' not in r])} 个，失败 {len([r for r in processed_results if 'error' in r])} 个")
         return processed_results
     
-    def run(self, top_garment_image, bottom_garment_image, person_images, api_key, endpoint, model, parameters, async_mode=True, enable_refiner=False, gender="male", poll_interval=3, max_wait_time=300):
+    async def run(self, top_garment_image, bottom_garment_image, person_images, api_key, endpoint, model, parameters, async_mode=True, enable_refiner=False, gender="male", poll_interval=3, max_wait_time=300, priority=1, preflight=False, preprocess=False, hedge=False, load_images=False, unique_id=None):
         try:
             if not person_images or len(person_images) == 0:
                 raise ValueError("person_images 不能为空")
@@ -1015,59 +1471,194 @@ class VirtualTryOn:
             if async_mode:
                 headers["X-DashScope-Async"] = "enable"
 
-            # 检查是否已经在事件循环中运行
-            try:
-                # 尝试获取当前事件循环
-                loop = asyncio.get_running_loop()
-                # 如果已经在事件循环中，使用同步方式处理
-                logger.info(f"[VirtualTryOn] 检测到运行中的事件循环，使用同步处理方式")
-                response_data_list = self._sync_process_all_persons(
-                    person_images, top_garment_image, bottom_garment_image, model, 
-                    parameters, endpoint, headers, async_mode, enable_refiner, 
-                    gender, api_key, poll_interval, max_wait_time
+            # 整个批次（提交、轮询、refiner）共享同一个截止时间
+            deadline = Deadline(max_wait_time)
+
+            # 可选的预检：提交付费任务前先检查所有输入图片，注定失败的图片直接在本地返回错误
+            rejected = {}
+            if preflight:
+                # 预处理会缩小图片，此时不检查文件大小和最长边
+                rules = dict(preflight_module.DEFAULT_RULES, max_bytes=None, max_side=None) if preprocess else None
+                checks = await preflight_module.validate([top_garment_image, bottom_garment_image] + person_images, rules=rules, deadline=deadline)
+                for garment_image in (top_garment_image, bottom_garment_image):
+                    if garment_image and not checks[garment_image]["ok"]:
+                        raise ValueError(f"服装图片预检失败: {garment_image} {checks[garment_image]['error']}")
+                rejected = {url: check["error"] for url, check in checks.items() if not check["ok"]}
+
+            # 可选的预处理：按模型规格缩小、旋转、重新压缩输入图片后上传到临时存储空间
+            preprocessed = {}
+            if preprocess:
+                preprocessed = await preprocess_module.preprocess_urls(
+                    [top_garment_image, bottom_garment_image] + [p for p in person_images if p not in rejected],
+                    model, api_key, deadline
                 )
-            except RuntimeError:
-                # 没有运行中的事件循环，可以使用 asyncio.run()
-                logger.info(f"[VirtualTryOn] 使用异步处理方式")
-                response_data_list = asyncio.run(self._async_process_all_persons(
-                    person_images, top_garment_image, bottom_garment_image, model, 
-                    parameters, endpoint, headers, async_mode, enable_refiner, 
-                    gender, api_key, poll_interval, max_wait_time
-                ))
+                if top_garment_image in preprocessed:
+                    top_garment_image = preprocessed[top_garment_image]["url"]
+                if bottom_garment_image in preprocessed:
+                    bottom_garment_image = preprocessed[bottom_garment_image]["url"]
+                if any(report["url"].startswith("oss://") for report in preprocessed.values()):
+                    headers[upload.OSS_RESOLVE_HEADER] = "enable"
+
+            # 可选的结果图片输出：每个人物成功后立即下载，下载与其他人物的任务重叠
+            images = {} if load_images else None
+            response_data_list = await self._async_process_all_persons(
+                person_images, top_garment_image, bottom_garment_image, model, 
+                parameters, endpoint, headers, async_mode, enable_refiner, 
+                gender, api_key, poll_interval, deadline, owner_key(unique_id), priority, rejected, preprocessed, hedge, unique_id, images
+            )
+            image_batch = _image_batch([images.get(i) for i in range(len(person_images))] if load_images else [None])
                 
-            return (json.dumps(response_data_list, ensure_ascii=False),)
+            return (json.dumps(response_data_list, ensure_ascii=False), image_batch)
+        
+        except InterruptProcessingException:
+            raise
             
-        except requests.exceptions.RequestException as e:
+        except transport.RequestError as e:
             error_msg = f"API 请求失败: {str(e)}"
             logger.info(f"[VirtualTryOn] {error_msg}")
-            return (json.dumps({"error": error_msg}, ensure_ascii=False),)
+            return (json.dumps({"error": error_msg}, ensure_ascii=False), _image_batch([None]))
             
         except json.JSONDecodeError as e:
             error_msg = f"JSON 解析失败: {str(e)}"
             logger.info(f"[VirtualTryOn] {error_msg}")
-            return (json.dumps({"error": error_msg}, ensure_ascii=False),)
+            return (json.dumps({"error": error_msg}, ensure_ascii=False), _image_batch([None]))
             
         except Exception as e:
             error_msg = f"未知错误: {str(e)}"
             logger.info(f"[VirtualTryOn] {error_msg}")
-            return (json.dumps({"error": error_msg}, ensure_ascii=False),)
+            return (json.dumps({"error": error_msg}, ensure_ascii=False), _image_batch([None]))
     
 
+@profiling.profiled
+@eventloop.async_node
+class VirtualTryOnBatchJob:
+    """大批量虚拟试穿任务：从文件流式读取人物图片，每完成一张立即追加到 NDJSON 输出文件
+
+    输出文件同时作为检查点，中断或崩溃后使用相同参数重新运行会跳过已完成的条目。
+    内存中只保留在途的条目，与批次大小无关。
+    """
+
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "top_garment_image": ("STRING",),
+                "bottom_garment_image": ("STRING",),
+                "input_path": ("STRING", {"default": "person_images.ndjson"}),
+                "output_path": ("STRING", {"default": "tryon_results.ndjson"}),
+                "api_key": ("STRING", {"default": ""}),
+            },
+            "optional": {
+                "endpoint": ("STRING", {"default": "https://dashscope.aliyuncs.com/api/v1/services/aigc/image2image/image-synthesis/"}),
+                "model": ("STRING", {"default": "aitryon-plus"}),
+                "parameters": ("STRING", {"default": "{}"}),
+                "async_mode": ("BOOLEAN", {"default": True}),
+                "enable_refiner": ("BOOLEAN", {"default": False}),
+                "gender": ("STRING", {"default": "male", "choices": ["male", "female"]}),
+                "poll_interval": ("INT", {"default": 3, "min": 1, "max": 30}),
+                "max_wait_time": ("INT", {"default": 300, "min": 30, "max": 1800}),
+                "max_concurrency": ("INT", {"default": 8, "min": 1, "max": 64}),
+                "priority": ("INT", {"default": 1, "min": 1, "max": 10}),
+                "retry_failed": ("BOOLEAN", {"default": False}),
+                "hedge": ("BOOLEAN", {"default": False}),
+            },
+            "hidden": {
+                "unique_id": "UNIQUE_ID",
+            }
+        }
+
+    RETURN_TYPES = ("STRING",)
+    RETURN_NAMES = ("summary",)
+
+    FUNCTION = "run"
+
+    CATEGORY = "Malette"
+
+    async def run(self, top_garment_image, bottom_garment_image, input_path, output_path, api_key, endpoint="https://dashscope.aliyuncs.com/api/v1/services/aigc/image2image/image-synthesis/", model="aitryon-plus", parameters="{}", async_mode=True, enable_refiner=False, gender="male", poll_interval=3, max_wait_time=300, max_concurrency=8, priority=1, retry_failed=False, hedge=False, unique_id=None):
+        try:
+            if (not top_garment_image) and (not bottom_garment_image):
+                raise ValueError("top_garment_image 和 bottom_garment_image 不能同时为空")
+
+            input_path = batch_job.resolve_path(input_path, "input")
+            output_path = batch_job.resolve_path(output_path, "output")
+            if not os.path.exists(input_path):
+                raise ValueError(f"输入文件不存在: {input_path}")
+
+            headers = {
+                "Content-Type": "application/json",
+                "Authorization": f"Bearer {api_key}" if api_key else ""
+            }
+            if async_mode:
+                headers["X-DashScope-Async"] = "enable"
+
+            completed = batch_job.load_completed(output_path, retry_failed)
+            if completed:
+                logger.info(f"[VirtualTryOnBatchJob] 从 {output_path} 恢复进度，跳过 {len(completed)} 个已完成的条目")
+            pending = ((index, url) for index, url in batch_job.iter_inputs(input_path) if index not in completed)
+            owner = owner_key(unique_id)
+
+            async def process(index, person_image):
+                if not person_image:
+                    return {"error": f"第 {index+1} 行没有人物图片 URL"}
+                # 每个条目有各自的截止时间，批次本身不限时
+                deadline = Deadline(max_wait_time)
+                async with adaptive.slot(endpoint, deadline), scheduler.async_slot(owner, priority, deadline):
+                    response_data = await _async_process_single_person(
+                        person_image, top_garment_image, bottom_garment_image,
+                        model, parameters, endpoint, headers, async_mode, enable_refiner,
+                        gender, api_key, poll_interval, deadline, hedge,
+                        # 幂等键按输出文件和行号，崩溃后续跑时复用上次已经提交的任务
+                        {"scope": ["batch_job", output_path], "slot": index}
+                    )
+                await archive.archive_result(response_data)
+                return response_data
+
+            logger.info(f"[VirtualTryOnBatchJob] 开始处理 {input_path}，结果写入 {output_path}")
+            with batch_job.ResultWriter(output_path, input_path, len(completed)) as writer:
+                await batch_job.run(pending, process, writer, max_concurrency)
+
+            summary = {
+                "input_path": input_path,
+                "output_path": output_path,
+                "skipped": len(completed),
+                "completed": writer.completed,
+                "failed": writer.failed,
+            }
+            logger.info(f"[VirtualTryOnBatchJob] 处理完成，跳过 {summary['skipped']} 个，成功 {summary['completed']} 个，失败 {summary['failed']} 个")
+            return (json.dumps(summary, ensure_ascii=False),)
+
+        except InterruptProcessingException:
+            raise
+
+        except Exception as e:
+            error_msg = f"未知错误: {str(e)}"
+            logger.info(f"[VirtualTryOnBatchJob] {error_msg}")
+            return (json.dumps({"error": error_msg}, ensure_ascii=False),)
+
+
 # 节点映射
 NODE_CLASS_MAPPINGS = {
     "BailianAPI": BailianAPI,
+    "BailianAPIBatch": BailianAPIBatch,
     "BailianAPISubmit": BailianAPISubmit,
     "BailianAPIPoll": BailianAPIPoll,
+    "BailianAPIGather": BailianAPIGather,
+    "BailianLoadImages": BailianLoadImages,
     "MaletteJSONExtractor": MaletteJSONExtractor,
     "MaletteJSONModifier": MaletteJSONModifier,
-    "MaletteVirtualTryOn": VirtualTryOn
+    "MaletteVirtualTryOn": VirtualTryOn,
+    "MaletteVirtualTryOnBatchJob": VirtualTryOnBatchJob
 }
 
 NODE_DISPLAY_NAME_MAPPINGS = {
     "BailianAPI": "AliCloud Bailian API",
+    "BailianAPIBatch": "AliCloud Bailian API Batch",
     "BailianAPISubmit": "AliCloud Bailian API Submit",
     "BailianAPIPoll": "AliCloud Bailian API Poll",
+    "BailianAPIGather": "AliCloud Bailian API Gather",
+    "BailianLoadImages": "AliCloud Bailian Load Images",
     "MaletteJSONExtractor": "Malette JSON Extractor",
     "MaletteJSONModifier": "Malette JSON Modifier",
-    "MaletteVirtualTryOn": "Malette Virtual TryOn"
+    "MaletteVirtualTryOn": "Malette Virtual TryOn",
+    "MaletteVirtualTryOnBatchJob": "Malette Virtual TryOn Batch Job"
 }
\ No newline at end of file
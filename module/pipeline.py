@@ -0,0 +1,192 @@
+import os
+import json
+import time
+import weakref
+import threading
+
+from . import interrupt
+from .interrupt import InterruptProcessingException
+from .deadline import DeadlineExceeded
+from .scheduler import MAX_CONCURRENT_TASKS
+from .lazy import lazy_import
+from .logging import logger
+
+asyncio = lazy_import("asyncio")
+
+
+# 各阶段的工作协程数（每次节点执行），默认平分进程级调度器的名额，粗略结果阶段不会占满名额让 refiner 阶段饿死
+COARSE_WORKERS = int(os.environ.get("BAILIAN_PIPELINE_COARSE_WORKERS", str(max(1, MAX_CONCURRENT_TASKS // 2))))
+REFINER_WORKERS = int(os.environ.get("BAILIAN_PIPELINE_REFINER_WORKERS", str(max(1, MAX_CONCURRENT_TASKS - COARSE_WORKERS))))
+# 下载阶段（下载结果图片和归档转存）的工作协程数，不占用调度器的名额，固定数量避免大批次同时发起大量下载
+DOWNLOAD_WORKERS = int(os.environ.get("BAILIAN_PIPELINE_DOWNLOAD_WORKERS", "8"))
+# 阶段之间的队列长度，下游的队列满时上游暂停交付（背压）
+QUEUE_SIZE = int(os.environ.get("BAILIAN_PIPELINE_QUEUE_SIZE", "100"))
+# 各阶段每秒最多开始的任务数（按模型在进程内共享），0 表示不限制
+COARSE_RATE = float(os.environ.get("BAILIAN_PIPELINE_COARSE_RATE", "0"))
+REFINER_RATE = float(os.environ.get("BAILIAN_PIPELINE_REFINER_RATE", "0"))
+
+_active = weakref.WeakSet()
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+class RateLimiter:
+    """按固定间隔放行：每秒最多 rate 个，空闲后不积累额度"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    async def acquire(self, deadline=None):
+        """等待下一个放行时刻，deadline 内等不到时抛出 DeadlineExceeded（不占用放行时刻）"""
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            if deadline is not None and start - now > deadline.remaining():
+                raise DeadlineExceeded(f"等待阶段的速率配额时已超出最大等待时间 ({deadline.budget}秒)")
+            self._next = start + self.interval
+        if start > now:
+            await interrupt.async_sleep(start - now)
+
+
+def rate_limiter(name, rate):
+    """名称（如模型名）对应的速率限制，在进程内跨节点执行共享；rate 不大于 0 时返回 None"""
+    if rate <= 0:
+        return None
+    with _rate_limiters_lock:
+        limiter = _rate_limiters.get((name, rate))
+        if limiter is None:
+            limiter = _rate_limiters[(name, rate)] = RateLimiter(rate)
+        return limiter
+
+
+class Stage:
+    """流水线的一个阶段：process(index, value) 返回交给下一阶段的值，由 workers 个工作协程并行处理"""
+
+    def __init__(self, name, process, workers, rate=None, queue_size=QUEUE_SIZE):
+        self.name = name
+        self.process = process
+        self.workers = max(1, workers)
+        self.rate = rate
+        self.queue_size = queue_size
+        self.queue = None
+        self.max_depth = 0
+        self.in_progress = 0
+        self.completed = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+
+    def stats(self, elapsed):
+        return {
+            "workers": self.workers,
+            "queued": self.queue.qsize() if self.queue is not None else 0,
+            "max_queued": self.max_depth,
+            "in_progress": self.in_progress,
+            "completed": self.completed,
+            "failed": self.failed,
+            "throughput_per_minute": round(self.completed / elapsed * 60, 2) if elapsed > 0 else 0.0,
+            # 工作协程的平均利用率，接近 1 时该阶段是瓶颈
+            "utilization": round(self.busy_seconds / (elapsed * self.workers), 3) if elapsed > 0 else 0.0,
+        }
+
+
+class Pipeline:
+    """多阶段流水线：每一项完成一个阶段后立即进入下一阶段的队列，各阶段的并发互相独立
+
+    某一阶段抛出异常的项不再进入后续阶段，结果为该异常；收到取消请求时停止所有阶段后向上抛出。
+    deadline 限制等待速率配额的时间。
+    """
+
+    def __init__(self, name, stages, deadline=None):
+        self.name = name
+        self.stages = stages
+        self.deadline = deadline
+        self.started_at = None
+        self.finished_at = None
+
+    def stats(self):
+        end = self.finished_at or time.monotonic()
+        elapsed = end - self.started_at if self.started_at is not None else 0.0
+        return {
+            "name": self.name,
+            "elapsed_seconds": round(elapsed, 3),
+            "stages": {stage.name: stage.stats(elapsed) for stage in self.stages},
+        }
+
+    async def _put(self, stage, item):
+        await stage.queue.put(item)
+        stage.max_depth = max(stage.max_depth, stage.queue.qsize())
+
+    async def _worker(self, position, results):
+        stage = self.stages[position]
+        downstream = self.stages[position + 1] if position + 1 < len(self.stages) else None
+        while True:
+            item = await stage.queue.get()
+            if item is None:
+                return
+            index, value = item
+            stage.in_progress += 1
+            started = time.monotonic()
+            try:
+                if stage.rate is not None:
+                    await stage.rate.acquire(self.deadline)
+                value = await stage.process(index, value)
+            except InterruptProcessingException:
+                raise
+            except Exception as e:
+                stage.failed += 1
+                results[index] = e
+                continue
+            finally:
+                stage.in_progress -= 1
+                stage.busy_seconds += time.monotonic() - started
+            stage.completed += 1
+            if downstream is None:
+                results[index] = value
+            else:
+                await self._put(downstream, (index, value))
+
+    async def _run_stage(self, position, results):
+        stage = self.stages[position]
+        await asyncio.gather(*[self._worker(position, results) for _ in range(stage.workers)])
+        # 本阶段的工作协程全部结束后，通知下一阶段没有新的项了
+        if position + 1 < len(self.stages):
+            for _ in range(self.stages[position + 1].workers):
+                await self.stages[position + 1].queue.put(None)
+
+    async def _feed(self, items):
+        first = self.stages[0]
+        for item in items:
+            await self._put(first, item)
+        for _ in range(first.workers):
+            await first.queue.put(None)
+
+    async def run(self, items):
+        """处理 items 中的 (序号, 值)，返回 {序号: 最后一个阶段的结果或异常}"""
+        results = {}
+        for stage in self.stages:
+            stage.queue = asyncio.Queue(maxsize=max(0, stage.queue_size))
+        self.started_at = time.monotonic()
+        _active.add(self)
+        tasks = [asyncio.ensure_future(self._feed(items))]
+        tasks += [asyncio.ensure_future(self._run_stage(position, results)) for position in range(len(self.stages))]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                if task.exception() is not None:
+                    raise task.exception()
+            return results
+        finally:
+            # 出错或被取消时停止所有阶段，在途的任务各自取消远端任务后才返回
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.finished_at = time.monotonic()
+            _active.discard(self)
+            logger.info(f"[BailianPipeline] {self.name} 阶段统计: {json.dumps(self.stats()['stages'], ensure_ascii=False)}")
+
+
+def stats():
+    """正在运行的流水线的各阶段队列深度、在途数和吞吐量"""
+    return [pipeline.stats() for pipeline in list(_active)]
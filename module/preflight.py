@@ -0,0 +1,151 @@
+import io
+import os
+import time
+import threading
+
+from . import transport
+from .lazy import lazy_import
+from .logging import logger
+
+asyncio = lazy_import("asyncio")
+Image = lazy_import("PIL.Image")
+
+
+# 同时进行的预检请求数
+CONCURRENCY = int(os.environ.get("BAILIAN_PREFLIGHT_CONCURRENCY", "16"))
+# 预检结果的缓存时间（秒），同一个 URL 在有效期内不会重复请求
+CACHE_TTL = float(os.environ.get("BAILIAN_PREFLIGHT_CACHE_TTL", "600"))
+# 是否读取图片头部检查尺寸（额外一次 Range 请求，只下载前 64KB）
+CHECK_DIMENSIONS = os.environ.get("BAILIAN_PREFLIGHT_DIMENSIONS", "1").lower() in ("1", "true", "yes", "on")
+
+# 读取图片头部的字节数，足够解析常见 JPEG/PNG 的尺寸
+_PROBE_BYTES = 64 * 1024
+
+# 百炼图像接口对输入图片的通用限制
+DEFAULT_RULES = {
+    "max_bytes": 5 * 1024 * 1024,
+    "content_types": ("image/jpeg", "image/jpg", "image/png", "image/bmp", "image/heic", "image/webp"),
+    "min_side": 150,
+    "max_side": 4096,
+}
+
+_lock = threading.Lock()
+_cache = {}
+
+
+class _Probe:
+    """URL 的探测结果，与校验规则无关，可以缓存复用"""
+
+    def __init__(self, status=None, content_type=None, size=None, width=None, height=None, error=None):
+        self.status = status
+        self.content_type = content_type
+        self.size = size
+        self.width = width
+        self.height = height
+        self.error = error
+
+
+def _cached(url):
+    with _lock:
+        entry = _cache.get(url)
+        if entry is not None and entry[0] > time.monotonic():
+            return entry[1]
+        _cache.pop(url, None)
+        return None
+
+
+def _remember(url, probe):
+    with _lock:
+        _cache[url] = (time.monotonic() + CACHE_TTL, probe)
+
+
+def _total_size(headers):
+    """从 Content-Range（bytes 0-65535/123456）或 Content-Length 中取出文件总大小"""
+    content_range = headers.get("content-range", "")
+    if "/" in content_range:
+        total = content_range.rsplit("/", 1)[-1]
+        if total.isdigit():
+            return int(total)
+    content_length = headers.get("content-length", "")
+    return int(content_length) if content_length.isdigit() else None
+
+
+async def _probe(url, deadline):
+    probe = _Probe()
+    try:
+        response = await transport.fetch("HEAD", url, deadline=deadline)
+        # 部分对象存储不支持 HEAD（或预签名 URL 只对 GET 签名），改用 Range 请求
+        need_range = response.status in (403, 405, 501) or CHECK_DIMENSIONS
+        if response.status == 200:
+            probe.status = 200
+            probe.content_type = response.headers.get("content-type", "").split(";")[0].strip().lower()
+            probe.size = _total_size(response.headers)
+        if need_range:
+            response = await transport.fetch("GET", url, headers={"Range": f"bytes=0-{_PROBE_BYTES - 1}"}, deadline=deadline)
+            if response.status in (200, 206):
+                probe.status = 200
+                probe.content_type = probe.content_type or response.headers.get("content-type", "").split(";")[0].strip().lower()
+                # 服务端忽略 Range 时返回的是完整文件
+                probe.size = probe.size or (_total_size(response.headers) if response.status == 206 else len(response.body))
+                try:
+                    probe.width, probe.height = Image.open(io.BytesIO(response.body)).size
+                except Exception:
+                    # 头部不完整时无法确定尺寸，不作为错误
+                    pass
+        if probe.status is None:
+            probe.status = response.status
+            probe.error = f"无法访问 ({response.status})"
+    except transport.RequestError as e:
+        probe.error = f"无法访问: {str(e)}"
+    return probe
+
+
+def _evaluate(url, probe, rules):
+    result = {
+        "url": url,
+        "ok": False,
+        "content_type": probe.content_type,
+        "size": probe.size,
+        "width": probe.width,
+        "height": probe.height,
+    }
+    if probe.error:
+        result["error"] = probe.error
+    elif probe.content_type and rules.get("content_types") and probe.content_type not in rules["content_types"]:
+        result["error"] = f"不支持的图片格式: {probe.content_type}"
+    elif probe.size is not None and rules.get("max_bytes") and probe.size > rules["max_bytes"]:
+        result["error"] = f"图片过大: {probe.size / 1024 / 1024:.1f}MB，上限 {rules['max_bytes'] / 1024 / 1024:.1f}MB"
+    elif probe.width and rules.get("min_side") and min(probe.width, probe.height) < rules["min_side"]:
+        result["error"] = f"图片尺寸过小: {probe.width}x{probe.height}，最短边至少 {rules['min_side']}"
+    elif probe.width and rules.get("max_side") and max(probe.width, probe.height) > rules["max_side"]:
+        result["error"] = f"图片尺寸过大: {probe.width}x{probe.height}，最长边不超过 {rules['max_side']}"
+    else:
+        result["ok"] = True
+    return result
+
+
+async def validate(urls, rules=None, deadline=None):
+    """并发检查所有输入图片 URL（可访问、格式、大小、尺寸），返回 {url: 检查结果}
+
+    只检查 http(s) URL，其他协议（如 oss://）直接视为通过。探测结果按 URL 缓存 CACHE_TTL 秒。
+    """
+    rules = DEFAULT_RULES if rules is None else rules
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def check(url):
+        if not url.lower().startswith(("http://", "https://")):
+            return {"url": url, "ok": True, "skipped": True}
+        probe = _cached(url)
+        if probe is None:
+            async with semaphore:
+                probe = await _probe(url, deadline)
+            # 网络错误可能是暂时的，不缓存
+            if probe.error is None or probe.status is not None:
+                _remember(url, probe)
+        return _evaluate(url, probe, rules)
+
+    unique_urls = list(dict.fromkeys(url for url in urls if url))
+    results = await asyncio.gather(*[check(url) for url in unique_urls])
+    failed = [result for result in results if not result["ok"]]
+    logger.info(f"[BailianPreflight] 检查 {len(unique_urls)} 个图片 URL，{len(failed)} 个不可用")
+    return {result["url"]: result for result in results}
@@ -0,0 +1,149 @@
+import io
+import os
+import time
+import hashlib
+import threading
+
+from . import transport
+from . import codec
+from . import upload
+from .lazy import lazy_import
+from .logging import logger
+
+asyncio = lazy_import("asyncio")
+Image = lazy_import("PIL.Image")
+ImageOps = lazy_import("PIL.ImageOps")
+
+
+# 各模型的输入图片规格：最长边、宽高比（宽/高）范围，超出最长边时等比缩小，超出宽高比范围时补白边
+PROFILES = {
+    "aitryon": {"max_side": 1536, "min_aspect": 0.5, "max_aspect": 2.0},
+    "aitryon-plus": {"max_side": 2048, "min_aspect": 0.5, "max_aspect": 2.0},
+    "aitryon-refiner": {"max_side": 2048, "min_aspect": 0.5, "max_aspect": 2.0},
+}
+# 未知模型只按百炼图像接口的通用上限处理
+DEFAULT_PROFILE = {"max_side": 4096, "min_aspect": 0.25, "max_aspect": 4.0}
+
+# 重新压缩的 JPEG 质量
+JPEG_QUALITY = int(os.environ.get("BAILIAN_PREPROCESS_QUALITY", "90"))
+# 同时处理的图片数
+CONCURRENCY = int(os.environ.get("BAILIAN_PREPROCESS_CONCURRENCY", "8"))
+# 处理结果的缓存时间（秒），不超过临时存储空间 48 小时的有效期
+CACHE_TTL = 47 * 3600
+
+_lock = threading.Lock()
+_cache = {}
+
+
+def get_profile(model):
+    return PROFILES.get(model, DEFAULT_PROFILE)
+
+
+def process_bytes(data, profile):
+    """按模型规格处理图片：EXIF 方向、去透明通道、补边到允许的宽高比、缩小到最长边、重新压缩为 JPEG
+
+    返回 (处理后的字节, 报告)，图片不需要处理或处理后反而更大时字节为 None
+    """
+    img = Image.open(io.BytesIO(data))
+    original_size = img.size
+    actions = []
+
+    # 0x0112 为 EXIF 方向标签，1 表示不需要旋转
+    if img.getexif().get(0x0112, 1) != 1:
+        actions.append("exif_transpose")
+    img = ImageOps.exif_transpose(img)
+
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img.convert("RGBA"), mask=img.convert("RGBA").split()[-1])
+        img = background
+        actions.append("flatten_alpha")
+    elif img.mode != "RGB":
+        img = img.convert("RGB")
+
+    w, h = img.size
+    if w / h < profile["min_aspect"]:
+        target = (int(round(h * profile["min_aspect"])), h)
+    elif w / h > profile["max_aspect"]:
+        target = (w, int(round(w / profile["max_aspect"])))
+    else:
+        target = None
+    if target is not None:
+        padded = Image.new("RGB", target, (255, 255, 255))
+        padded.paste(img, ((target[0] - w) // 2, (target[1] - h) // 2))
+        img = padded
+        actions.append("pad_aspect")
+
+    if max(img.size) > profile["max_side"]:
+        scale = profile["max_side"] / max(img.size)
+        img = img.resize((max(1, int(img.width * scale)), max(1, int(img.height * scale))), Image.LANCZOS)
+        actions.append("resize")
+
+    output = io.BytesIO()
+    img.save(output, format="JPEG", quality=JPEG_QUALITY, optimize=True)
+    processed = output.getvalue()
+
+    # 只是重新压缩且没有变小时保留原图
+    if not actions and len(processed) >= len(data):
+        processed = None
+    elif len(processed) < len(data):
+        actions.append("recompress")
+
+    report = {
+        "actions": actions if processed is not None else [],
+        "original_bytes": len(data),
+        "bytes": len(processed) if processed is not None else len(data),
+        "original_size": list(original_size),
+        "size": list(img.size) if processed is not None else list(original_size),
+    }
+    report["bytes_saved"] = report["original_bytes"] - report["bytes"]
+    report["pixels_saved"] = original_size[0] * original_size[1] - report["size"][0] * report["size"][1]
+    return processed, report
+
+
+async def _preprocess_one(url, model, profile, api_key, deadline):
+    # 临时存储空间的地址只有上传时使用的 API Key 所属的账号可以使用，按 API Key 区分缓存
+    cache_key = (url, model, hashlib.sha256((api_key or "").encode("utf-8")).hexdigest())
+    with _lock:
+        entry = _cache.get(cache_key)
+        if entry is not None and entry[0] > time.monotonic():
+            return entry[1]
+
+    report = {"source_url": url, "url": url}
+    try:
+        data = await transport.request_bytes("GET", url, deadline=deadline)
+        processed, details = await codec.preprocess(data, profile)
+        report.update(details)
+        if processed is not None:
+            report["url"] = await upload.upload_bytes(processed, "input.jpg", "image/jpeg", model, api_key, deadline)
+    except Exception as e:
+        # 预处理失败不影响任务，继续使用原图
+        report["error"] = f"预处理失败: {str(e)}"
+        logger.info(f"[BailianPreprocess] {url} {report['error']}")
+        return report
+
+    with _lock:
+        _cache[cache_key] = (time.monotonic() + CACHE_TTL, report)
+    return report
+
+
+async def preprocess_urls(urls, model, api_key, deadline=None):
+    """按模型规格批量预处理输入图片并上传到临时存储空间，返回 {原 URL: 报告}，报告中的 url 为处理后应使用的地址
+
+    只处理 http(s) URL；不需要处理或处理失败的图片继续使用原 URL。
+    """
+    profile = get_profile(model)
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def run(url):
+        if not url.lower().startswith(("http://", "https://")):
+            return {"source_url": url, "url": url, "actions": []}
+        async with semaphore:
+            return await _preprocess_one(url, model, profile, api_key, deadline)
+
+    unique_urls = list(dict.fromkeys(url for url in urls if url))
+    reports = await asyncio.gather(*[run(url) for url in unique_urls])
+    saved = sum(report.get("bytes_saved", 0) for report in reports)
+    changed = len([report for report in reports if report["url"] != report["source_url"]])
+    logger.info(f"[BailianPreprocess] 预处理 {len(unique_urls)} 张图片，替换 {changed} 张，共节省 {saved / 1024 / 1024:.1f}MB")
+    return {report["source_url"]: report for report in reports}
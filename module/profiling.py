@@ -0,0 +1,254 @@
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import inspect
+import functools
+import threading
+
+from . import eventloop
+from .context import current_prompt_id
+from .logging import logger
+
+
+# 是否按 SAMPLE_RATE 对节点执行采样分析；节点的 profile 输入可以单独打开某一次执行
+ENABLED = os.environ.get("BAILIAN_PROFILE", "").lower() in ("1", "true", "yes", "on")
+# 开启时被分析的执行比例（0~1），生产环境可以只分析一小部分执行
+SAMPLE_RATE = float(os.environ.get("BAILIAN_PROFILE_SAMPLE_RATE", "1"))
+# 采样间隔（毫秒）
+INTERVAL_MS = float(os.environ.get("BAILIAN_PROFILE_INTERVAL_MS", "5"))
+# 输出格式：speedscope（https://www.speedscope.app 直接打开）或 collapsed（flamegraph.pl、inferno 等使用的折叠栈）
+FORMAT = os.environ.get("BAILIAN_PROFILE_FORMAT", "speedscope").lower()
+# 输出目录
+PROFILE_DIR = os.environ.get("BAILIAN_PROFILE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "comfyui-bailian", "profiles"))
+
+# 线程停在这些文件中时视为空闲（事件循环等待网络、执行器线程等待结果）
+_IDLE_FILES = ("selectors.py", "threading.py")
+
+_active_lock = threading.Lock()
+_active = 0
+
+
+def _frame_name(code):
+    return getattr(code, "co_qualname", code.co_name)
+
+
+def _thread_cpu_clock(ident):
+    """线程的 CPU 时钟，平台不支持时返回 None"""
+    try:
+        return time.pthread_getcpuclockid(ident)
+    except (AttributeError, OSError):
+        return None
+
+
+class _Sampler(threading.Thread):
+    """定时读取目标线程的调用栈，按实际间隔累计权重"""
+
+    def __init__(self, threads, interval):
+        super().__init__(name="bailian-profiler", daemon=True)
+        self.threads = threads
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.frames = {}
+        self._stacks = {}
+        self.samples = {label: [] for label in threads.values()}
+        self.idle = {label: 0.0 for label in threads.values()}
+        self.max_concurrent = 0
+
+    def _frame_index(self, code):
+        key = (_frame_name(code), code.co_filename, code.co_firstlineno)
+        index = self.frames.get(key)
+        if index is None:
+            index = self.frames[key] = len(self.frames)
+        return index
+
+    def run(self):
+        last = time.perf_counter()
+        while not self.stopped.wait(self.interval):
+            now = time.perf_counter()
+            weight, last = now - last, now
+            current_frames = sys._current_frames()
+            self.max_concurrent = max(self.max_concurrent, _active)
+            for ident, label in self.threads.items():
+                frame = current_frames.get(ident)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self._frame_index(frame.f_code))
+                    frame = frame.f_back
+                stack.reverse()
+                # 相同的调用栈只保存一份
+                stack = tuple(stack)
+                stack = self._stacks.setdefault(stack, stack)
+                self.samples[label].append((stack, weight))
+                leaf_file = current_frames[ident].f_code.co_filename
+                if os.path.basename(leaf_file) in _IDLE_FILES:
+                    self.idle[label] += weight
+
+
+class Profile:
+    """一次节点执行的采样分析：记录墙钟时间、CPU 时间和各线程的调用栈"""
+
+    def __init__(self, node, unique_id):
+        self.node = node
+        self.unique_id = unique_id
+        self.prompt_id = current_prompt_id()
+        threads = {threading.get_ident(): "caller"}
+        eventloop.get_loop()
+        loop_ident = eventloop.loop_thread_ident()
+        if loop_ident is not None and loop_ident != threading.get_ident():
+            threads[loop_ident] = "bailian-event-loop"
+        self.threads = threads
+        self._sampler = _Sampler(threads, INTERVAL_MS / 1000)
+
+    def __enter__(self):
+        self._clocks = {label: _thread_cpu_clock(ident) for ident, label in self.threads.items()}
+        self._thread_cpu = {label: time.clock_gettime(clock) for label, clock in self._clocks.items() if clock is not None}
+        self._wall = time.perf_counter()
+        self._process_cpu = time.process_time()
+        self.started_at = time.time()
+        self._sampler.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._sampler.stopped.set()
+        self._sampler.join()
+        self.wall = time.perf_counter() - self._wall
+        self.process_cpu = time.process_time() - self._process_cpu
+        self.thread_cpu = {
+            label: time.clock_gettime(self._clocks[label]) - start for label, start in self._thread_cpu.items()
+        }
+        try:
+            self.write()
+        except Exception as e:
+            logger.info(f"[BailianProfile] 写入分析结果失败: {str(e)}")
+
+    def summary(self):
+        sampler = self._sampler
+        threads = {}
+        for label, samples in sampler.samples.items():
+            sampled = sum(weight for _, weight in samples)
+            threads[label] = {
+                "cpu_seconds": self.thread_cpu.get(label),
+                "sampled_seconds": sampled,
+                "idle_seconds": sampler.idle[label],
+                "busy_seconds": sampled - sampler.idle[label],
+            }
+        return {
+            "node": self.node,
+            "unique_id": self.unique_id,
+            "prompt_id": self.prompt_id,
+            "started_at": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.started_at)),
+            "wall_seconds": self.wall,
+            "process_cpu_seconds": self.process_cpu,
+            "threads": threads,
+            # 事件循环线程是所有百炼节点共享的，大于 1 时调用栈中包含同时执行的其他节点
+            "max_concurrent_executions": sampler.max_concurrent,
+            "interval_ms": INTERVAL_MS,
+        }
+
+    def _speedscope(self):
+        sampler = self._sampler
+        frames = [{"name": name, "file": file, "line": line} for (name, file, line) in sampler.frames]
+        profiles = []
+        for label, samples in sampler.samples.items():
+            profiles.append({
+                "type": "sampled",
+                "name": label,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": self.wall,
+                "samples": [list(stack) for stack, _ in samples],
+                "weights": [weight for _, weight in samples],
+            })
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": f"{self.node} {self.unique_id or ''}".strip(),
+            "exporter": "ComfyUI-AliCloud-Bailian",
+            "shared": {"frames": frames},
+            "profiles": profiles,
+        }
+
+    def _collapsed(self):
+        names = [f"{name} ({os.path.basename(file)}:{line})" for (name, file, line) in self._sampler.frames]
+        totals = {}
+        for label, samples in self._sampler.samples.items():
+            for stack, weight in samples:
+                key = ";".join([label] + [names[index] for index in stack])
+                totals[key] = totals.get(key, 0.0) + weight
+        # 折叠栈的计数为整数，以微秒为单位
+        return "".join(f"{key} {int(round(value * 1e6))}\n" for key, value in totals.items() if value > 0)
+
+    def write(self):
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(self.started_at))
+        base = os.path.join(PROFILE_DIR, f"{stamp}-{self.node}-{self.unique_id or '-'}-{uuid.uuid4().hex[:8]}")
+        if FORMAT == "collapsed":
+            path = base + ".collapsed.txt"
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(self._collapsed())
+        else:
+            path = base + ".speedscope.json"
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(self._speedscope(), f)
+        summary = self.summary()
+        with open(base + ".summary.json", "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        logger.info(f"[BailianProfile] {self.node} 墙钟 {self.wall:.3f}秒，进程 CPU {self.process_cpu:.3f}秒，分析结果: {path}")
+
+
+def _should_profile(requested):
+    return requested or (ENABLED and random.random() < SAMPLE_RATE)
+
+
+class _Active:
+    """统计同时执行的节点数"""
+
+    def __enter__(self):
+        global _active
+        with _active_lock:
+            _active += 1
+
+    def __exit__(self, *exc):
+        global _active
+        with _active_lock:
+            _active -= 1
+
+
+def profiled(cls):
+    """节点类装饰器：增加可选的 profile 输入，开启或被采样到时对 FUNCTION 的执行做采样分析
+
+    需要放在 eventloop.async_node 之上，分析的是节点入口（包括在后台事件循环中执行的部分）。
+    """
+    function_name = cls.FUNCTION
+    function = getattr(cls, function_name)
+    input_types = cls.INPUT_TYPES.__func__
+
+    def INPUT_TYPES(s):
+        types = input_types(s)
+        types.setdefault("optional", {})["profile"] = ("BOOLEAN", {"default": False})
+        return types
+
+    if inspect.iscoroutinefunction(function):
+        @functools.wraps(function)
+        async def entry(self, *args, profile=False, **kwargs):
+            with _Active():
+                if not _should_profile(profile):
+                    return await function(self, *args, **kwargs)
+                with Profile(cls.__name__, kwargs.get("unique_id")):
+                    return await function(self, *args, **kwargs)
+    else:
+        @functools.wraps(function)
+        def entry(self, *args, profile=False, **kwargs):
+            with _Active():
+                if not _should_profile(profile):
+                    return function(self, *args, **kwargs)
+                with Profile(cls.__name__, kwargs.get("unique_id")):
+                    return function(self, *args, **kwargs)
+
+    cls.INPUT_TYPES = classmethod(INPUT_TYPES)
+    setattr(cls, function_name, entry)
+    return cls
@@ -0,0 +1,154 @@
+import os
+import time
+import threading
+from collections import deque
+
+from .context import current_execution
+
+
+# 保留的已结束任务记录数
+HISTORY = int(os.environ.get("BAILIAN_TASK_HISTORY", "1000"))
+# 在途任务记录数上限，超出时最久没有更新的记录移入历史
+MAX_OUTSTANDING = int(os.environ.get("BAILIAN_TASK_MAX_OUTSTANDING", "20000"))
+# 在途记录超过这个时间（秒）没有任何更新时移入历史，如提交后没有节点轮询的任务（BailianAPISubmit）
+STALE_AFTER = float(os.environ.get("BAILIAN_TASK_STALE_AFTER", "3600"))
+
+_TERMINAL_STATUSES = ("SUCCEEDED", "FAILED", "CANCELED", "UNKNOWN")
+
+
+class TaskRecord:
+    """一个百炼任务的登记信息，使用 __slots__ 让数千个在途任务只占很少的内存"""
+
+    __slots__ = ("task_id", "model", "phase", "node", "unique_id", "prompt_id", "status", "submitted_at", "updated_at", "finished_at", "polls")
+
+    def __init__(self, task_id, model, phase, status):
+        execution = current_execution() or (None, None, None)
+        self.task_id = task_id
+        self.model = model
+        self.phase = phase
+        self.node, self.unique_id, self.prompt_id = execution
+        self.status = status
+        self.submitted_at = time.time()
+        self.updated_at = self.submitted_at
+        self.finished_at = None
+        self.polls = 0
+
+    def to_dict(self, now):
+        end = self.finished_at or now
+        return {
+            "task_id": self.task_id,
+            "model": self.model,
+            "phase": self.phase,
+            "node": self.node,
+            "unique_id": self.unique_id,
+            "prompt_id": self.prompt_id,
+            "status": self.status,
+            "submitted_at": self.submitted_at,
+            "age_seconds": round(end - self.submitted_at, 3),
+            "since_update_seconds": round(now - self.updated_at, 3),
+            "polls": self.polls,
+        }
+
+
+class TaskRegistry:
+    """进程内所有百炼任务的登记表：在途任务按 task_id 索引，结束的任务保留最近 HISTORY 条
+
+    在途任务按最近一次更新的时间排列，过期和超出上限时从最前面移出。
+    """
+
+    def __init__(self, history, max_outstanding, stale_after):
+        self.max_outstanding = max_outstanding
+        self.stale_after = stale_after
+        self._lock = threading.Lock()
+        self._outstanding = {}
+        self._history = deque(maxlen=history)
+        self._totals = {"submitted": 0, "finished": 0}
+
+    def _finish_locked(self, record, status):
+        record.status = status
+        record.finished_at = record.updated_at = time.time()
+        self._history.append(record)
+        self._totals["finished"] += 1
+
+    def _expire_locked(self, now):
+        while self._outstanding:
+            oldest = next(iter(self._outstanding.values()))
+            if now - oldest.updated_at < self.stale_after:
+                return
+            self._finish_locked(self._outstanding.pop(oldest.task_id), "EXPIRED")
+
+    def submitted(self, task_id, model, phase, status="PENDING"):
+        """提交成功（包括复用账本中的任务）后登记"""
+        # 同步调用直接返回结果，不需要登记
+        if status in _TERMINAL_STATUSES:
+            return
+        with self._lock:
+            if task_id in self._outstanding:
+                return
+            record = self._outstanding[task_id] = TaskRecord(task_id, model, phase, status)
+            self._expire_locked(record.submitted_at)
+            self._totals["submitted"] += 1
+            while len(self._outstanding) > self.max_outstanding:
+                oldest = next(iter(self._outstanding))
+                self._finish_locked(self._outstanding.pop(oldest), "EVICTED")
+
+    def polled(self, task_id, status):
+        """查询到任务状态后更新，任务结束时移入历史；不在登记表中的任务（如其他进程提交的）不记录"""
+        with self._lock:
+            record = self._outstanding.get(task_id)
+            if record is None:
+                return
+            record.polls += 1
+            if status in _TERMINAL_STATUSES:
+                self._finish_locked(self._outstanding.pop(task_id), status)
+            else:
+                record.status = status or record.status
+                record.updated_at = time.time()
+                # 移到最后，保持按更新时间排列
+                self._outstanding[task_id] = self._outstanding.pop(task_id)
+
+    def finished(self, task_id, status):
+        """节点不再跟踪任务（取消、等待超时）时移入历史"""
+        with self._lock:
+            record = self._outstanding.pop(task_id, None)
+            if record is not None:
+                self._finish_locked(record, status)
+
+    def snapshot(self, filters=None, min_age=None, include_history=False, limit=100):
+        """在途任务（以及可选的历史记录）和汇总统计
+
+        filters 为 {字段: 值}（status、phase、model、node、unique_id、prompt_id），min_age 只返回等待超过该秒数的任务；
+        任务按等待时间从长到短排列，最多返回 limit 条，汇总统计包括所有符合条件的任务。
+        """
+        now = time.time()
+        filters = {key: value for key, value in (filters or {}).items() if value}
+        with self._lock:
+            self._expire_locked(now)
+            outstanding = [record.to_dict(now) for record in self._outstanding.values()]
+            history = [record.to_dict(now) for record in self._history] if include_history else []
+            totals = dict(self._totals, outstanding=len(self._outstanding))
+
+        def matches(task):
+            if min_age is not None and task["age_seconds"] < min_age:
+                return False
+            return all(str(task.get(key)) == str(value) for key, value in filters.items())
+
+        outstanding = sorted((task for task in outstanding if matches(task)), key=lambda task: -task["age_seconds"])
+        counts = {"status": {}, "phase": {}, "model": {}, "node": {}}
+        for task in outstanding:
+            for field, values in counts.items():
+                key = str(task[field])
+                values[key] = values.get(key, 0) + 1
+        result = {
+            "totals": totals,
+            "matched": len(outstanding),
+            "oldest_age_seconds": outstanding[0]["age_seconds"] if outstanding else None,
+            "counts": counts,
+            "tasks": outstanding[:limit],
+        }
+        if include_history:
+            result["history"] = [task for task in reversed(history) if matches(task)][:limit]
+        return result
+
+
+registry = TaskRegistry(HISTORY, MAX_OUTSTANDING, STALE_AFTER)
@@ -0,0 +1,58 @@
+from . import callback
+from . import adaptive
+from . import pipeline
+from .scheduler import scheduler
+from .registry import registry
+from .logging import logger
+
+
+# 并发状态：每个接口地址的自适应并发上限、进程级调度器的名额和正在运行的流水线各阶段的状态
+CONCURRENCY_ROUTE_PATH = "/bailian/concurrency"
+
+
+async def handle_concurrency(request):
+    from aiohttp import web
+    return web.json_response({"adaptive": adaptive.stats(), "scheduler": scheduler.stats(), "pipelines": pipeline.stats()})
+
+
+# 任务登记表：在途任务、最近结束的任务和汇总统计
+TASKS_ROUTE_PATH = "/bailian/tasks"
+
+_TASK_FILTERS = ("status", "phase", "model", "node", "unique_id", "prompt_id")
+
+
+async def handle_tasks(request):
+    """查询参数：status、phase、model、node、unique_id、prompt_id 过滤，min_age 为最短等待秒数，
+    history=1 时包含最近结束的任务，limit 为返回的任务数上限（默认 100）
+    """
+    from aiohttp import web
+    query = request.query
+    try:
+        min_age = float(query["min_age"]) if query.get("min_age") else None
+        limit = int(query.get("limit", "100"))
+    except ValueError:
+        return web.json_response({"error": "min_age 和 limit 必须是数字"}, status=400)
+    snapshot = registry.snapshot(
+        {key: query.get(key) for key in _TASK_FILTERS},
+        min_age=min_age,
+        include_history=query.get("history", "").lower() in ("1", "true", "yes", "on"),
+        limit=limit,
+    )
+    snapshot["scheduler"] = {key: value for key, value in scheduler.stats().items() if key != "owners"}
+    return web.json_response(snapshot)
+
+
+def setup_routes():
+    """在 ComfyUI 的 PromptServer 上注册插件的 HTTP 路由，脱离 ComfyUI 运行时跳过"""
+    try:
+        from server import PromptServer
+        routes = PromptServer.instance.routes
+    except Exception:
+        return
+
+    if callback.ENABLED:
+        routes.post(callback.ROUTE_PATH)(callback.handle_callback)
+        logger.info(f"[BailianCallback] 已启用回调模式，接收地址: {callback.ROUTE_PATH}，兜底轮询间隔: {callback.FALLBACK_POLL_INTERVAL}秒")
+
+    routes.get(CONCURRENCY_ROUTE_PATH)(handle_concurrency)
+    routes.get(TASKS_ROUTE_PATH)(handle_tasks)
@@ -0,0 +1,155 @@
+import os
+import threading
+from collections import deque
+from contextlib import asynccontextmanager
+
+from . import interrupt
+from .deadline import DeadlineExceeded
+from .lazy import lazy_import
+
+asyncio = lazy_import("asyncio")
+
+
+# 整个进程同时在途的百炼任务数上限（所有节点、所有 prompt 共享）
+MAX_CONCURRENT_TASKS = int(os.environ.get("BAILIAN_MAX_CONCURRENT_TASKS", "16"))
+
+
+class _Waiter:
+    """排队中的一次提交请求，被调度到时通过 grant() 唤醒 loop 上等待的协程"""
+
+    def __init__(self, owner, loop):
+        self.owner = owner
+        self.loop = loop
+        self.granted = False
+        self.cancelled = False
+        self.future = loop.create_future()
+
+    def grant(self):
+        """在调度器锁内调用，返回 False 表示等待方已不存在，名额需要交还"""
+        self.granted = True
+        try:
+            self.loop.call_soon_threadsafe(self._resolve)
+            return True
+        except RuntimeError:
+            # 等待方所在的事件循环已关闭
+            return False
+
+    def _resolve(self):
+        # future 被 shield 保护，等待方取消时由 FairScheduler._cancel 归还名额
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class FairScheduler:
+    """进程级的百炼任务调度器
+
+    每个 owner（prompt + 节点）一个队列，按权重做 stride 公平调度：每次放行一个任务，
+    owner 的 pass 值增加 1/weight，空闲名额总是分给 pass 值最小的 owner。
+    新出现的 owner 从当前虚拟时间开始计数，因此只有一两个任务的交互式请求可以插到
+    大批量任务的前面，而大批量任务仍然可以用满空闲的名额。
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._queues = {}
+        self._weights = {}
+        self._pass = {}
+        self._in_flight = {}
+        self._virtual_time = 0.0
+        self._total_in_flight = 0
+
+    def _enqueue(self, waiter, weight):
+        owner = waiter.owner
+        queue = self._queues.get(owner)
+        if queue is None:
+            queue = self._queues[owner] = deque()
+        if not queue:
+            # 重新变为活跃的 owner 不能带着过去空闲时积累的额度插队
+            self._pass[owner] = max(self._pass.get(owner, 0.0), self._virtual_time)
+        self._weights[owner] = max(1, weight)
+        queue.append(waiter)
+        self._dispatch()
+
+    def _dispatch(self):
+        while self._total_in_flight < self.capacity:
+            candidates = [owner for owner, queue in self._queues.items() if queue]
+            if not candidates:
+                break
+            owner = min(candidates, key=lambda o: self._pass[o])
+            waiter = self._queues[owner].popleft()
+            if waiter.cancelled:
+                continue
+            self._virtual_time = self._pass[owner]
+            self._pass[owner] += 1.0 / self._weights[owner]
+            self._total_in_flight += 1
+            self._in_flight[owner] = self._in_flight.get(owner, 0) + 1
+            if not waiter.grant():
+                self._release_locked(owner)
+        self._cleanup()
+
+    def _cleanup(self):
+        for owner in [o for o, q in self._queues.items() if not q and not self._in_flight.get(o)]:
+            self._queues.pop(owner, None)
+            self._weights.pop(owner, None)
+            self._in_flight.pop(owner, None)
+            # 保留 pass 值没有意义：重新活跃时会被提升到当前虚拟时间
+            self._pass.pop(owner, None)
+
+    def _release_locked(self, owner):
+        self._total_in_flight -= 1
+        self._in_flight[owner] = self._in_flight.get(owner, 1) - 1
+
+    def _cancel(self, waiter):
+        with self._lock:
+            if waiter.granted:
+                self._release_locked(waiter.owner)
+                self._dispatch()
+            else:
+                waiter.cancelled = True
+
+    def release(self, owner):
+        with self._lock:
+            self._release_locked(owner)
+            self._dispatch()
+
+    async def async_acquire(self, owner, weight=1, deadline=None):
+        """异步等待直到获得一个名额，等待期间可被 ComfyUI 取消，排队时间计入 deadline"""
+        waiter = _Waiter(owner, asyncio.get_running_loop())
+        with self._lock:
+            self._enqueue(waiter, weight)
+        try:
+            timeout = deadline.remaining() if deadline is not None else None
+            await asyncio.wait_for(interrupt.wait_for(asyncio.shield(waiter.future)), timeout)
+        except asyncio.TimeoutError:
+            self._cancel(waiter)
+            raise DeadlineExceeded(f"排队等待提交前已超出最大等待时间 ({deadline.budget}秒)")
+        except BaseException:
+            self._cancel(waiter)
+            raise
+
+    @asynccontextmanager
+    async def async_slot(self, owner, weight=1, deadline=None):
+        await self.async_acquire(owner, weight, deadline)
+        try:
+            yield
+        finally:
+            self.release(owner)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "capacity": self.capacity,
+                "in_flight": self._total_in_flight,
+                "owners": {
+                    owner: {
+                        "weight": self._weights.get(owner, 1),
+                        "queued": len(queue),
+                        "in_flight": self._in_flight.get(owner, 0),
+                    }
+                    for owner, queue in self._queues.items()
+                },
+            }
+
+
+scheduler = FairScheduler(MAX_CONCURRENT_TASKS)
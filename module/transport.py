@@ -0,0 +1,243 @@
+import os
+import json as json_module
+import weakref
+from contextlib import asynccontextmanager
+
+from .deadline import CONNECT_TIMEOUT, READ_TIMEOUT
+from .lazy import lazy_import
+from .logging import logger
+
+# 第一次发送请求时才导入
+asyncio = lazy_import("asyncio")
+aiohttp = lazy_import("aiohttp")
+
+
+# 每个事件循环共享一个连接池，提交、轮询都复用 keep-alive 连接
+POOL_LIMIT = int(os.environ.get("BAILIAN_HTTP_POOL_LIMIT", "100"))
+# 可选的 HTTP/2 传输（需要安装 httpx[http2]）：大量提交、轮询请求复用少数几个连接并发传输，
+# 服务端不支持时通过 ALPN 协商自动回退到 HTTP/1.1
+HTTP2 = os.environ.get("BAILIAN_HTTP2", "").lower() in ("1", "true", "yes", "on")
+# 明文 HTTP/2（h2c），不经过协商直接以 HTTP/2 连接，用于本地 h2c 代理等场景
+HTTP2_PRIOR_KNOWLEDGE = os.environ.get("BAILIAN_HTTP2_PRIOR_KNOWLEDGE", "").lower() in ("1", "true", "yes", "on")
+
+_sessions = weakref.WeakKeyDictionary()
+_http2_available = None
+
+
+class RequestError(Exception):
+    pass
+
+
+class APIError(RequestError):
+    """接口返回了非 200 的状态码"""
+
+    def __init__(self, status, text):
+        self.status = status
+        self.text = text
+        super().__init__(f"{status} {text}")
+
+
+class TransportError(RequestError):
+    """连接失败、超时等网络错误"""
+    pass
+
+
+def http2_enabled():
+    """是否使用 HTTP/2 传输，未安装 httpx/h2 时回退到 HTTP/1.1"""
+    global _http2_available
+    if not HTTP2:
+        return False
+    if _http2_available is None:
+        try:
+            import httpx  # noqa: F401
+            import h2  # noqa: F401
+            _http2_available = True
+        except ImportError:
+            _http2_available = False
+            logger.info("[Bailian] 未安装 httpx[http2]，使用 HTTP/1.1 传输")
+    return _http2_available
+
+
+def _is_http2_session(session):
+    # httpx.AsyncClient 与 aiohttp.ClientSession 的接口不同，按类型分别处理
+    return hasattr(session, "aclose")
+
+
+def _is_closed(session):
+    return session.is_closed if _is_http2_session(session) else session.closed
+
+
+def _get_session():
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is not None and not _is_closed(session):
+        return session
+
+    if http2_enabled():
+        import httpx
+        # 连接建立期间的并发请求会复用同一个 HTTP/2 连接；回退到 HTTP/1.1 时仍然可以打开 POOL_LIMIT 个连接
+        session = httpx.AsyncClient(
+            http2=True,
+            http1=not HTTP2_PRIOR_KNOWLEDGE,
+            limits=httpx.Limits(max_connections=POOL_LIMIT, max_keepalive_connections=POOL_LIMIT),
+            timeout=httpx.Timeout(connect=CONNECT_TIMEOUT, read=READ_TIMEOUT, write=READ_TIMEOUT, pool=None),
+        )
+    else:
+        # 不设置会话级的总超时，整体耗时由调用方的 deadline 控制
+        session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=POOL_LIMIT, ttl_dns_cache=300),
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=CONNECT_TIMEOUT, sock_read=READ_TIMEOUT),
+        )
+    _sessions[loop] = session
+    return session
+
+
+def _timeout(deadline):
+    """单次请求的超时：连接/读取各自有上限，总时长不超过 deadline 的剩余预算"""
+    if deadline is None:
+        return aiohttp.ClientTimeout(total=None, sock_connect=CONNECT_TIMEOUT, sock_read=READ_TIMEOUT)
+    remaining = max(deadline.remaining(), 0.1)
+    return aiohttp.ClientTimeout(
+        total=remaining,
+        sock_connect=min(CONNECT_TIMEOUT, remaining),
+        sock_read=min(READ_TIMEOUT, remaining),
+    )
+
+
+class Response:
+    """一次请求的状态码、响应头（键为小写）和响应体"""
+
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    @property
+    def text(self):
+        return self.body.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json_module.loads(self.body)
+
+
+def _form_data(fields, files):
+    """aiohttp 的 multipart 表单，普通字段在前、文件在后（OSS 表单上传要求 file 是最后一个字段）"""
+    form = aiohttp.FormData()
+    for name, value in (fields or {}).items():
+        form.add_field(name, str(value))
+    for name, (filename, content, content_type) in (files or {}).items():
+        form.add_field(name, content, filename=filename, content_type=content_type)
+    return form
+
+
+async def _http2_fetch(session, method, url, headers, json, deadline, fields, files):
+    import httpx
+
+    try:
+        # httpx 没有总超时，用 deadline 的剩余预算限制整个请求
+        timeout = max(deadline.remaining(), 0.1) if deadline is not None else None
+        request = session.request(method, url, headers=headers, json=json, data=fields, files=files)
+        response = await asyncio.wait_for(request, timeout)
+    except (httpx.HTTPError, asyncio.TimeoutError) as e:
+        raise TransportError(str(e) or type(e).__name__) from e
+    return Response(response.status_code, {k.lower(): v for k, v in response.headers.items()}, response.content)
+
+
+async def fetch(method, url, headers=None, json=None, deadline=None, fields=None, files=None):
+    """发送请求并读取完整响应，不检查状态码，网络错误时抛出 TransportError
+
+    fields/files 用于 multipart 表单上传，files 为 {字段名: (文件名, 内容, Content-Type)}
+    """
+    session = _get_session()
+    if _is_http2_session(session):
+        return await _http2_fetch(session, method, url, headers, json, deadline, fields, files)
+    data = _form_data(fields, files) if fields or files else None
+    try:
+        async with session.request(method, url, headers=headers, json=json, data=data, timeout=_timeout(deadline)) as response:
+            body = await response.read()
+            return Response(response.status, {k.lower(): v for k, v in response.headers.items()}, body)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        raise TransportError(str(e) or type(e).__name__) from e
+
+
+class StreamResponse:
+    """流式读取的响应：状态码、响应头（键为小写），响应体通过 iter_chunks 逐块读取"""
+
+    def __init__(self, status, headers, chunks, errors):
+        self.status = status
+        self.headers = headers
+        self._chunks = chunks
+        # 底层库的网络错误类型，读取时转换为 TransportError
+        self._errors = errors
+
+    async def iter_chunks(self, size):
+        """逐块读取响应体，每块不超过 size 字节，网络错误时抛出 TransportError"""
+        try:
+            async for chunk in self._chunks(size):
+                if chunk:
+                    yield chunk
+        except self._errors as e:
+            raise TransportError(str(e) or type(e).__name__) from e
+
+
+@asynccontextmanager
+async def stream(method, url, headers=None, deadline=None):
+    """发送请求并以流的方式读取响应体，内存中只保留当前读取的块
+
+    非 200 时抛出 APIError，网络错误时抛出 TransportError；deadline 限制包括读取响应体在内的整个请求
+    """
+    session = _get_session()
+    if _is_http2_session(session):
+        import httpx
+        try:
+            timeout = max(deadline.remaining(), 0.1) if deadline is not None else None
+            context = session.stream(method, url, headers=headers)
+            response = await asyncio.wait_for(context.__aenter__(), timeout)
+        except (httpx.HTTPError, asyncio.TimeoutError) as e:
+            raise TransportError(str(e) or type(e).__name__) from e
+        try:
+            if response.status_code != 200:
+                raise APIError(response.status_code, (await response.aread()).decode("utf-8", errors="replace"))
+            yield StreamResponse(response.status_code, {k.lower(): v for k, v in response.headers.items()}, response.aiter_bytes, (httpx.HTTPError, asyncio.TimeoutError))
+        finally:
+            await context.__aexit__(None, None, None)
+        return
+
+    try:
+        context = session.request(method, url, headers=headers, timeout=_timeout(deadline))
+        response = await context.__aenter__()
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        raise TransportError(str(e) or type(e).__name__) from e
+    try:
+        if response.status != 200:
+            raise APIError(response.status, (await response.read()).decode("utf-8", errors="replace"))
+        yield StreamResponse(response.status, {k.lower(): v for k, v in response.headers.items()}, response.content.iter_chunked, (aiohttp.ClientError, asyncio.TimeoutError))
+    finally:
+        await context.__aexit__(None, None, None)
+
+
+async def request_bytes(method, url, headers=None, json=None, deadline=None):
+    """发送请求并返回响应体，非 200 时抛出 APIError，网络错误时抛出 TransportError"""
+    response = await fetch(method, url, headers=headers, json=json, deadline=deadline)
+    if response.status != 200:
+        raise APIError(response.status, response.text)
+    return response.body
+
+
+async def request_json(method, url, headers=None, json=None, deadline=None):
+    """发送请求并解析 JSON 响应，非 200 时抛出 APIError，网络错误时抛出 TransportError"""
+    response = await fetch(method, url, headers=headers, json=json, deadline=deadline)
+    if response.status != 200:
+        raise APIError(response.status, response.text)
+    return response.json()
+
+
+async def close():
+    """关闭当前事件循环的连接池"""
+    session = _sessions.pop(asyncio.get_running_loop(), None)
+    if session is None:
+        return
+    if _is_http2_session(session):
+        await session.aclose()
+    else:
+        await session.close()
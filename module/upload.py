@@ -0,0 +1,61 @@
+import time
+import uuid
+import threading
+
+from . import transport
+from .logging import logger
+
+
+POLICY_URL = "https://dashscope.aliyuncs.com/api/v1/uploads"
+
+# 使用 oss:// 临时文件时，提交任务需要带上这个请求头
+OSS_RESOLVE_HEADER = "X-DashScope-OssResourceResolve"
+
+_lock = threading.Lock()
+_policies = {}
+
+
+async def _get_policy(model, api_key, deadline):
+    """获取 DashScope 临时存储空间的上传凭证，按 (api_key, model) 缓存到过期前一分钟"""
+    key = (api_key, model)
+    with _lock:
+        entry = _policies.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            return entry[1]
+
+    headers = {
+        "Authorization": f"Bearer {api_key}" if api_key else "",
+        "Content-Type": "application/json",
+    }
+    url = f"{POLICY_URL}?action=getPolicy&model={model}"
+    policy = (await transport.request_json("GET", url, headers=headers, deadline=deadline))["data"]
+    expires_at = time.monotonic() + max(float(policy.get("expire_in_seconds", 300)) - 60, 0)
+    with _lock:
+        _policies[key] = (expires_at, policy)
+    return policy
+
+
+async def upload_bytes(data, filename, content_type, model, api_key, deadline=None):
+    """上传文件到 DashScope 临时存储空间（有效期 48 小时），返回 oss:// 地址
+
+    使用该地址提交任务时请求头需要包含 OSS_RESOLVE_HEADER: enable
+    """
+    policy = await _get_policy(model, api_key, deadline)
+    key = f"{policy['upload_dir']}/{uuid.uuid4().hex}-{filename}"
+    fields = {
+        "OSSAccessKeyId": policy["oss_access_key_id"],
+        "Signature": policy["signature"],
+        "policy": policy["policy"],
+        "x-oss-object-acl": policy["x_oss_object_acl"],
+        "x-oss-forbid-overwrite": policy["x_oss_forbid_overwrite"],
+        "key": key,
+        "success_action_status": "200",
+    }
+    response = await transport.fetch(
+        "POST", policy["upload_host"], deadline=deadline,
+        fields=fields, files={"file": (filename, data, content_type)},
+    )
+    if response.status != 200:
+        raise transport.APIError(response.status, response.text)
+    logger.info(f"[BailianUpload] 已上传 {filename} ({len(data) / 1024:.0f}KB)")
+    return f"oss://{key}"
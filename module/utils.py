@@ -1,12 +1,32 @@
 from datetime import datetime
-import torch
-import numpy as np
 from pathlib import Path
 import os
-from PIL import Image, ImageOps
 
-from comfy.model_management import get_torch_device
-DEVICE = get_torch_device()
+from .lazy import lazy_import
+
+# torch、numpy、PIL 在第一次使用时才导入，插件加载时不需要这些重量级模块
+torch = lazy_import("torch")
+np = lazy_import("numpy")
+Image = lazy_import("PIL.Image")
+ImageOps = lazy_import("PIL.ImageOps")
+
+_device = None
+
+
+def get_device():
+    """第一次使用时才查询 ComfyUI 的计算设备"""
+    global _device
+    if _device is None:
+        from comfy.model_management import get_torch_device
+        _device = get_torch_device()
+    return _device
+
+
+def __getattr__(name):
+    # 兼容旧代码中的 utils.DEVICE
+    if name == "DEVICE":
+        return get_device()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 #if img length is not a multiple of 8, then return the length divided by 8
@@ -59,7 +79,9 @@ def cropimage(img, x, y):
 
 # Convert PIL to Tensor
 # 图片转张量
-def pil2tensor(image, device=DEVICE):
+def pil2tensor(image, device=None):
+    if device is None:
+        device = get_device()
     if isinstance(image, Image.Image):
         img = np.array(image)
     else:
@@ -105,14 +127,22 @@ def tensor2pil2(image):
     return img
 
 
+# pil to numpy
+# 图片转 float32 像素数组 (h, w, 3)，按 EXIF 方向旋转
+def pil2numpy(img):
+    img = ImageOps.exif_transpose(img)
+    image = img.convert("RGB")
+    return np.array(image).astype(np.float32) / 255.0
+
+# numpy to comfy
+# 像素数组转comfy格式 (h, w, 3) -> (1, h, w, 3)，与数组共享内存（包括 mmap 的数组），不复制
+def numpy2comfy(pixels):
+    return torch.from_numpy(pixels)[None,]
+
 # pil to comfy
 # 图片转comfy格式 (i, 3, w, h) -> (i, h, w, 3)
 def pil2comfy(img):
-    img = ImageOps.exif_transpose(img)
-    image = img.convert("RGB")
-    image = np.array(image).astype(np.float32) / 255.0
-    image = torch.from_numpy(image)[None,]
-    return image
+    return numpy2comfy(pil2numpy(img))
 
 font_path='arial.ttf'
 
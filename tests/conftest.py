@@ -0,0 +1,22 @@
+import os
+import sys
+import importlib.util
+
+import pytest
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_module(name):
+    """不经过 ComfyUI 直接加载插件的子模块（与 benchmarks/micro.py 相同，不执行插件的 __init__）"""
+    if "bailian_plugin" not in sys.modules:
+        spec = importlib.util.spec_from_file_location("bailian_plugin", os.path.join(ROOT, "__init__.py"), submodule_search_locations=[ROOT])
+        sys.modules["bailian_plugin"] = importlib.util.module_from_spec(spec)
+    from importlib import import_module
+    return import_module(f"bailian_plugin.module.{name}")
+
+
+@pytest.fixture
+def plugin():
+    return load_module
@@ -0,0 +1,71 @@
+import time
+import asyncio
+
+import pytest
+
+
+@pytest.fixture
+def adaptive(plugin, monkeypatch):
+    adaptive = plugin("adaptive")
+    monkeypatch.setattr(adaptive, "ENABLED", True)
+    monkeypatch.setattr(adaptive, "INITIAL_LIMIT", 16)
+    return adaptive
+
+
+def _warm_up(limiter, latency):
+    for _ in range(10):
+        limiter.on_success(time.monotonic(), latency)
+
+
+def test_small_absolute_latency_change_is_not_a_spike(adaptive):
+    limiter = adaptive.AIMDLimiter("e")
+    _warm_up(limiter, 0.001)
+    # 10 倍于基线，但只多出 9 毫秒
+    limiter.on_success(time.monotonic(), 0.010)
+    assert limiter.limit == 16
+    assert limiter.stats()["latency_spikes"] == 0
+
+
+def test_sustained_latency_shift_becomes_the_new_baseline(adaptive):
+    limiter = adaptive.AIMDLimiter("e")
+    _warm_up(limiter, 0.1)
+    for _ in range(50):
+        limiter.on_success(time.monotonic(), 1.0)
+    stats = limiter.stats()
+    # 只在基线跟上之前下调几次，之后不再视为突增
+    assert 0 < stats["decreases"] <= 3
+    assert stats["baseline_latency"] > 0.9
+    spikes = stats["latency_spikes"]
+    limiter.on_success(time.monotonic(), 1.0)
+    assert limiter.stats()["latency_spikes"] == spikes
+
+
+def test_task_slot_covers_nested_submits(adaptive):
+    endpoint = "http://example.com/nested"
+
+    async def scenario():
+        async with adaptive.slot(endpoint):
+            # 任务期间的提交请求（包括 refiner）不再占用第二个名额
+            async with adaptive.slot(endpoint):
+                return adaptive.get_limiter(endpoint).in_flight
+
+    assert asyncio.run(scenario()) == 1
+    assert adaptive.get_limiter(endpoint).in_flight == 0
+
+
+def test_limit_bounds_tasks_in_flight(adaptive):
+    endpoint = "http://example.com/bounded"
+    limiter = adaptive.get_limiter(endpoint)
+    limiter.limit = 2
+    peak = []
+
+    async def task():
+        async with adaptive.slot(endpoint):
+            peak.append(limiter.in_flight)
+            await asyncio.sleep(0.05)
+
+    async def scenario():
+        await asyncio.gather(*[task() for _ in range(6)])
+
+    asyncio.run(scenario())
+    assert max(peak) == 2
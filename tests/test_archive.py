@@ -0,0 +1,105 @@
+import os
+import asyncio
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+
+PART_SIZE = 256 * 1024
+LARGE = os.urandom(PART_SIZE * 3 + 1000)
+SMALL = os.urandom(1000)
+
+
+def _app():
+    async def large(request):
+        # 分块写出，模拟逐步到达的响应
+        response = web.StreamResponse(headers={"Content-Type": "image/png"})
+        await response.prepare(request)
+        for start in range(0, len(LARGE), 64 * 1024):
+            await response.write(LARGE[start:start + 64 * 1024])
+        return response
+
+    async def small(request):
+        return web.Response(body=SMALL, content_type="image/jpeg")
+
+    app = web.Application()
+    app.router.add_get("/large.png", large)
+    app.router.add_get("/small.jpg", small)
+    return app
+
+
+@pytest.fixture
+def archive(plugin, monkeypatch):
+    archive = plugin("archive")
+    monkeypatch.setattr(archive, "PART_SIZE", PART_SIZE)
+    yield archive
+    archive.set_store(None)
+
+
+def _run(archive, scenario):
+    transport = archive.transport
+
+    async def main():
+        async with TestServer(_app()) as server:
+            try:
+                return await scenario(lambda path: str(server.make_url(path)))
+            finally:
+                await transport.close()
+
+    return asyncio.run(main())
+
+
+def test_relay_uploads_large_images_in_parts(archive):
+    store = archive.MemoryStore()
+    parts = []
+    upload_part = store.upload_part
+    store.upload_part = lambda key, upload_id, number, data: parts.append(len(data)) or upload_part(key, upload_id, number, data)
+
+    size = _run(archive, lambda url: archive.relay(url("/large.png"), "results/large.png", store))
+    assert size == len(LARGE)
+    assert store.objects["results/large.png"] == LARGE
+    assert parts == [PART_SIZE, PART_SIZE, PART_SIZE, 1000]
+    # 完成后没有遗留的分片上传
+    assert store._uploads == {}
+
+
+def test_relay_puts_small_images_directly(archive):
+    store = archive.MemoryStore()
+    size = _run(archive, lambda url: archive.relay(url("/small.jpg"), "results/small.jpg", store))
+    assert size == len(SMALL)
+    assert store.objects["results/small.jpg"] == SMALL
+
+
+def test_failed_upload_aborts_multipart(archive):
+    class FailingStore(archive.MemoryStore):
+        def upload_part(self, key, upload_id, number, data):
+            if number == 2:
+                raise RuntimeError("upload failed")
+            return super().upload_part(key, upload_id, number, data)
+
+    store = FailingStore()
+    with pytest.raises(RuntimeError):
+        _run(archive, lambda url: archive.relay(url("/large.png"), "results/large.png", store))
+    assert store.objects == {}
+    assert store._uploads == {}
+
+
+def test_archive_result_records_object_urls_and_errors(archive):
+    store = archive.MemoryStore("bucket")
+    archive.set_store(store)
+
+    async def scenario(url):
+        succeeded = {"output": {"task_status": "SUCCEEDED", "results": [{"url": url("/large.png")}, {"url": url("/small.jpg")}]}}
+        missing = {"output": {"task_status": "SUCCEEDED", "image_url": url("/missing.png")}}
+        failed = {"output": {"task_status": "FAILED", "image_url": url("/small.jpg")}}
+        await asyncio.gather(*[archive.archive_result(data) for data in (succeeded, missing, failed)])
+        return succeeded, missing, failed
+
+    succeeded, missing, failed = _run(archive, scenario)
+    assert len(succeeded["archive"]) == 2
+    assert all(url.startswith("oss://bucket/bailian-results/") for url in succeeded["archive"])
+    assert sorted(store.objects.values(), key=len) == [SMALL, LARGE]
+    assert "archive" not in missing and "404" in missing["archive_error"]
+    # 失败的任务不转存
+    assert "archive" not in failed and "archive_error" not in failed
@@ -0,0 +1,61 @@
+import os
+import json
+
+import pytest
+
+
+@pytest.fixture
+def batch_job(plugin, monkeypatch, tmp_path):
+    batch_job = plugin("batch_job")
+    # 脱离 ComfyUI 运行时路径相对于当前目录
+    monkeypatch.chdir(tmp_path)
+    return batch_job
+
+
+def _write(path, lines, trailing=""):
+    path.write_text("".join(line + "\n" for line in lines) + trailing, encoding="utf-8")
+
+
+def test_resolve_path_stays_inside_the_directory(batch_job, tmp_path):
+    assert batch_job.resolve_path(" results/out.ndjson ", "output") == os.path.join(os.path.realpath(tmp_path), "results", "out.ndjson")
+    for path in ("/etc/passwd", "~/.bashrc", "../outside.ndjson", "results/../../outside.ndjson", "", "."):
+        with pytest.raises(ValueError):
+            batch_job.resolve_path(path, "output")
+
+
+def test_resolve_path_rejects_symlinks_out_of_the_directory(batch_job, tmp_path):
+    outside = tmp_path.parent / f"{tmp_path.name}-outside"
+    outside.mkdir()
+    os.symlink(outside, tmp_path / "link")
+    with pytest.raises(ValueError):
+        batch_job.resolve_path("link/out.ndjson", "output")
+
+
+def test_load_completed_truncates_partial_last_line(batch_job, tmp_path):
+    output = tmp_path / "out.ndjson"
+    lines = [json.dumps({"index": 0, "result": {"output": {}}}), json.dumps({"index": 1, "result": {"error": "failed"}})]
+    _write(output, lines, trailing='{"index": 2, "res')
+    assert batch_job.load_completed(str(output), retry_failed=False) == {0, 1}
+    assert output.read_text(encoding="utf-8") == "".join(line + "\n" for line in lines)
+    assert batch_job.load_completed(str(output), retry_failed=True) == {0}
+
+
+def test_load_completed_skips_malformed_lines(batch_job, tmp_path):
+    output = tmp_path / "out.ndjson"
+    _write(output, [
+        json.dumps({"index": 0, "result": {}}),
+        "not json",
+        json.dumps([1, 2]),
+        json.dumps({"result": {}}),
+        json.dumps({"index": 3, "result": "unexpected"}),
+    ])
+    assert batch_job.load_completed(str(output), retry_failed=True) == {0, 3}
+
+
+def test_load_completed_refuses_other_files(batch_job, tmp_path):
+    for name, content in (("notes.txt", "line one\nline two\n"), ("config.ini", "[section]\nkey = value")):
+        path = tmp_path / name
+        path.write_text(content, encoding="utf-8")
+        with pytest.raises(ValueError):
+            batch_job.load_completed(str(path), retry_failed=False)
+        assert path.read_text(encoding="utf-8") == content
@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+
+TOKEN = "local-token"
+
+
+@pytest.fixture
+def callback(plugin, monkeypatch):
+    callback = plugin("callback")
+    coordination = plugin("coordination")
+    monkeypatch.setattr(callback, "ENABLED", True)
+    monkeypatch.setattr(callback, "TOKEN", TOKEN)
+    # 本地替身：用进程内的协调后端代替 Redis
+    backend = coordination.MemoryBackend()
+    coordination.set_backend(backend)
+    yield callback
+    coordination.set_backend(None)
+
+
+async def _post(callback, payload, headers=None, path=None):
+    app = web.Application()
+    app.router.add_post(callback.ROUTE_PATH, callback.handle_callback)
+    async with TestClient(TestServer(app)) as client:
+        response = await client.post(path or callback.ROUTE_PATH, json=payload, headers=headers or {})
+        return response.status, await response.json()
+
+
+def _payload(task_id, status="SUCCEEDED"):
+    return {"output": {"task_id": task_id, "task_status": status, "image_url": f"http://example.com/{task_id}.jpg"}}
+
+
+def test_callback_rejects_missing_or_wrong_token(callback):
+    status, body = asyncio.run(_post(callback, _payload("task-1")))
+    assert status == 403
+    status, body = asyncio.run(_post(callback, _payload("task-1"), {"X-Bailian-Callback-Token": "wrong"}))
+    assert status == 403
+    assert callback.take("task-1") is None
+
+
+def test_callback_rejects_everything_without_configured_token(callback, monkeypatch):
+    monkeypatch.setattr(callback, "TOKEN", "")
+    status, _ = asyncio.run(_post(callback, _payload("task-2"), {"X-Bailian-Callback-Token": ""}))
+    assert status == 403
+    assert callback.take("task-2") is None
+
+
+def test_callback_wakes_waiting_poll(callback, plugin):
+    coordination = plugin("coordination")
+
+    async def scenario():
+        waiting = asyncio.ensure_future(callback.async_wait("task-3", 10))
+        await asyncio.sleep(0.05)
+        status, body = await _post(callback, _payload("task-3"), path=f"{callback.ROUTE_PATH}?token={TOKEN}")
+        await asyncio.wait_for(waiting, 2)
+        return status, body, await coordination.cached_result("task-3")
+
+    status, body, shared = asyncio.run(scenario())
+    assert status == 200
+    assert body == {"received": ["task-3"]}
+    assert callback.take("task-3")["output"]["image_url"] == "http://example.com/task-3.jpg"
+    # 其他进程可以从协调后端拿到结果
+    assert shared["output"]["task_status"] == "SUCCEEDED"
+
+
+def test_callback_accepts_cloudevents_batch(callback):
+    events = [{"specversion": "1.0", "data": _payload("task-4")}, {"data": _payload("task-5", "RUNNING")}]
+    status, body = asyncio.run(_post(callback, events, {"X-Bailian-Callback-Token": TOKEN}))
+    assert status == 200
+    assert body == {"received": ["task-4", "task-5"]}
+    assert callback.take("task-4")["output"]["task_status"] == "SUCCEEDED"
+    # 未结束的任务只确认收到，不当作结果
+    assert callback.take("task-5") is None
@@ -0,0 +1,143 @@
+import asyncio
+
+import pytest
+
+
+ENDPOINT = "http://example.com/submit"
+REQUEST = {"model": "aitryon", "input": {"person_image_url": "http://example.com/person.jpg"}}
+
+
+def _headers(api_key):
+    return {"X-DashScope-Async": "enable", "Authorization": f"Bearer {api_key}"}
+
+
+@pytest.fixture
+def coordination(plugin, monkeypatch):
+    coordination = plugin("coordination")
+    monkeypatch.setattr(coordination, "DEDUPE", True)
+    # 同一个进程内的 MemoryBackend 代替多个进程共享的 Redis
+    coordination.set_backend(coordination.MemoryBackend())
+    yield coordination
+    coordination.set_backend(None)
+
+
+class Worker:
+    """模拟一个 ComfyUI 进程：send() 提交任务，提交请求耗时 delay 秒"""
+
+    def __init__(self, name, delay=0.0):
+        self.name = name
+        self.delay = delay
+        self.submitted = []
+
+    async def send(self):
+        await asyncio.sleep(self.delay)
+        task_id = f"{self.name}-task-{len(self.submitted) + 1}"
+        self.submitted.append(task_id)
+        return {"output": {"task_id": task_id, "task_status": "PENDING"}}
+
+
+def test_work_key_is_scoped_to_the_api_key(coordination, monkeypatch):
+    key = coordination.work_key(ENDPOINT, _headers("a"), REQUEST)
+    assert key == coordination.work_key(ENDPOINT, _headers("a"), REQUEST)
+    assert key != coordination.work_key(ENDPOINT, _headers("b"), REQUEST)
+    assert key != coordination.work_key(ENDPOINT, _headers("a"), REQUEST, slot=1)
+    monkeypatch.setattr(coordination, "DEDUPE", False)
+    assert coordination.work_key(ENDPOINT, _headers("a"), REQUEST) is None
+
+
+def test_concurrent_workers_share_one_task(coordination):
+    first, second = Worker("first", delay=0.2), Worker("second")
+    key = coordination.work_key(ENDPOINT, _headers("a"), REQUEST)
+
+    async def scenario():
+        submitting = asyncio.ensure_future(coordination.submit(key, first.send))
+        await asyncio.sleep(0.05)
+        # 第二个进程在第一个进程拿到 task_id 之前提交，等待后复用它的任务
+        return await submitting, await coordination.submit(key, second.send)
+
+    owner, shared = asyncio.run(scenario())
+    assert first.submitted == ["first-task-1"]
+    assert second.submitted == []
+    assert shared["output"]["task_id"] == owner["output"]["task_id"]
+    assert shared["coordination"] == "shared"
+
+
+def test_claim_is_kept_while_the_owner_waits(coordination, monkeypatch):
+    # 提交方等待配额和并发名额的时间超过占用时间，占用在此期间续期，第二个进程不会重复提交
+    monkeypatch.setattr(coordination, "_CLAIM_TTL", 0.15)
+    first, second = Worker("first", delay=0.5), Worker("second")
+    key = coordination.work_key(ENDPOINT, _headers("a"), REQUEST)
+
+    async def scenario():
+        submitting = asyncio.ensure_future(coordination.submit(key, first.send))
+        await asyncio.sleep(0.3)
+        shared = await coordination.submit(key, second.send)
+        return await submitting, shared
+
+    owner, shared = asyncio.run(scenario())
+    assert second.submitted == []
+    assert shared["output"]["task_id"] == owner["output"]["task_id"]
+
+
+def test_other_api_keys_submit_their_own_task(coordination):
+    first, second = Worker("first"), Worker("second")
+
+    async def scenario():
+        await coordination.submit(coordination.work_key(ENDPOINT, _headers("a"), REQUEST), first.send)
+        return await coordination.submit(coordination.work_key(ENDPOINT, _headers("b"), REQUEST), second.send)
+
+    assert asyncio.run(scenario())["output"]["task_id"] == "second-task-1"
+
+
+def test_forgotten_and_expired_tasks_are_resubmitted(coordination, monkeypatch):
+    worker = Worker("worker")
+    key = coordination.work_key(ENDPOINT, _headers("a"), REQUEST)
+
+    async def scenario():
+        first = await coordination.submit(key, worker.send)
+        await coordination.forget_task(first["output"]["task_id"])
+        monkeypatch.setattr(coordination, "TASK_TTL", 0.05)
+        second = await coordination.submit(key, worker.send)
+        third = await coordination.submit(key, worker.send)
+        await asyncio.sleep(0.1)
+        fourth = await coordination.submit(key, worker.send)
+        return [result["output"]["task_id"] for result in (first, second, third, fourth)]
+
+    assert asyncio.run(scenario()) == ["worker-task-1", "worker-task-2", "worker-task-2", "worker-task-3"]
+
+
+def test_failed_submit_releases_the_claim(coordination):
+    worker = Worker("worker")
+    key = coordination.work_key(ENDPOINT, _headers("a"), REQUEST)
+
+    async def failing():
+        raise RuntimeError("connection reset")
+
+    async def scenario():
+        with pytest.raises(RuntimeError):
+            await coordination.submit(key, failing)
+        return await coordination.submit(key, worker.send)
+
+    assert asyncio.run(scenario())["output"]["task_id"] == "worker-task-1"
+
+
+def test_results_are_shared_between_workers(coordination):
+    async def scenario():
+        await coordination.store_result("task-1", {"output": {"task_id": "task-1", "task_status": "SUCCEEDED"}})
+        return await coordination.cached_result("task-1"), await coordination.cached_result("task-2")
+
+    stored, missing = asyncio.run(scenario())
+    assert stored["output"]["task_status"] == "SUCCEEDED"
+    assert missing is None
+
+
+def test_memory_backend_token_bucket(coordination):
+    backend = coordination.MemoryBackend()
+
+    async def scenario():
+        return [await backend.take_token("submit", 10, 2) for _ in range(3)]
+
+    first, second, third = asyncio.run(scenario())
+    assert first == 0 and second == 0
+    # 突发额度用完后约 1/rate 秒才有下一个令牌
+    assert 0 < third <= 0.1
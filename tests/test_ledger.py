@@ -0,0 +1,171 @@
+import asyncio
+
+import pytest
+
+
+HEADERS = {"X-DashScope-Async": "enable", "Authorization": "Bearer key"}
+REQUEST = {"model": "aitryon", "input": {"person_image_url": "http://example.com/person.jpg"}}
+
+
+@pytest.fixture
+def ledger(plugin, monkeypatch, tmp_path):
+    ledger = plugin("ledger")
+    monkeypatch.setattr(ledger, "ENABLED", True)
+    monkeypatch.setattr(ledger, "LEDGER_PATH", str(tmp_path / "ledger.sqlite3"))
+    monkeypatch.setattr(ledger, "_ledger", None)
+    return ledger
+
+
+class FakeDashScope:
+    """记录提交次数的 send()，每次提交创建一个新任务"""
+
+    def __init__(self, fail_with=None):
+        self.fail_with = fail_with
+        self.submitted = []
+
+    async def send(self):
+        if self.fail_with is not None:
+            error, self.fail_with = self.fail_with, None
+            raise error
+        task_id = f"task-{len(self.submitted) + 1}"
+        self.submitted.append(task_id)
+        return {"output": {"task_id": task_id, "task_status": "PENDING"}}
+
+
+def _submit(ledger, key, dashscope):
+    return ledger.submit(key, "http://example.com/submit", HEADERS, REQUEST, None, dashscope.send)
+
+
+def test_idempotency_key_depends_on_scope_and_slot(ledger):
+    key = ledger.idempotency_key("e", HEADERS, REQUEST, scope=["batch", "out.jsonl"], slot=1)
+    assert key == ledger.idempotency_key("e", HEADERS, REQUEST, scope=["batch", "out.jsonl"], slot=1)
+    assert key != ledger.idempotency_key("e", HEADERS, REQUEST, scope=["batch", "out.jsonl"], slot=2)
+    # 同步调用不经过账本
+    assert ledger.idempotency_key("e", {}, REQUEST, scope=["batch"]) is None
+
+
+def test_idempotency_key_is_per_node_and_credential(ledger, plugin):
+    context = plugin("context")
+    key = ledger.idempotency_key("e", HEADERS, REQUEST, unique_id="7")
+
+    async def requeued():
+        # 重新排队的工作流 prompt_id 不同，键不变
+        return ledger.idempotency_key("e", HEADERS, REQUEST, unique_id="7")
+
+    assert asyncio.run(context.bind_execution(requeued(), "BailianAPI", "7", "prompt-2")) == key
+    assert ledger.idempotency_key("e", HEADERS, REQUEST, unique_id="8") != key
+    other = dict(HEADERS, Authorization="Bearer other")
+    assert ledger.idempotency_key("e", other, REQUEST, unique_id="7") != key
+    # 没有节点 ID 也没有 scope 时无法区分调用方，不经过账本
+    assert ledger.idempotency_key("e", HEADERS, REQUEST) is None
+
+
+def test_resubmit_reuses_recorded_task(ledger):
+    dashscope = FakeDashScope()
+
+    async def scenario():
+        first = await _submit(ledger, "key-1", dashscope)
+        second = await _submit(ledger, "key-1", dashscope)
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert dashscope.submitted == ["task-1"]
+    assert second["output"]["task_id"] == first["output"]["task_id"]
+    assert second["ledger"] == "reused"
+
+
+def test_forgotten_task_is_submitted_again(ledger):
+    dashscope = FakeDashScope()
+
+    async def scenario():
+        await _submit(ledger, "key-2", dashscope)
+        await ledger.forget_task("task-1")
+        return await _submit(ledger, "key-2", dashscope)
+
+    assert asyncio.run(scenario())["output"]["task_id"] == "task-2"
+
+
+def test_rejected_request_leaves_no_record(ledger, plugin):
+    transport = plugin("transport")
+    dashscope = FakeDashScope(fail_with=transport.APIError(400, "InvalidParameter"))
+
+    async def scenario():
+        with pytest.raises(transport.APIError):
+            await _submit(ledger, "key-3", dashscope)
+        return await asyncio.to_thread(ledger.get_ledger().get, "key-3")
+
+    assert asyncio.run(scenario()) is None
+
+
+def _timed_out(ledger, transport, monkeypatch, listed_tasks):
+    """第一次提交超时，任务列表返回 listed_tasks"""
+    listed = []
+
+    async def recent_tasks(model, start, end, headers, deadline):
+        listed.append(model)
+        return listed_tasks
+
+    monkeypatch.setattr(ledger, "_recent_tasks", recent_tasks)
+    return FakeDashScope(fail_with=transport.TransportError("read timeout")), listed
+
+
+def test_unknown_outcome_resubmits_when_no_task_was_created(ledger, plugin, monkeypatch):
+    transport = plugin("transport")
+    dashscope, listed = _timed_out(ledger, transport, monkeypatch, [])
+
+    async def scenario():
+        with pytest.raises(transport.TransportError):
+            await _submit(ledger, "key-4", dashscope)
+        # 发送结果未知，记录保留为 pending
+        pending = await asyncio.to_thread(ledger.get_ledger().get, "key-4")
+        retried = await _submit(ledger, "key-4", dashscope)
+        reused = await _submit(ledger, "key-4", dashscope)
+        return pending, retried, reused
+
+    pending, retried, reused = asyncio.run(scenario())
+    assert pending["task_id"] is None
+    assert listed == ["aitryon"]
+    assert retried["output"]["task_id"] == "task-1"
+    assert "ledger" not in retried
+    assert reused["output"]["task_id"] == "task-1"
+    assert dashscope.submitted == ["task-1"]
+
+
+def test_unknown_outcome_with_unclaimed_tasks_refuses_to_resubmit(ledger, plugin, monkeypatch):
+    transport = plugin("transport")
+    # 时间窗口内的任务可能由超时的提交创建，也可能属于其他进程或其他用户
+    dashscope, listed = _timed_out(ledger, transport, monkeypatch, ["unclaimed-task"])
+
+    async def scenario():
+        with pytest.raises(transport.TransportError):
+            await _submit(ledger, "key-5", dashscope)
+        with pytest.raises(ledger.UnknownSubmission, match="unclaimed-task"):
+            await _submit(ledger, "key-5", dashscope)
+
+    asyncio.run(scenario())
+    assert dashscope.submitted == []
+
+
+def test_unknown_outcome_resubmits_with_override(ledger, plugin, monkeypatch):
+    transport = plugin("transport")
+    dashscope, listed = _timed_out(ledger, transport, monkeypatch, ["unclaimed-task"])
+    monkeypatch.setattr(ledger, "RESUBMIT_UNKNOWN", True)
+
+    async def scenario():
+        with pytest.raises(transport.TransportError):
+            await _submit(ledger, "key-6", dashscope)
+        return await _submit(ledger, "key-6", dashscope)
+
+    assert asyncio.run(scenario())["output"]["task_id"] == "task-1"
+    assert dashscope.submitted == ["task-1"]
+
+
+def test_concurrent_submits_share_one_task(ledger):
+    dashscope = FakeDashScope()
+
+    async def scenario():
+        return await asyncio.gather(_submit(ledger, "key-7", dashscope), _submit(ledger, "key-7", dashscope))
+
+    first, second = asyncio.run(scenario())
+    assert dashscope.submitted == ["task-1"]
+    assert first["output"]["task_id"] == second["output"]["task_id"] == "task-1"
@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+
+def _app():
+    async def submit(request):
+        body = await request.json()
+        return web.json_response({"output": {"task_id": "task-1", "task_status": "PENDING"}, "echo": body})
+
+    async def throttled(request):
+        return web.json_response({"code": "Throttling"}, status=429)
+
+    app = web.Application()
+    app.router.add_post("/submit", submit)
+    app.router.add_post("/throttled", throttled)
+    return app
+
+
+@pytest.fixture(params=[False, True], ids=["http1", "http2"])
+def transport(plugin, monkeypatch, request):
+    transport = plugin("transport")
+    monkeypatch.setattr(transport, "HTTP2", request.param)
+    monkeypatch.setattr(transport, "_http2_available", None)
+    if request.param:
+        pytest.importorskip("httpx")
+        pytest.importorskip("h2")
+    return transport
+
+
+def test_request_json_against_local_server(transport):
+    # 本地服务只支持 HTTP/1.1，开启 HTTP/2 时 httpx 按协商结果回退
+    async def scenario():
+        async with TestServer(_app()) as server:
+            try:
+                result = await transport.request_json("POST", str(server.make_url("/submit")), json={"model": "aitryon"})
+                with pytest.raises(transport.APIError) as error:
+                    await transport.request_json("POST", str(server.make_url("/throttled")), json={})
+                return result, error.value.status
+            finally:
+                await transport.close()
+
+    result, status = asyncio.run(scenario())
+    assert result["output"]["task_id"] == "task-1"
+    assert result["echo"] == {"model": "aitryon"}
+    assert status == 429
+
+
+def test_connection_error_is_transport_error(transport):
+    async def scenario():
+        try:
+            with pytest.raises(transport.TransportError):
+                await transport.request_json("GET", "http://127.0.0.1:1/unreachable")
+        finally:
+            await transport.close()
+
+    asyncio.run(scenario())